@@ -0,0 +1,51 @@
+import os
+import time
+import threading
+
+# =================================================================
+# Caché de Autorización de Administradores (en proceso, con TTL)
+# =================================================================
+
+ADMIN_AUTH_TTL = float(os.getenv('ADMIN_AUTH_TTL', '300'))
+
+class CacheAutorizacion:
+    """Guarda por telegram_id si el usuario es admin logueado, con expiración e invalidación explícita."""
+
+    def __init__(self, ttl=ADMIN_AUTH_TTL):
+        self.ttl = ttl
+        self._entradas = {}
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, telegram_id):
+        """Retorna True/False si hay una entrada vigente, o None si hay que consultar la DB."""
+        with self._lock:
+            entrada = self._entradas.get(telegram_id)
+            if entrada is not None and entrada[1] > time.monotonic():
+                self.aciertos += 1
+                return entrada[0]
+            self.fallos += 1
+            return None
+
+    def guardar(self, telegram_id, es_admin):
+        with self._lock:
+            self._entradas[telegram_id] = (es_admin, time.monotonic() + self.ttl)
+
+    def invalidar(self, *telegram_ids):
+        """Descarta las entradas de los telegram_id indicados (logout, degradación o re-vinculación)."""
+        with self._lock:
+            for telegram_id in telegram_ids:
+                if telegram_id is not None:
+                    self._entradas.pop(telegram_id, None)
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def estadisticas(self):
+        """Retorna (aciertos, fallos, entradas)."""
+        with self._lock:
+            return self.aciertos, self.fallos, len(self._entradas)
+
+CACHE_ADMIN = CacheAutorizacion()
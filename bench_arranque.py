@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+import signal
+import argparse
+import statistics
+import subprocess
+from bench_load import ProcesoApi, preparar_entorno, update_mensaje, TOKEN_MAIN, ID_SOCIO_BASE
+
+# =================================================================
+# Benchmark de Arranque (del proceso al primer update atendido)
+# =================================================================
+# Reproduce start.sh contra la Bot API simulada de bench_load.py: aplica las
+# migraciones (db_migrations.py, se reporta aparte) y lanza run_bots.py como
+# proceso nuevo. La Bot API tiene un /start pendiente en getUpdates del bot
+# principal; el tiempo de arranque va desde que se lanza el proceso (antes de
+# que el intérprete importe nada) hasta que llega el sendMessage de la respuesta.
+#
+# Uso: python bench_arranque.py [--repeticiones 5] [--database-url ...]
+# La primera repetición migra una base vacía; las siguientes reusan el esquema,
+# como un reinicio. Termina con exit 1 si algún arranque no respondió a tiempo.
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+def lanzar_script(script, verbose=False):
+    """Lanza un script del repo como proceso nuevo (su salida solo con verbose)."""
+    salida = None if verbose else subprocess.DEVNULL
+    return subprocess.Popen([sys.executable, os.path.join(DIRECTORIO, script)], cwd=DIRECTORIO, stdout=salida, stderr=salida)
+
+def detener_proceso(proceso):
+    """SIGTERM (cierre limpio de los bots) y, si no termina a tiempo, kill."""
+    if proceso.poll() is None:
+        proceso.send_signal(signal.SIGTERM)
+        try:
+            proceso.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proceso.kill()
+
+def medir_arranque(args):
+    """Lanza run_bots.py con un /start pendiente. Retorna los segundos hasta la respuesta, o None."""
+    api = ProcesoApi(args.latencia_api_ms / 1000, updates={TOKEN_MAIN: [update_mensaje(ID_SOCIO_BASE, '/start')]})
+    preparar_entorno(args, api.iniciar())
+
+    inicio = time.time()
+    bots = lanzar_script('run_bots.py', args.verbose)
+    fin = inicio + args.limite
+    respuesta = None
+    while respuesta is None and bots.poll() is None and time.time() < fin:
+        time.sleep(0.02)
+        respuesta, _ = api.estado()
+
+    detener_proceso(bots)
+    api.detener()
+    return None if respuesta is None else respuesta - inicio
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide el arranque de run_bots.py hasta el primer update atendido.")
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--latencia-api-ms', type=float, default=0, help="Demora de cada respuesta de la Bot API simulada.")
+    parser.add_argument('--database-url', default='', help="Por defecto, SQLite temporal.")
+    parser.add_argument('--limite', type=float, default=60, help="Segundos máximos por arranque.")
+    parser.add_argument('--verbose', action='store_true', help="Muestra la salida de los procesos.")
+    args = parser.parse_args()
+
+    # Deja fijado el entorno (DB de prueba y tokens falsos) antes de migrar.
+    preparar_entorno(args, 0)
+    inicio = time.perf_counter()
+    if lanzar_script('db_migrations.py', args.verbose).wait() != 0:
+        print("❌ db_migrations.py falló")
+        sys.exit(1)
+    print(f"DB: {args.database_url} | migraciones: {time.perf_counter() - inicio:.2f}s")
+
+    tiempos = []
+    for n in range(args.repeticiones):
+        segundos = medir_arranque(args)
+        print(f"Arranque {n + 1}: " + (f"{segundos:.2f}s hasta el primer update atendido" if segundos is not None else "sin respuesta"))
+        tiempos.append(segundos)
+
+    atendidos = [t for t in tiempos if t is not None]
+    if atendidos:
+        print(f"\nMediana: {statistics.median(atendidos):.2f}s | mín {min(atendidos):.2f}s | máx {max(atendidos):.2f}s")
+    if len(atendidos) < len(tiempos):
+        print(f"❌ {len(tiempos) - len(atendidos)} arranques no respondieron en {args.limite:.0f}s")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
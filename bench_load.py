@@ -0,0 +1,600 @@
+import os
+import sys
+import time
+import json
+import random
+import asyncio
+import logging
+import warnings
+import argparse
+import tempfile
+import itertools
+import multiprocessing
+from aiohttp import web
+
+# =================================================================
+# Harness de Carga (bot_main + bot_admin contra una Bot API simulada)
+# =================================================================
+# Levanta un servidor HTTP local que responde como la Bot API de Telegram, siembra
+# una base de datos temporal y envía Updates sintéticos a ambas Applications a
+# través de su update processor (con la misma concurrencia y orden por usuario
+# que en producción). Reporta throughput y p50/p95/p99 por paso de cada flujo.
+#
+# Uso: python bench_load.py [--usuarios 2000] [--admins 2] [--max-p99-ms 500]
+# Cada admin importa keys pegadas como texto y, con --archivos, también .txt/.csv
+# que la Bot API simulada sirve para descargar; se mide hasta que la importación
+# en segundo plano guardó todas las keys del archivo.
+# Con --estres-saldo N, una misma cuenta recibe N compras y N ajustes de cada uno
+# de dos admins a la vez, y al final se verifica que no se perdió ninguna escritura.
+# En SQLite la cola de escritura serializa todo lo de un proceso, así que la prueba
+# exige --procesos-estres (otros procesos que ajustan la misma cuenta) o un Postgres.
+# Con --compras-directas N no se usan los bots: mide compras/s de N compras con
+# ejecutar_db(comprar_key), --en-vuelo a la vez, cada una en su unidad de trabajo,
+# mientras otro proceso importa keys; con SQLITE_PERFIL=0 se obtiene la comparación
+# contra SQLite sin WAL ni cola de escritura.
+# Nunca usa el DATABASE_URL ni los tokens del entorno: por defecto crea una DB
+# SQLite temporal (--database-url permite apuntar a un Postgres de pruebas).
+
+TOKEN_MAIN = '100000:bench-main'
+TOKEN_ADMIN = '200000:bench-admin'
+ID_SOCIO_BASE = 10_000_000
+ID_ADMIN_BASE = 20_000_000
+ADMINS_ESTRES = 2
+
+def percentil(valores, p):
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    if not valores:
+        return 0.0
+    indice = max(0, min(len(valores) - 1, int(round(p / 100 * len(valores) + 0.5)) - 1))
+    return valores[indice]
+
+# --- Bot API Simulada ---
+class ApiTelegramFalsa:
+    """Servidor aiohttp que responde a /bot<token>/<método> como la Bot API."""
+
+    def __init__(self, latencia=0.0, archivos=None, updates=None):
+        self.latencia = latencia
+        self.archivos = archivos or {}
+        self.updates = updates or {}
+        self.llamadas = {}
+        self.primer_envio = None
+        self.envios = 0
+        self._ids_mensaje = itertools.count(1)
+        self._runner = None
+        self.puerto = None
+
+    async def iniciar(self):
+        app_web = web.Application(client_max_size=50 * 1024 * 1024)
+        app_web.router.add_post('/bot{token}/{metodo}', self._metodo)
+        app_web.router.add_get('/file/bot{token}/{ruta:.*}', self._archivo)
+        self._runner = web.AppRunner(app_web, access_log=None)
+        await self._runner.setup()
+        sitio = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await sitio.start()
+        self.puerto = sitio._server.sockets[0].getsockname()[1]
+
+    async def detener(self):
+        await self._runner.cleanup()
+
+    def _mensaje(self, chat_id, texto=''):
+        return {
+            'message_id': next(self._ids_mensaje), 'date': int(time.time()),
+            'chat': {'id': int(chat_id or 0), 'type': 'private'}, 'text': texto,
+        }
+
+    async def _metodo(self, request: web.Request) -> web.Response:
+        metodo = request.match_info['metodo']
+        self.llamadas[metodo] = self.llamadas.get(metodo, 0) + 1
+        if self.latencia and metodo != 'getMe':
+            await asyncio.sleep(self.latencia)
+        if request.content_type == 'application/json':
+            datos = await request.json()
+        else:
+            datos = await request.post()
+        if metodo == 'getMe':
+            resultado = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        elif metodo in ('sendMessage', 'editMessageText', 'sendDocument'):
+            if metodo == 'sendMessage':
+                self.envios += 1
+                self.primer_envio = self.primer_envio or time.time()
+            resultado = self._mensaje(datos.get('chat_id'), str(datos.get('text', '')))
+        elif metodo == 'getUpdates':
+            resultado = await self._updates(request.match_info['token'], int(datos.get('offset') or 0))
+        elif metodo == 'getFile':
+            resultado = {'file_id': datos.get('file_id'), 'file_unique_id': 'u', 'file_path': f"documents/{datos.get('file_id')}"}
+        else:
+            resultado = True
+        return web.json_response({'ok': True, 'result': resultado})
+
+    async def _updates(self, token, offset):
+        """getUpdates: los updates sembrados para el token con update_id >= offset (long polling corto)."""
+        pendientes = [u for u in self.updates.get(token, []) if u['update_id'] >= offset]
+        if not pendientes:
+            await asyncio.sleep(0.2)
+        return pendientes
+
+    async def _archivo(self, request: web.Request) -> web.Response:
+        """Descarga de archivos: documents/<file_id> de los sembrados."""
+        self.llamadas['descarga'] = self.llamadas.get('descarga', 0) + 1
+        contenido = self.archivos.get(request.match_info['ruta'].rsplit('/', 1)[-1])
+        if contenido is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=contenido)
+
+def _proceso_api(conexion, latencia, archivos, updates):
+    """Sirve la Bot API simulada en un proceso aparte, para no competir por CPU con los bots."""
+    async def servir():
+        api = ApiTelegramFalsa(latencia, archivos, updates)
+        await api.iniciar()
+        conexion.send(api.puerto)
+        while await asyncio.get_running_loop().run_in_executor(None, conexion.recv) == 'estado':
+            conexion.send((api.primer_envio, api.envios))
+        conexion.send(api.llamadas)
+        await api.detener()
+
+    asyncio.run(servir())
+
+class ProcesoApi:
+    """Lanza y detiene el proceso de la Bot API simulada."""
+
+    def __init__(self, latencia=0.0, archivos=None, updates=None):
+        self._conexion, extremo = multiprocessing.Pipe()
+        self._proceso = multiprocessing.Process(
+            target=_proceso_api, args=(extremo, latencia, archivos or {}, updates or {}), daemon=True
+        )
+
+    def iniciar(self):
+        self._proceso.start()
+        return self._conexion.recv()
+
+    def estado(self):
+        """(time.time() del primer sendMessage o None si no llegó ninguno, sendMessage recibidos)."""
+        self._conexion.send('estado')
+        return self._conexion.recv()
+
+    def detener(self):
+        """Detiene el servidor y retorna las llamadas recibidas por método."""
+        self._conexion.send('fin')
+        llamadas = self._conexion.recv()
+        self._proceso.join()
+        return llamadas
+
+# --- Entorno y Base de Datos Sembrada ---
+def preparar_entorno(args, puerto):
+    """Fija el entorno antes de importar los bots: DB de prueba, tokens falsos y la Bot API local."""
+    if not args.database_url:
+        args.database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench_load_'), 'bench.db')}"
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ['BOT_MAIN_TOKEN'] = TOKEN_MAIN
+    os.environ['BOT_ADMIN_TOKEN'] = TOKEN_ADMIN
+    os.environ['BOT_MODE'] = 'polling'
+    os.environ['METRICS_PORT'] = ''
+    os.environ['TELEGRAM_API_URL'] = f'http://127.0.0.1:{puerto}/bot'
+    os.environ['TELEGRAM_FILE_URL'] = f'http://127.0.0.1:{puerto}/file/bot'
+    # El estrés de saldo verifica que ningún ajuste deje la cuenta en negativo.
+    os.environ['SALDO_MINIMO_AJUSTES'] = '0'
+
+def sembrar(args):
+    """Crea socios con sesión iniciada, admins, productos por categoría y su stock de keys."""
+    from sqlalchemy import insert
+    from db_models import ENGINE, Usuario, Producto, get_session, inicializar_db
+    from db_import import insertar_licencias
+
+    inicializar_db(ENGINE)
+    with get_session() as session_db:
+        session_db.execute(insert(Usuario), [
+            {'username': f'bench_socio_{i}', 'login_key': 'bench', 'saldo': 1_000_000.0,
+             'telegram_id': ID_SOCIO_BASE + i, 'es_admin': False}
+            for i in range(args.usuarios)
+        ] + [
+            {'username': f'bench_admin_{i}', 'login_key': 'bench', 'saldo': 0.0,
+             'telegram_id': ID_ADMIN_BASE + i, 'es_admin': True}
+            for i in range(args.admins + ADMINS_ESTRES * bool(args.estres_saldo))
+        ])
+        productos = [
+            Producto(nombre=f'Bench {i}', categoria=f'Categoria {i % args.categorias}', precio=1.0)
+            for i in range(args.productos)
+        ]
+        session_db.add_all(productos)
+        session_db.commit()
+        ids = [(p.id, p.categoria) for p in productos]
+
+        for producto_id, _ in ids:
+            insertar_licencias(session_db, producto_id, [f'BENCH-{producto_id}-{n}' for n in range(args.keys_por_producto)])
+
+    categorias = {}
+    for producto_id, categoria in ids:
+        categorias.setdefault(categoria, []).append(producto_id)
+    return categorias
+
+def nombre_archivo(telegram_id, n):
+    """file_id (y nombre) del archivo n del admin; alterna .txt y .csv."""
+    return f"licencias-{telegram_id}-{n}.{'csv' if n % 2 else 'txt'}"
+
+def sembrar_archivos(args):
+    """Genera los archivos de licencias que cada admin importa. Retorna {file_id: contenido}."""
+    archivos = {}
+    for i in range(args.admins):
+        telegram_id = ID_ADMIN_BASE + i
+        for n in range(args.archivos):
+            licencias = [f'ARC-{telegram_id}-{n}-{k}' for k in range(args.keys_por_archivo)]
+            if n % 2:
+                licencias.insert(0, 'licencia')
+            archivos[nombre_archivo(telegram_id, n)] = '\n'.join(licencias).encode()
+    return archivos
+
+# --- Updates Sintéticos ---
+_ids_update = itertools.count(1)
+_ids_mensaje = itertools.count(1)
+
+def update_mensaje(telegram_id, texto):
+    mensaje = {
+        'message_id': next(_ids_mensaje), 'date': int(time.time()),
+        'chat': {'id': telegram_id, 'type': 'private'},
+        'from': {'id': telegram_id, 'is_bot': False, 'first_name': 'bench'}, 'text': texto,
+    }
+    if texto.startswith('/'):
+        mensaje['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(texto.split()[0])}]
+    return {'update_id': next(_ids_update), 'message': mensaje}
+
+def update_documento(telegram_id, file_id, tamano):
+    return {'update_id': next(_ids_update), 'message': {
+        'message_id': next(_ids_mensaje), 'date': int(time.time()),
+        'chat': {'id': telegram_id, 'type': 'private'},
+        'from': {'id': telegram_id, 'is_bot': False, 'first_name': 'bench'},
+        'document': {'file_id': file_id, 'file_unique_id': file_id, 'file_name': file_id, 'file_size': tamano},
+    }}
+
+def update_boton(telegram_id, datos):
+    return {'update_id': next(_ids_update), 'callback_query': {
+        'id': str(next(_ids_mensaje)), 'chat_instance': 'bench', 'data': datos,
+        'from': {'id': telegram_id, 'is_bot': False, 'first_name': 'bench'},
+        'message': {'message_id': 1, 'date': int(time.time()), 'chat': {'id': telegram_id, 'type': 'private'},
+                    'from': {'id': 1, 'is_bot': True, 'first_name': 'bench'}, 'text': 'menu'},
+    }}
+
+class Medicion:
+    """Latencias (segundos) por paso de flujo."""
+
+    def __init__(self):
+        self.latencias = {}
+        self.importaciones_incompletas = []
+
+    async def enviar(self, application, paso, datos):
+        from telegram import Update
+        update = Update.de_json(datos, application.bot)
+        inicio = time.perf_counter()
+        # Mismo camino que la Application: cupo global y lock por usuario del update processor.
+        await application.update_processor.process_update(update, application.process_update(update))
+        self.latencias.setdefault(paso, []).append(time.perf_counter() - inicio)
+
+# --- Flujos ---
+async def flujo_socio(medicion, app_main, telegram_id, categorias, compras, demora=0.0):
+    """Abre el menú, navega una categoría y compra y revisa su cuenta (o vuelve atrás si solo navega)."""
+    from bot_main import CB_MENU, CB_CATEGORIA, CB_PRODUCTO
+    await asyncio.sleep(demora)
+    categoria = random.choice(list(categorias))
+    await medicion.enviar(app_main, 'menu', update_mensaje(telegram_id, '🛒 Buy keys'))
+    await medicion.enviar(app_main, 'categoria', update_boton(telegram_id, f'{CB_CATEGORIA}{categorias[categoria][0]}'))
+    if not compras:
+        await medicion.enviar(app_main, 'volver', update_boton(telegram_id, CB_MENU))
+        return
+    for _ in range(compras):
+        producto_id = random.choice(categorias[categoria])
+        await medicion.enviar(app_main, 'compra', update_boton(telegram_id, f'{CB_PRODUCTO}{producto_id}'))
+    await medicion.enviar(app_main, 'cuenta', update_mensaje(telegram_id, '👤 Account'))
+
+def _contar_keys_con_prefijo(prefijo):
+    from db_models import get_session, Key
+    with get_session() as session_db:
+        return session_db.query(Key).filter(Key.licencia.like(f'{prefijo}%')).count()
+
+async def esperar_importacion(prefijo, esperadas, limite=300.0):
+    """Espera a que la tarea en segundo plano guarde las keys del archivo. Retorna si terminó a tiempo."""
+    fin = time.monotonic() + limite
+    while time.monotonic() < fin:
+        if await asyncio.to_thread(_contar_keys_con_prefijo, prefijo) >= esperadas:
+            return True
+        await asyncio.sleep(0.2)
+    return False
+
+async def flujo_admin(medicion, app_admin, telegram_id, producto_ids, importaciones, tamano, archivos, tamano_archivo):
+    """Importa keys pegadas como texto y luego archivos .txt/.csv, repitiendo el flujo 🔑 Añadir Keys."""
+    for n in range(importaciones):
+        producto_id = random.choice(producto_ids)
+        await medicion.enviar(app_admin, 'admin_menu_keys', update_mensaje(telegram_id, '🔑 Añadir Keys'))
+        await medicion.enviar(app_admin, 'admin_producto', update_mensaje(telegram_id, f'ID {producto_id}: bench'))
+        licencias = '\n'.join(f'IMP-{telegram_id}-{n}-{i}' for i in range(tamano))
+        await medicion.enviar(app_admin, 'admin_importar', update_mensaje(telegram_id, licencias))
+
+    for n in range(archivos):
+        producto_id = random.choice(producto_ids)
+        await medicion.enviar(app_admin, 'admin_menu_keys', update_mensaje(telegram_id, '🔑 Añadir Keys'))
+        await medicion.enviar(app_admin, 'admin_producto', update_mensaje(telegram_id, f'ID {producto_id}: bench'))
+        inicio = time.perf_counter()
+        await medicion.enviar(app_admin, 'admin_archivo', update_documento(telegram_id, nombre_archivo(telegram_id, n), tamano_archivo))
+        if await esperar_importacion(f'ARC-{telegram_id}-{n}-', tamano_archivo):
+            medicion.latencias.setdefault('admin_archivo_fin', []).append(time.perf_counter() - inicio)
+        else:
+            medicion.importaciones_incompletas.append(nombre_archivo(telegram_id, n))
+
+async def flujo_estres_compras(medicion, app_main, telegram_id, producto_ids, operaciones):
+    """Compras seguidas de un mismo socio (la cuenta bajo estrés)."""
+    from bot_main import CB_PRODUCTO
+    for _ in range(operaciones):
+        await medicion.enviar(app_main, 'estres_compra', update_boton(telegram_id, f'{CB_PRODUCTO}{random.choice(producto_ids)}'))
+
+async def flujo_estres_ajustes(medicion, app_admin, telegram_id, usuario_id, operaciones):
+    """Ajustes de +1/-1 sobre la cuenta bajo estrés por el flujo 💰 Ajustar Saldo."""
+    for n in range(operaciones):
+        await medicion.enviar(app_admin, 'estres_ajuste_menu', update_mensaje(telegram_id, '💰 Ajustar Saldo'))
+        await medicion.enviar(app_admin, 'estres_ajuste_id', update_mensaje(telegram_id, str(usuario_id)))
+        await medicion.enviar(app_admin, 'estres_ajuste', update_mensaje(telegram_id, '1' if n % 2 else '-1'))
+        # Si el piso rechazó el ajuste, la conversación sigue esperando un monto.
+        await medicion.enviar(app_admin, 'estres_cancelar', update_mensaje(telegram_id, '/cancelar'))
+
+def _proceso_ajustes(usuario_id, operaciones, barrera):
+    """Ajustes de +1/-1 sobre la cuenta bajo estrés desde otro proceso (otro pool, otra cola de escritura).
+
+    Usa la misma función que el flujo 💰 Ajustar Saldo; hereda el entorno de preparar_entorno.
+    """
+    from bot_admin import _aplicar_ajuste_saldo
+    from db_models import get_session
+    barrera.wait()
+    with get_session() as session_db:
+        for n in range(operaciones):
+            _aplicar_ajuste_saldo(session_db, usuario_id, 1 if n % 2 else -1)
+
+def _proceso_importador(producto_id, lotes, keys_por_lote, barrera):
+    """Importa lotes de keys desde otro proceso mientras se miden las compras."""
+    from db_models import get_session
+    from db_import import insertar_licencias
+    barrera.wait()
+    with get_session() as session_db:
+        for n in range(lotes):
+            insertar_licencias(session_db, producto_id, [f'IMPORTADOR-{n}-{k}' for k in range(keys_por_lote)])
+
+def lanzar_procesos(destino, argumentos, cantidad):
+    """Lanza procesos destino(*argumentos, barrera) (spawn: sin heredar el pool ya abierto).
+
+    Retorna (procesos, barrera); esperar la barrera los libera a todos a la vez, ya importados.
+    """
+    contexto = multiprocessing.get_context('spawn')
+    barrera = contexto.Barrier(cantidad + 1)
+    procesos = [contexto.Process(target=destino, args=(*argumentos, barrera), daemon=True) for _ in range(cantidad)]
+    for proceso in procesos:
+        proceso.start()
+    return procesos, barrera
+
+def verificar_saldo(usuario_id, saldo_inicial):
+    """Comprueba que ninguna escritura sobre la cuenta se perdió: saldo final = inicial + suma del libro."""
+    from sqlalchemy import func
+    from db_models import get_session, Usuario, Transaccion, Key
+    from db_ledger import TIPO_COMPRA
+    with get_session() as session_db:
+        saldo = session_db.query(Usuario.saldo).filter(Usuario.id == usuario_id).scalar()
+        suma, minimo, movimientos = session_db.query(
+            func.sum(Transaccion.monto), func.min(Transaccion.saldo_resultante), func.count()
+        ).filter(Transaccion.usuario_id == usuario_id).one()
+        compras = session_db.query(func.count()).filter(Transaccion.tipo == TIPO_COMPRA).scalar()
+        vendidas = session_db.query(Key).filter(Key.estado == 'used').count()
+
+    problemas = []
+    if abs(saldo - (saldo_inicial + (suma or 0))) > 1e-6:
+        problemas.append(f"saldo {saldo:.2f} != inicial {saldo_inicial:.2f} + libro {suma or 0:.2f}")
+    if minimo is not None and minimo < 0:
+        problemas.append(f"saldo negativo en el libro ({minimo:.2f})")
+    if compras != vendidas:
+        problemas.append(f"{compras} compras en el libro para {vendidas} keys vendidas")
+    print(f"Estrés de saldo: {movimientos} movimientos, saldo final {saldo:.2f} "
+          f"({'OK' if not problemas else '; '.join(problemas)})")
+    return problemas
+
+# --- Reporte ---
+def reportar(medicion, duracion):
+    print(f"\n{'paso':<18}{'n':>8}{'upd/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    resumen = {}
+    for paso, valores in medicion.latencias.items():
+        valores.sort()
+        fila = {
+            'n': len(valores), 'por_segundo': len(valores) / duracion,
+            'p50': percentil(valores, 50) * 1000, 'p95': percentil(valores, 95) * 1000,
+            'p99': percentil(valores, 99) * 1000, 'max': valores[-1] * 1000,
+        }
+        resumen[paso] = fila
+        print(f"{paso:<18}{fila['n']:>8}{fila['por_segundo']:>10.1f}{fila['p50']:>10.1f}"
+              f"{fila['p95']:>10.1f}{fila['p99']:>10.1f}{fila['max']:>10.1f}")
+    return resumen
+
+async def ejecutar(args):
+    api = ProcesoApi(args.latencia_api_ms / 1000, sembrar_archivos(args))
+    preparar_entorno(args, api.iniciar())
+
+    import bot_main
+    import bot_admin
+    from metrics import ERRORES_HANDLER
+    from db_models import get_session, Key
+    # Los bots configuran logging en INFO; una línea por request distorsiona la medición.
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    # Las Applications no se inician con start(): las importaciones de archivo se esperan en flujo_admin.
+    warnings.filterwarnings('ignore', message='Tasks created via `Application.create_task`')
+
+    categorias = sembrar(args)
+    producto_ids = [pid for ids in categorias.values() for pid in ids]
+    aplicaciones = [bot_main.crear_aplicacion(), bot_admin.crear_aplicacion()]
+    for application in aplicaciones:
+        await application.initialize()
+        await application.post_init(application)
+    app_main, app_admin = aplicaciones
+
+    random.seed(args.semilla)
+    medicion = Medicion()
+    compradores = int(args.usuarios * args.compradores)
+    tareas = [
+        flujo_socio(
+            medicion, app_main, ID_SOCIO_BASE + i, categorias, args.compras if i < compradores else 0,
+            demora=i / args.llegadas_por_segundo if args.llegadas_por_segundo else 0.0
+        )
+        for i in range(args.usuarios)
+    ] + [
+        flujo_admin(medicion, app_admin, ID_ADMIN_BASE + i, producto_ids, args.importaciones, args.keys_por_importacion,
+                    args.archivos, args.keys_por_archivo)
+        for i in range(args.admins)
+    ]
+    if args.estres_saldo:
+        # La cuenta del primer socio arranca con saldo para la mitad de las compras (precio 1.0),
+        # así las compras y los ajustes de dos admins compiten también contra el piso.
+        from db_models import Usuario
+        saldo_estres = args.estres_saldo / 2
+        with get_session() as session_db:
+            usuario_estres = session_db.query(Usuario).filter(Usuario.telegram_id == ID_SOCIO_BASE).one()
+            usuario_estres.saldo = saldo_estres
+            usuario_id_estres = usuario_estres.id
+            session_db.commit()
+        tareas.append(flujo_estres_compras(medicion, app_main, ID_SOCIO_BASE, producto_ids, args.estres_saldo))
+        tareas += [
+            flujo_estres_ajustes(medicion, app_admin, ID_ADMIN_BASE + args.admins + i, usuario_id_estres, args.estres_saldo)
+            for i in range(ADMINS_ESTRES)
+        ]
+    random.shuffle(tareas)
+    procesos = []
+    if args.procesos_estres:
+        procesos, barrera = lanzar_procesos(_proceso_ajustes, (usuario_id_estres, args.estres_saldo), args.procesos_estres)
+        await asyncio.to_thread(barrera.wait)
+
+    print(f"DB: {args.database_url} | {args.usuarios} socios ({compradores} compran), "
+          f"{args.admins} admins importando, concurrencia {app_main.update_processor.max_concurrent_updates}")
+    inicio = time.perf_counter()
+    await asyncio.gather(*tareas)
+    for proceso in procesos:
+        await asyncio.to_thread(proceso.join)
+    duracion = time.perf_counter() - inicio
+
+    for application in aplicaciones:
+        await application.post_shutdown(application)
+        await application.shutdown()
+    llamadas = api.detener()
+
+    resumen = reportar(medicion, duracion)
+    with get_session() as session_db:
+        vendidas = session_db.query(Key).filter(Key.estado == 'used').count()
+    errores = ERRORES_HANDLER.total()
+    print(f"\nDuración: {duracion:.2f}s | Keys vendidas: {vendidas} | Errores en handlers: {errores} | "
+          f"Llamadas a la Bot API: {sum(llamadas.values())}")
+
+    if args.json:
+        with open(args.json, 'w') as archivo:
+            json.dump({'duracion': duracion, 'vendidas': vendidas, 'errores': errores, 'pasos': resumen}, archivo, indent=2)
+
+    fallos = [paso for paso, fila in resumen.items() if args.max_p99_ms and fila['p99'] > args.max_p99_ms]
+    problemas = verificar_saldo(usuario_id_estres, saldo_estres) if args.estres_saldo else []
+    problemas += [f"proceso de ajustes terminó con código {p.exitcode}" for p in procesos if p.exitcode]
+    incompletas = medicion.importaciones_incompletas
+    if errores or fallos or problemas or incompletas:
+        print(f"❌ Fuera de umbral: errores={errores}, p99 > {args.max_p99_ms} ms en {fallos}, saldo: {problemas}, "
+              f"importaciones de archivo sin terminar: {incompletas}")
+        return 1
+    return 0
+
+async def comprar_como_update(telegram_id, producto_id):
+    """Una compra con su propia unidad de trabajo, como la atiende el bot. Retorna el estado."""
+    from db_models import iniciar_unidad_de_trabajo, terminar_unidad_de_trabajo, cerrar_unidad_de_trabajo, ejecutar_db
+    from db_purchases import comprar_key
+    uow, token = iniciar_unidad_de_trabajo()
+    try:
+        estado, _ = await ejecutar_db(comprar_key, telegram_id, producto_id)
+        return estado
+    finally:
+        terminar_unidad_de_trabajo(token)
+        await cerrar_unidad_de_trabajo(uow)
+
+async def ejecutar_compras_directas(args):
+    # Cada compra en vuelo retiene una conexión, como un update.
+    os.environ.setdefault('DB_POOL_SIZE', str(args.en_vuelo))
+    preparar_entorno(args, 0)
+    from db_models import ES_SQLITE, SQLITE_PERFIL
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    categorias = sembrar(args)
+    producto_ids = [pid for ids in categorias.values() for pid in ids]
+    random.seed(args.semilla)
+    procesos, barrera = lanzar_procesos(
+        _proceso_importador, (producto_ids[0], args.importador_lotes, args.keys_por_lote), 1 if args.importador_lotes else 0
+    )
+    await asyncio.to_thread(barrera.wait)
+
+    cupos = asyncio.Semaphore(args.en_vuelo)
+    estados = {}
+
+    async def una_compra():
+        async with cupos:
+            try:
+                estado = await comprar_como_update(ID_SOCIO_BASE + random.randrange(args.usuarios), random.choice(producto_ids))
+            except Exception as e:
+                estado = f'error {type(e).__name__}: {e}'
+        estados[estado] = estados.get(estado, 0) + 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(una_compra() for _ in range(args.compras_directas)))
+    duracion = time.perf_counter() - inicio
+    for proceso in procesos:
+        await asyncio.to_thread(proceso.join)
+    duracion_importador = time.perf_counter() - inicio
+
+    perfil = 'sin SQLite' if not ES_SQLITE else ('perfil SQLite activo' if SQLITE_PERFIL else 'SQLITE_PERFIL=0')
+    print(f"DB: {args.database_url} ({perfil}) | {args.compras_directas} compras, {args.en_vuelo} en vuelo | "
+          f"importador: {args.importador_lotes} x {args.keys_por_lote} keys")
+    print(f"{args.compras_directas / duracion:.1f} compras/s ({duracion:.2f}s) | importador terminó a {duracion_importador:.2f}s")
+    for estado, cantidad in sorted(estados.items()):
+        print(f"  {estado}: {cantidad}")
+
+    errores = sum(cantidad for estado, cantidad in estados.items() if estado.startswith('error'))
+    fallidos = [p.exitcode for p in procesos if p.exitcode]
+    if errores or fallidos:
+        print(f"❌ {errores} compras con error; importador con código {fallidos or 0}")
+        return 1
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de bot_main y bot_admin contra una Bot API simulada.")
+    parser.add_argument('--usuarios', type=int, default=2000)
+    parser.add_argument('--compradores', type=float, default=0.7, help="Fracción de socios que compra (el resto solo navega).")
+    parser.add_argument('--compras', type=int, default=1, help="Compras por socio comprador.")
+    parser.add_argument('--llegadas-por-segundo', type=float, default=0, help="Ritmo de llegada de socios (0 = todos a la vez).")
+    parser.add_argument('--productos', type=int, default=20)
+    parser.add_argument('--categorias', type=int, default=5)
+    parser.add_argument('--keys-por-producto', type=int, default=500)
+    parser.add_argument('--admins', type=int, default=2)
+    parser.add_argument('--importaciones', type=int, default=10, help="Importaciones por admin.")
+    parser.add_argument('--keys-por-importacion', type=int, default=200)
+    parser.add_argument('--archivos', type=int, default=1, help="Importaciones de archivo .txt/.csv por admin.")
+    parser.add_argument('--keys-por-archivo', type=int, default=5000)
+    parser.add_argument('--estres-saldo', type=int, default=0,
+                        help="Compras del primer socio y ajustes de cada admin de estrés sobre esa misma cuenta (0 = desactivado).")
+    parser.add_argument('--procesos-estres', type=int, default=0,
+                        help="Procesos extra que hacen --estres-saldo ajustes cada uno sobre la misma cuenta.")
+    parser.add_argument('--compras-directas', type=int, default=0,
+                        help="Solo mide compras/s: N compras sin los bots y un proceso importando keys (0 = desactivado).")
+    parser.add_argument('--en-vuelo', type=int, default=32, help="Compras simultáneas con --compras-directas.")
+    parser.add_argument('--importador-lotes', type=int, default=30, help="Lotes del proceso importador (0 = sin importador).")
+    parser.add_argument('--keys-por-lote', type=int, default=2000)
+    parser.add_argument('--latencia-api-ms', type=float, default=0, help="Demora de cada respuesta de la Bot API simulada.")
+    parser.add_argument('--database-url', default='', help="Por defecto, SQLite temporal.")
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--max-p99-ms', type=float, default=0, help="Falla (exit 1) si algún paso supera este p99.")
+    parser.add_argument('--json', default='', help="Guarda el resumen en este archivo.")
+    parser.add_argument('--verbose', action='store_true', help="Mantiene el logging INFO de los bots.")
+    args = parser.parse_args()
+    if args.procesos_estres and not args.estres_saldo:
+        parser.error("--procesos-estres requiere --estres-saldo")
+    if args.estres_saldo and not args.procesos_estres and not args.database_url.startswith('postgresql'):
+        # Dentro de un proceso, SQLite aplica las escrituras de a una: no habría ninguna carrera que detectar.
+        parser.error("--estres-saldo en SQLite no prueba escrituras concurrentes; "
+                     "agrega --procesos-estres N o usa --database-url de un Postgres")
+    if args.compras_directas:
+        sys.exit(asyncio.run(ejecutar_compras_directas(args)))
+    sys.exit(asyncio.run(ejecutar(args)))
+
+
+if __name__ == '__main__':
+    main()
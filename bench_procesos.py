@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import argparse
+from bench_load import ProcesoApi, preparar_entorno, update_mensaje, TOKEN_MAIN, TOKEN_ADMIN, ID_SOCIO_BASE, ID_ADMIN_BASE
+from bench_arranque import lanzar_script, detener_proceso
+
+# =================================================================
+# Comparación de Procesos (un runner vs. un proceso por bot)
+# =================================================================
+# Lanza contra la Bot API simulada de bench_load.py las dos disposiciones:
+#   - un proceso: run_bots.py (ambos bots, un event loop, un pool);
+#   - dos procesos: bot_main.py y bot_admin.py por separado (lo que hacía start.sh).
+# Cuando ambos bots respondieron un /start, mide la memoria residente actual
+# (/proc/<pid>/statm) y las conexiones a la DB abiertas, contadas como
+# descriptores hacia el archivo SQLite en /proc/<pid>/fd, junto al tope de
+# conexiones que pueden llegar a abrir (un pool de DB_POOL_SIZE +
+# DB_MAX_OVERFLOW por proceso).
+#
+# Uso: python bench_procesos.py [--espera 1.0]
+# Solo Linux y SQLite (la DB temporal por defecto); exit 1 si algún bot no respondió.
+
+BOTS = 2
+DISPOSICIONES = {
+    'un proceso': ['run_bots.py'],
+    'dos procesos': ['bot_main.py', 'bot_admin.py'],
+}
+
+def memoria_mb(pid):
+    """Memoria residente actual del proceso."""
+    with open(f'/proc/{pid}/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+def conexiones_sqlite(pid, ruta_db):
+    """Descriptores del proceso abiertos sobre el archivo de la DB (uno por conexión)."""
+    directorio = f'/proc/{pid}/fd'
+    total = 0
+    for fd in os.listdir(directorio):
+        try:
+            total += os.readlink(os.path.join(directorio, fd)) == ruta_db
+        except OSError:
+            pass
+    return total
+
+def medir(args, scripts, ruta_db):
+    """Lanza los scripts y, cuando ambos bots respondieron, retorna (memoria MB, conexiones), o None."""
+    api = ProcesoApi(updates={
+        TOKEN_MAIN: [update_mensaje(ID_SOCIO_BASE, '/start')],
+        TOKEN_ADMIN: [update_mensaje(ID_ADMIN_BASE, '/start')],
+    })
+    preparar_entorno(args, api.iniciar())
+    procesos = [lanzar_script(script, args.verbose) for script in scripts]
+    fin = time.time() + args.limite
+    envios = 0
+    while envios < BOTS and time.time() < fin and all(p.poll() is None for p in procesos):
+        time.sleep(0.05)
+        _, envios = api.estado()
+
+    resultado = None
+    if envios >= BOTS:
+        # Deja terminar las tareas de post_init que abren conexiones en segundo plano.
+        time.sleep(args.espera)
+        resultado = (
+            sum(memoria_mb(p.pid) for p in procesos),
+            sum(conexiones_sqlite(p.pid, ruta_db) for p in procesos),
+        )
+    for proceso in procesos:
+        detener_proceso(proceso)
+    api.detener()
+    return resultado
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara memoria y conexiones de run_bots.py contra un proceso por bot.")
+    parser.add_argument('--espera', type=float, default=1.0, help="Segundos tras las respuestas antes de medir.")
+    parser.add_argument('--limite', type=float, default=60, help="Segundos máximos hasta que ambos bots respondan.")
+    parser.add_argument('--verbose', action='store_true', help="Muestra la salida de los procesos.")
+    args = parser.parse_args()
+    args.database_url = ''
+
+    preparar_entorno(args, 0)
+    ruta_db = args.database_url.removeprefix('sqlite:///')
+    if lanzar_script('db_migrations.py', args.verbose).wait() != 0:
+        print("❌ db_migrations.py falló")
+        sys.exit(1)
+
+    # Mismos valores por defecto que db_models.
+    por_pool = int(os.getenv('DB_POOL_SIZE', '5')) + int(os.getenv('DB_MAX_OVERFLOW', '10'))
+    print(f"DB: {args.database_url}\n\n{'disposición':<16}{'procesos':>10}{'memoria MB':>12}{'conexiones':>12}{'tope pool':>11}")
+    sin_respuesta = []
+    for nombre, scripts in DISPOSICIONES.items():
+        resultado = medir(args, scripts, ruta_db)
+        if resultado is None:
+            sin_respuesta.append(nombre)
+            print(f"{nombre:<16}{len(scripts):>10}{'sin respuesta':>24}")
+            continue
+        memoria, conexiones = resultado
+        print(f"{nombre:<16}{len(scripts):>10}{memoria:>12.1f}{conexiones:>12}{len(scripts) * por_pool:>11}")
+
+    if sin_respuesta:
+        print(f"❌ Los bots no respondieron en {args.limite:.0f}s: {', '.join(sin_respuesta)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,27 @@
 import os
+import asyncio
 import logging
+import tempfile
+from datetime import datetime
 from dotenv import load_dotenv
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler
+from telegram import Update, InputFile, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes, ConversationHandler
+from telegram.error import TelegramError
 from sqlalchemy.exc import IntegrityError
-from db_models import Usuario, Producto, Key, get_session, inicializar_db 
+from db_models import Usuario, Producto, ejecutar_db, ejecutar_en_hilo_db, desligar_unidad_de_trabajo, lectura_idempotente, escritura_serializada
+from auth_cache import CACHE_ADMIN
+from db_stock import productos_con_stock, lotes_de_productos, reconciliar_lote, marcar_producto_eliminado, purgar_keys, eliminar_producto_purgado, productos_pendientes_de_purga
+from db_import import insertar_licencias, leer_licencias
+from db_users import pagina_usuarios
+from db_export import exportar_csv, EXPORTACIONES, ESTADOS_KEY
+from db_bulk import leer_csv, cargar_socios, cargar_ajustes, reporte_errores, ArchivoInvalido
+from db_ledger import registrar_transaccion, TIPO_AJUSTE
+from db_balance import mover_saldo, SALDO_MINIMO_AJUSTES
+from catalog_cache import incrementar_version_catalogo
+from bot_middleware import AplicacionBot, ContextoBot, ProcesadorPorUsuario, marcar_update_fallido, lanzar_en_segundo_plano, MensajeProgreso, TELEGRAM_API_URL, TELEGRAM_FILE_URL
+from metrics import instrumentar_aplicacion
+from webhook_server import modo_webhook, ejecutar_webhook
+from db_migrations import verificar_esquema
 
 # =================================================================
 # 1. Configuración Inicial (Lectura de Variables de Entorno)
@@ -15,9 +32,6 @@ ADMIN_TOKEN_STR = os.getenv('BOT_ADMIN_TOKEN')
 if not ADMIN_TOKEN_STR:
     raise ValueError("Error: BOT_ADMIN_TOKEN no encontrado. Verifica las variables de entorno.")
 
-# Inicializa la base de datos (se hace después de cargar ENV)
-inicializar_db() 
-
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -27,36 +41,67 @@ ADD_KEYS_PRODUCT, ADD_KEYS_LICENSES = range(2, 4)
 CREATE_USER_NAME, CREATE_USER_LOGIN_KEY, CREATE_USER_SALDO, CREATE_USER_ADMIN = range(4, 8)
 CREATE_PRODUCT_NAME, CREATE_PRODUCT_CATEGORY, CREATE_PRODUCT_PRICE, CREATE_PRODUCT_DESC = range(8, 12)
 DELETE_PRODUCT_ID = 12
+BULK_USERS_FILE, BULK_SALDO_FILE = range(13, 15)
 
 
 # =================================================================
 # 2. Seguridad y Login de Administradores
 # =================================================================
 
-def check_admin(update: Update) -> bool:
+@lectura_idempotente
+def _es_admin(session_db, user_id_telegram):
+    """Retorna True si el telegram_id pertenece a un administrador logueado."""
+    return session_db.query(Usuario.id).filter_by(
+        telegram_id=user_id_telegram, 
+        es_admin=True
+    ).first() is not None
+
+async def check_admin(update: Update) -> bool:
     """Verifica si el usuario está logueado y tiene permisos de administrador."""
     if not update.effective_user:
         return False
 
     user_id_telegram = update.effective_user.id
     
-    with get_session() as session_db:
-        usuario = session_db.query(Usuario).filter_by(
-            telegram_id=user_id_telegram, 
-            es_admin=True
-        ).first()
+    es_admin = CACHE_ADMIN.obtener(user_id_telegram)
+    if es_admin is None:
+        es_admin = await ejecutar_db(_es_admin, user_id_telegram)
+        CACHE_ADMIN.guardar(user_id_telegram, es_admin)
 
-    if usuario:
+    if es_admin:
         return True
     else:
         if update.message and update.message.text and not update.message.text.lower().startswith('/login'):
-            update.message.reply_text(
+            await update.message.reply_text(
                 "❌ Acceso denegado. Debes iniciar sesión como administrador.\n"
                 "Usa el formato: `/login [USERNAME] [CLAVE]`",
                 parse_mode='Markdown'
             )
         return False
 
+@escritura_serializada
+def _vincular_admin(session_db, username, login_key_input, user_id_telegram):
+    """Valida credenciales de admin y asocia el telegram_id. Retorna (estado, username, telegram_id anterior)."""
+    usuario = session_db.query(Usuario).filter_by(
+        username=username, 
+        login_key=login_key_input, 
+        es_admin=True
+    ).first()
+    if not usuario:
+        return 'fallido', None, None
+
+    existing_user_with_id = session_db.query(Usuario).filter(
+        Usuario.telegram_id == user_id_telegram, 
+        Usuario.id != usuario.id
+    ).first()
+    if existing_user_with_id:
+        return 'id_en_uso', existing_user_with_id.username, None
+
+    telegram_id_anterior = usuario.telegram_id
+    usuario.telegram_id = user_id_telegram
+    session_db.commit()
+    return 'ok', username, telegram_id_anterior
+
 async def admin_login_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Permite a un usuario administrador loguearse en el bot."""
     
@@ -73,31 +118,20 @@ async def admin_login_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE)
     username, login_key_input = parts[1], parts[2]
     user_id_telegram = update.effective_user.id
 
-    session_db = get_session()
     try:
-        usuario = session_db.query(Usuario).filter_by(
-            username=username, 
-            login_key=login_key_input, 
-            es_admin=True
-        ).first()
-
-        if usuario:
-            existing_user_with_id = session_db.query(Usuario).filter(
-                Usuario.telegram_id == user_id_telegram, 
-                Usuario.id != usuario.id
-            ).first()
-            
-            if existing_user_with_id:
-                await update.message.reply_text(
-                    f"❌ Error: Tu ID de Telegram ya está asociada a la cuenta '{existing_user_with_id.username}'. Desloguea esa cuenta primero si es necesario."
-                )
-                return ConversationHandler.END
+        resultado, nombre, telegram_id_anterior = await ejecutar_db(_vincular_admin, username, login_key_input, user_id_telegram)
 
-            usuario.telegram_id = user_id_telegram
-            session_db.commit()
+        if resultado == 'id_en_uso':
+            await update.message.reply_text(
+                f"❌ Error: Tu ID de Telegram ya está asociada a la cuenta '{nombre}'. Desloguea esa cuenta primero si es necesario."
+            )
+            return ConversationHandler.END
 
+        if resultado == 'ok':
+            # La cuenta pudo estar vinculada a otro Telegram: ambos pierden la entrada cacheada.
+            CACHE_ADMIN.invalidar(user_id_telegram, telegram_id_anterior)
             await update.message.reply_text(
-                f"✅ **¡Bienvenido, {usuario.username}!** Eres administrador.\n"
+                f"✅ **¡Bienvenido, {nombre}!** Eres administrador.\n"
                 "Usa /start para acceder al panel.",
                 parse_mode='Markdown',
                 reply_markup=get_admin_keyboard()
@@ -110,11 +144,8 @@ async def admin_login_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE)
             return ConversationHandler.END
     except Exception as e:
         logger.error(f"Error en login de administrador: {e}")
-        session_db.rollback()
         await update.message.reply_text("Ha ocurrido un error inesperado durante el login.")
         return ConversationHandler.END
-    finally:
-        session_db.close()
 
 def get_admin_keyboard():
     """Genera el teclado principal de administración."""
@@ -126,14 +157,14 @@ def get_admin_keyboard():
 
 async def cancel_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancela el flujo actual y vuelve al menú principal."""
-    if not check_admin(update): return ConversationHandler.END
+    if not await check_admin(update): return ConversationHandler.END
     await update.message.reply_text("Operación cancelada. Volviendo al menú principal.", reply_markup=get_admin_keyboard())
     context.user_data.clear()
     return ConversationHandler.END
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Muestra el menú principal si es el administrador."""
-    if not check_admin(update):
+    if not await check_admin(update):
         return ConversationHandler.END 
 
     await update.message.reply_text(
@@ -148,14 +179,16 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 # 3. Gestión de Socios
 # =================================================================
 
-async def list_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Muestra la lista de usuarios y su saldo."""
-    if not check_admin(update): return
-
-    with get_session() as session_db:
-        usuarios = session_db.query(Usuario).all() 
+# El prefijo de búsqueda viaja en el callback_data de los botones (máx. 64 bytes),
+# así cada mensaje de /socios pagina su propia búsqueda.
+_PREFIJO_MAX_BYTES = 32
 
-    message = "**Socios Registrados (ID | Username | Saldo):**\n\n"
+def _mensaje_pagina_socios(usuarios, hay_anterior, hay_siguiente, prefijo):
+    """Construye el texto y los botones inline de una página de socios."""
+    titulo = "**Socios Registrados (ID | Username | Saldo):**"
+    if prefijo:
+        titulo = f"**Socios que empiezan por** `{prefijo}`**:**"
+    message = titulo + "\n\n"
     if not usuarios:
         message += "No hay socios registrados."
     else:
@@ -167,12 +200,50 @@ async def list_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
                 f"   Key: `{u.login_key}`\n"
                 "----------------------------------\n"
             )
+
+    sufijo = f":{prefijo}" if prefijo else ""
+    botones = []
+    if hay_anterior:
+        botones.append(InlineKeyboardButton("⬅️ Anterior", callback_data=f"socios:a:{usuarios[0].id}{sufijo}"))
+    if hay_siguiente:
+        botones.append(InlineKeyboardButton("Siguiente ➡️", callback_data=f"socios:s:{usuarios[-1].id}{sufijo}"))
+    return message, (InlineKeyboardMarkup([botones]) if botones else None)
+
+async def list_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Muestra la primera página de socios; '/socios PREFIJO' filtra por inicio del username."""
+    if not await check_admin(update): return
+
+    prefijo = " ".join(context.args).strip() if context.args else None
+    if prefijo and len(prefijo.encode('utf-8')) > _PREFIJO_MAX_BYTES:
+        await update.message.reply_text(f"❌ El prefijo de búsqueda admite como máximo {_PREFIJO_MAX_BYTES} bytes.")
+        return
+
+    usuarios, hay_anterior, hay_siguiente = await ejecutar_db(pagina_usuarios, prefijo=prefijo)
+    message, reply_markup = _mensaje_pagina_socios(usuarios, hay_anterior, hay_siguiente, prefijo)
     
-    await update.message.reply_text(message, parse_mode='Markdown', reply_markup=get_admin_keyboard())
+    await update.message.reply_text(message, parse_mode='Markdown', reply_markup=reply_markup or get_admin_keyboard())
+
+async def paginate_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Navega entre páginas de socios editando el mismo mensaje."""
+    query = update.callback_query
+    if not await check_admin(update):
+        await query.answer("Acceso denegado.")
+        return
+    await query.answer()
+
+    _, direccion, cursor, *resto = query.data.split(':', 3)
+    prefijo = resto[0] if resto else None
+    if direccion == 's':
+        pagina = await ejecutar_db(pagina_usuarios, despues_de=int(cursor), prefijo=prefijo)
+    else:
+        pagina = await ejecutar_db(pagina_usuarios, antes_de=int(cursor), prefijo=prefijo)
+
+    message, reply_markup = _mensaje_pagina_socios(*pagina, prefijo)
+    await query.edit_message_text(message, parse_mode='Markdown', reply_markup=reply_markup)
 
 # Flujo: ➕ Crear Socio
 async def prompt_create_user_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    if not check_admin(update): return ConversationHandler.END
+    if not await check_admin(update): return ConversationHandler.END
     await update.message.reply_text("Ingresa el **Username** para el nuevo socio:", parse_mode='Markdown', reply_markup=ReplyKeyboardRemove())
     return CREATE_USER_NAME
 
@@ -200,42 +271,49 @@ async def get_create_user_saldo(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text("❌ Saldo no válido. Ingresa un número (ej: 50.00).")
         return CREATE_USER_SALDO
 
+@escritura_serializada
+def _crear_usuario(session_db, username, login_key, saldo, es_admin, autor_telegram_id=None):
+    """Inserta un nuevo socio (y su saldo inicial en el libro) y retorna sus datos."""
+    nuevo_usuario = Usuario(username=username, login_key=login_key, saldo=saldo, es_admin=es_admin)
+    session_db.add(nuevo_usuario)
+    if saldo:
+        session_db.flush()
+        registrar_transaccion(session_db, nuevo_usuario.id, TIPO_AJUSTE, saldo, saldo,
+                              detalle='Saldo inicial', autor_telegram_id=autor_telegram_id)
+    session_db.commit()
+    return {'username': username, 'login_key': login_key, 'saldo': saldo}
+
 async def finish_create_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     is_admin = update.message.text.lower() == 'sí'
     
-    db_session = get_session()
     try:
-        nuevo_usuario = Usuario(
-            username=context.user_data['temp_username'],
-            login_key=context.user_data['temp_login_key'],
-            saldo=context.user_data['temp_saldo'],
-            es_admin=is_admin
+        nuevo_usuario = await ejecutar_db(
+            _crear_usuario,
+            context.user_data['temp_username'],
+            context.user_data['temp_login_key'],
+            context.user_data['temp_saldo'],
+            is_admin,
+            update.effective_user.id
         )
-        db_session.add(nuevo_usuario)
-        db_session.commit()
         
         await update.message.reply_text(
-            f"✅ Socio **{nuevo_usuario.username}** creado exitosamente:\n"
-            f"Key: `{nuevo_usuario.login_key}` | Saldo: `${nuevo_usuario.saldo:.2f}`", 
+            f"✅ Socio **{nuevo_usuario['username']}** creado exitosamente:\n"
+            f"Key: `{nuevo_usuario['login_key']}` | Saldo: `${nuevo_usuario['saldo']:.2f}`", 
             parse_mode='Markdown', 
             reply_markup=get_admin_keyboard()
         )
     except IntegrityError:
-        db_session.rollback()
         await update.message.reply_text("❌ Error: Ya existe un socio con ese nombre de usuario. Usa /cancelar.", reply_markup=get_admin_keyboard())
     except Exception as e:
         logger.error(f"Error al crear socio: {e}")
-        db_session.rollback()
         await update.message.reply_text("❌ Error al guardar el socio. Usa /cancelar.", reply_markup=get_admin_keyboard())
-    finally:
-        db_session.close()
     
     context.user_data.clear()
     return ConversationHandler.END
 
 # Flujo: 💰 Ajustar Saldo
 async def prompt_adjust_saldo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    if not check_admin(update): return ConversationHandler.END
+    if not await check_admin(update): return ConversationHandler.END
     await update.message.reply_text(
         "Ingresa el **ID** del Socio cuyo saldo quieres ajustar:\n"
         "O escribe /cancelar para volver.",
@@ -249,24 +327,39 @@ async def select_user_id(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     try:
         user_id = int(user_id_input)
         
-        with get_session() as session_db:
-            usuario = session_db.query(Usuario).filter_by(id=user_id).first()
-            if not usuario:
-                await update.message.reply_text("❌ ID de usuario no encontrado. Ingresa un ID válido.")
-                return ADJUST_USER_ID
-
-            context.user_data['user_to_adjust_id'] = user_id
-            
-            await update.message.reply_text(
-                f"Socio: **{usuario.username}** (Saldo actual: `${usuario.saldo:.2f}`)\n"
-                "Ingresa el **monto a ajustar** (Ej: `10.00` para agregar, `-5.50` para restar).",
-                parse_mode='Markdown'
-            )
-            return ADJUST_AMOUNT
+        usuario = await ejecutar_db(lambda session_db: session_db.query(Usuario).filter_by(id=user_id).first())
+        if not usuario:
+            await update.message.reply_text("❌ ID de usuario no encontrado. Ingresa un ID válido.")
+            return ADJUST_USER_ID
+
+        context.user_data['user_to_adjust_id'] = user_id
+        
+        await update.message.reply_text(
+            f"Socio: **{usuario.username}** (Saldo actual: `${usuario.saldo:.2f}`)\n"
+            "Ingresa el **monto a ajustar** (Ej: `10.00` para agregar, `-5.50` para restar).",
+            parse_mode='Markdown'
+        )
+        return ADJUST_AMOUNT
     except ValueError:
         await update.message.reply_text("❌ Por favor, ingresa solo el número ID.")
         return ADJUST_USER_ID
 
+@escritura_serializada
+def _aplicar_ajuste_saldo(session_db, user_id, monto, autor_telegram_id=None):
+    """Suma monto al saldo del socio de forma atómica y lo registra en el libro.
+
+    Retorna (estado, datos): 'ok' con (username, nuevo_saldo), 'saldo_insuficiente' con el saldo
+    actual si quedaría bajo SALDO_MINIMO_AJUSTES, o 'no_encontrado'.
+    """
+    fila = mover_saldo(session_db, monto, TIPO_AJUSTE, usuario_id=user_id, minimo=SALDO_MINIMO_AJUSTES,
+                       detalle='Ajuste de administrador', autor_telegram_id=autor_telegram_id)
+    if fila is None:
+        saldo_actual = session_db.query(Usuario.saldo).filter(Usuario.id == user_id).scalar()
+        session_db.rollback()
+        return ('no_encontrado', None) if saldo_actual is None else ('saldo_insuficiente', saldo_actual)
+    session_db.commit()
+    return 'ok', (fila.username, fila.saldo)
+
 async def adjust_saldo_final(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         monto = float(update.message.text)
@@ -274,20 +367,26 @@ async def adjust_saldo_final(update: Update, context: ContextTypes.DEFAULT_TYPE)
         
         if not user_id: return await cancel_conversation(update, context)
 
-        with get_session() as session_db:
-            usuario = session_db.query(Usuario).filter_by(id=user_id).first()
-            
-            if usuario:
-                usuario.saldo += monto
-                session_db.commit()
-                
-                await update.message.reply_text(
-                    f"✅ Saldo de **{usuario.username}** ajustado.\n"
-                    f"Monto aplicado: **${monto:.2f}**\n"
-                    f"Nuevo saldo: **${usuario.saldo:.2f}**",
-                    parse_mode='Markdown',
-                    reply_markup=get_admin_keyboard()
-                )
+        estado, datos = await ejecutar_db(_aplicar_ajuste_saldo, user_id, monto, update.effective_user.id)
+
+        if estado == 'saldo_insuficiente':
+            await update.message.reply_text(
+                f"❌ El ajuste dejaría el saldo bajo el mínimo permitido (${SALDO_MINIMO_AJUSTES:.2f}).\n"
+                f"Saldo actual: **${datos:.2f}**. Ingresa otro monto o usa /cancelar.",
+                parse_mode='Markdown'
+            )
+            return ADJUST_AMOUNT
+        if estado == 'no_encontrado':
+            await update.message.reply_text("❌ El socio ya no existe.", reply_markup=get_admin_keyboard())
+        else:
+            username, nuevo_saldo = datos
+            await update.message.reply_text(
+                f"✅ Saldo de **{username}** ajustado.\n"
+                f"Monto aplicado: **${monto:.2f}**\n"
+                f"Nuevo saldo: **${nuevo_saldo:.2f}**",
+                parse_mode='Markdown',
+                reply_markup=get_admin_keyboard()
+            )
     
     except ValueError:
         await update.message.reply_text("❌ Monto no válido. Ingresa un número (ej: 10.00 o -5.50).")
@@ -299,6 +398,77 @@ async def adjust_saldo_final(update: Update, context: ContextTypes.DEFAULT_TYPE)
     context.user_data.clear()
     return ConversationHandler.END
 
+# Flujo: carga masiva por CSV (/cargar_socios y /cargar_saldos)
+async def prompt_bulk_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    if not await check_admin(update): return ConversationHandler.END
+    await update.message.reply_text(
+        "Envía un archivo **.csv** con la cabecera `username,login_key,saldo,es_admin` "
+        "(saldo y es_admin son opcionales).\n"
+        "Si alguna fila tiene errores no se crea ningún socio y recibirás el reporte.\n"
+        "O escribe /cancelar para volver.",
+        parse_mode='Markdown',
+        reply_markup=ReplyKeyboardRemove()
+    )
+    return BULK_USERS_FILE
+
+async def prompt_bulk_saldo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    if not await check_admin(update): return ConversationHandler.END
+    await update.message.reply_text(
+        "Envía un archivo **.csv** con la cabecera `id,monto` o `username,monto` "
+        "(montos positivos suman, negativos restan).\n"
+        "Si alguna fila tiene errores no se aplica ningún ajuste y recibirás el reporte.\n"
+        "O escribe /cancelar para volver.",
+        parse_mode='Markdown',
+        reply_markup=ReplyKeyboardRemove()
+    )
+    return BULK_SALDO_FILE
+
+async def _procesar_carga_masiva(update, context, estado, cargar, obligatorias, alternativas, descripcion):
+    """Descarga el CSV, lo valida y aplica con 'cargar', y responde con el resumen o el reporte de errores."""
+    descriptor, ruta = tempfile.mkstemp(suffix='.csv')
+    os.close(descriptor)
+    try:
+        archivo = await update.message.document.get_file()
+        await archivo.download_to_drive(ruta)
+        filas = await ejecutar_en_hilo_db(leer_csv, ruta, obligatorias, alternativas)
+    except ArchivoInvalido as e:
+        await update.message.reply_text(f"❌ {e} Corrige el archivo y envíalo de nuevo, o usa /cancelar.")
+        return estado
+    except Exception as e:
+        logger.error(f"Error al leer CSV de carga masiva: {e}")
+        await update.message.reply_text("❌ No se pudo leer el archivo (máximo 20 MB). Usa /cancelar.")
+        return estado
+    finally:
+        os.remove(ruta)
+
+    try:
+        aplicadas, errores = await ejecutar_db(cargar, filas, update.effective_user.id)
+    except Exception as e:
+        logger.error(f"Error al aplicar carga masiva: {e}")
+        await update.message.reply_text("❌ Error al guardar los cambios; no se aplicó ninguna fila.", reply_markup=get_admin_keyboard())
+        context.user_data.clear()
+        return ConversationHandler.END
+
+    if errores:
+        await update.message.reply_document(
+            document=InputFile(reporte_errores(errores), filename="errores.csv"),
+            caption=f"❌ {len(errores)} filas con errores de {len(filas)}; no se aplicó ninguna. "
+                    "Corrige el archivo y envíalo de nuevo, o usa /cancelar."
+        )
+        return estado
+
+    await update.message.reply_text(f"✅ {aplicadas} {descripcion}.", reply_markup=get_admin_keyboard())
+    context.user_data.clear()
+    return ConversationHandler.END
+
+async def process_bulk_users_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    return await _procesar_carga_masiva(
+        update, context, BULK_USERS_FILE, cargar_socios, ('username', 'login_key'), (), "socios creados")
+
+async def process_bulk_saldo_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    return await _procesar_carga_masiva(
+        update, context, BULK_SALDO_FILE, cargar_ajustes, ('monto',), ('id', 'username'), "ajustes de saldo aplicados")
+
 
 # =================================================================
 # 4. Gestión de Productos/Keys
@@ -306,21 +476,19 @@ async def adjust_saldo_final(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 async def manage_products_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Muestra la lista de productos y un menú de acciones."""
-    if not check_admin(update): return
+    if not await check_admin(update): return
 
-    with get_session() as session_db:
-        productos = session_db.query(Producto).all()
-        message = "**Catálogo de Productos (ID | Nombre | Stock):**\n\n"
-        if not productos:
-            message += "No hay productos registrados. Usa '➕ Crear Producto'."
-        else:
-            for p in productos:
-                stock_available = session_db.query(Key).filter(Key.producto_id == p.id, Key.estado == 'available').count()
-                message += (
-                    f"ID: `{p.id}` | **{p.nombre}** (${p.precio:.2f})\n"
-                    f"   Stock: **{stock_available}**\n"
-                    "----------------------------------\n"
-                )
+    productos = await ejecutar_db(productos_con_stock)
+    message = "**Catálogo de Productos (ID | Nombre | Stock):**\n\n"
+    if not productos:
+        message += "No hay productos registrados. Usa '➕ Crear Producto'."
+    else:
+        for p, stock_available in productos:
+            message += (
+                f"ID: `{p.id}` | **{p.nombre}** (${p.precio:.2f})\n"
+                f"   Stock: **{stock_available}**\n"
+                "----------------------------------\n"
+            )
     
     keyboard = [
         [KeyboardButton("➕ Crear Producto")],
@@ -337,7 +505,7 @@ async def manage_products_menu(update: Update, context: ContextTypes.DEFAULT_TYP
     
 # Flujo: ➕ Crear Producto
 async def prompt_create_product(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    if not check_admin(update): return ConversationHandler.END
+    if not await check_admin(update): return ConversationHandler.END
     await update.message.reply_text("Ingresa el **Nombre del Producto**:", parse_mode='Markdown', reply_markup=ReplyKeyboardRemove())
     return CREATE_PRODUCT_NAME
 
@@ -361,31 +529,35 @@ async def get_product_price(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("❌ Precio no válido. Ingresa un número (ej: 10.00).")
         return CREATE_PRODUCT_PRICE
 
+@escritura_serializada
+def _crear_producto(session_db, nombre, categoria, precio, descripcion):
+    """Inserta un nuevo producto. Retorna (nombre, id)."""
+    nuevo_producto = Producto(nombre=nombre, categoria=categoria, precio=precio, descripcion=descripcion)
+    session_db.add(nuevo_producto)
+    incrementar_version_catalogo(session_db)
+    session_db.commit()
+    return nombre, nuevo_producto.id
+
 async def finish_create_product(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     desc = update.message.text if update.message.text and update.message.text != "/skip" else ""
     
-    db_session = get_session()
     try:
-        nuevo_producto = Producto(
-            nombre=context.user_data['temp_nombre'],
-            categoria=context.user_data['temp_categoria'],
-            precio=context.user_data['temp_precio'],
-            descripcion=desc
+        nombre, producto_id = await ejecutar_db(
+            _crear_producto,
+            context.user_data['temp_nombre'],
+            context.user_data['temp_categoria'],
+            context.user_data['temp_precio'],
+            desc
         )
-        db_session.add(nuevo_producto)
-        db_session.commit()
         
         await update.message.reply_text(
-            f"✅ Producto **{nuevo_producto.nombre}** (ID: {nuevo_producto.id}) creado exitosamente.", 
+            f"✅ Producto **{nombre}** (ID: {producto_id}) creado exitosamente.", 
             parse_mode='Markdown', 
             reply_markup=get_admin_keyboard()
         )
     except Exception as e:
         logger.error(f"Error al crear producto: {e}")
-        db_session.rollback()
         await update.message.reply_text("❌ Error al guardar el producto en la DB. Usa /cancelar.", reply_markup=get_admin_keyboard())
-    finally:
-        db_session.close()
     
     context.user_data.clear()
     return ConversationHandler.END
@@ -393,7 +565,7 @@ async def finish_create_product(update: Update, context: ContextTypes.DEFAULT_TY
 
 # Flujo: 🗑️ Eliminar Producto
 async def prompt_delete_product(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    if not check_admin(update): return ConversationHandler.END
+    if not await check_admin(update): return ConversationHandler.END
     
     await update.message.reply_text(
         "**ADVERTENCIA:** Esto eliminará el producto y TODAS las keys asociadas.\n"
@@ -403,44 +575,104 @@ async def prompt_delete_product(update: Update, context: ContextTypes.DEFAULT_TY
     )
     return DELETE_PRODUCT_ID
 
+# Purgas activas en este proceso: {product_id: tarea}.
+_PURGAS_EN_CURSO = {}
+
+async def _avisar_purga(mensaje, texto, **kwargs):
+    """Responde al admin que pidió la purga; un error de Telegram aquí no afecta a la purga."""
+    if mensaje is None:
+        return
+    try:
+        await mensaje.reply_text(texto, reply_markup=get_admin_keyboard(), **kwargs)
+    except TelegramError as e:
+        logger.warning(f"No se pudo avisar el resultado de la purga: {e}")
+
+async def _purgar_producto(product_id, nombre, pendientes, mensaje_progreso=None):
+    """Purga las keys del producto por bloques; con mensaje_progreso, reporta en él el avance."""
+    # La tarea hereda el contexto del update que la lanzó, pero no su unidad de trabajo.
+    desligar_unidad_de_trabajo()
+    progreso = MensajeProgreso(mensaje_progreso) if mensaje_progreso else None
+    borradas = 0
+    try:
+        while True:
+            bloque = await ejecutar_db(purgar_keys, product_id)
+            if not bloque:
+                break
+            borradas += bloque
+            if progreso:
+                await progreso.actualizar(
+                    f"⏳ Eliminando keys de {nombre}...\n"
+                    f"Borradas: {borradas} de {max(pendientes, borradas)}"
+                )
+        await ejecutar_db(eliminar_producto_purgado, product_id)
+    except Exception as e:
+        logger.error(f"Error en la purga de keys del producto {product_id}: {e}")
+        await _avisar_purga(
+            mensaje_progreso,
+            f"❌ La purga se detuvo tras borrar {borradas} keys. El producto ya no está en el catálogo; "
+            f"se retomará al reiniciar el bot, o vuelve a eliminar el ID {product_id} para retomarla ahora."
+        )
+        return
+    finally:
+        _PURGAS_EN_CURSO.pop(product_id, None)
+    logger.info(f"Purga del producto {product_id} ({nombre}) terminada: {borradas} keys borradas.")
+    await _avisar_purga(
+        mensaje_progreso,
+        f"✅ Producto **{nombre}** y sus {borradas} keys eliminados con éxito.",
+        parse_mode='Markdown'
+    )
+
+def _lanzar_purga(product_id, nombre, pendientes, mensaje_progreso=None):
+    """Inicia la purga como tarea de fondo, salvo que ya haya una en curso para el producto."""
+    if product_id in _PURGAS_EN_CURSO:
+        return False
+    # Tarea de asyncio (no de la Application): también se lanza desde post_init, antes de start().
+    _PURGAS_EN_CURSO[product_id] = asyncio.create_task(_purgar_producto(product_id, nombre, pendientes, mensaje_progreso))
+    return True
+
+async def iniciar_admin(application: Application) -> None:
+    """Hook post_init: verifica el esquema y retoma las purgas que un reinicio dejó a medias."""
+    await verificar_esquema(application)
+    for product_id, nombre, pendientes in await ejecutar_db(productos_pendientes_de_purga):
+        logger.info(f"Retomando la purga del producto {product_id} ({nombre}): {pendientes} keys pendientes.")
+        _lanzar_purga(product_id, nombre, pendientes)
+
 async def process_delete_product(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Da de baja el producto al instante y purga sus keys como tarea en segundo plano."""
     try:
         product_id = int(update.message.text)
     except ValueError:
         await update.message.reply_text("❌ ID no válido. Ingresa el número ID del producto.")
         return DELETE_PRODUCT_ID
 
-    db_session = get_session()
     try:
-        producto = db_session.query(Producto).filter_by(id=product_id).first()
-        if not producto:
+        baja = await ejecutar_db(marcar_producto_eliminado, product_id)
+        if baja is None:
             await update.message.reply_text("❌ Producto no encontrado. Ingresa un ID válido.")
             return DELETE_PRODUCT_ID
-
-        db_session.query(Key).filter_by(producto_id=product_id).delete()
-        db_session.delete(producto)
-        db_session.commit()
-
-        await update.message.reply_text(
-            f"✅ Producto **{producto.nombre}** y sus keys eliminados con éxito.",
-            parse_mode='Markdown',
-            reply_markup=get_admin_keyboard()
-        )
     except Exception as e:
         logger.error(f"Error al eliminar producto: {e}")
-        db_session.rollback()
         await update.message.reply_text("❌ Error inesperado al eliminar. Usa /cancelar.", reply_markup=get_admin_keyboard())
-    finally:
-        db_session.close()
-    
+        return ConversationHandler.END
+
+    nombre, pendientes = baja
+    if product_id in _PURGAS_EN_CURSO:
+        await update.message.reply_text(
+            f"⏳ Las keys de {nombre} ya se están eliminando en segundo plano.", reply_markup=get_admin_keyboard()
+        )
+        return ConversationHandler.END
+
+    mensaje_progreso = await update.message.reply_text(
+        f"🗑️ Producto {nombre} retirado del catálogo. Eliminando sus {pendientes} keys..."
+    )
+    _lanzar_purga(product_id, nombre, pendientes, mensaje_progreso)
     return ConversationHandler.END
 
 # Flujo: 🔑 Añadir Keys
 async def show_key_management_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    if not check_admin(update): return ConversationHandler.END
+    if not await check_admin(update): return ConversationHandler.END
     
-    with get_session() as session_db:
-        productos = session_db.query(Producto).all() 
+    productos = await ejecutar_db(productos_con_stock)
 
     if not productos:
         await update.message.reply_text("❌ No hay productos registrados. Usa '➕ Crear Producto'.", reply_markup=get_admin_keyboard())
@@ -448,9 +680,7 @@ async def show_key_management_menu(update: Update, context: ContextTypes.DEFAULT
     
     keyboard_rows = []
     message = "**Productos disponibles para añadir Keys:**\n\n"
-    for p in productos:
-        with get_session() as s:
-            stock = s.query(Key).filter(Key.producto_id == p.id, Key.estado == 'available').count()
+    for p, stock in productos:
         message += f"ID: `{p.id}` | **{p.nombre}** - Stock: {stock}\n"
         keyboard_rows.append([KeyboardButton(f"ID {p.id}: {p.nombre}")])
 
@@ -476,9 +706,10 @@ async def select_product_for_keys(update: Update, context: ContextTypes.DEFAULT_
         await update.message.reply_text("❌ Opción no válida. Ingresa el ID numérico del producto.")
         return ADD_KEYS_PRODUCT
 
-    with get_session() as session_db:
-        producto = session_db.query(Producto).filter_by(id=product_id).first()
-        
+    producto = await ejecutar_db(
+        lambda session_db: session_db.query(Producto).filter_by(id=product_id, eliminado_en=None).first()
+    )
+
     if not producto:
         await update.message.reply_text("❌ Producto no encontrado. Ingresa un ID válido.")
         return ADD_KEYS_PRODUCT
@@ -488,7 +719,8 @@ async def select_product_for_keys(update: Update, context: ContextTypes.DEFAULT_
 
     await update.message.reply_text(
         f"Producto seleccionado: **{producto.nombre}**\n\n"
-        "Ahora, **pega las licencias/keys, una por línea**.",
+        "Ahora, **pega las licencias/keys, una por línea**, o envía un archivo **.txt/.csv** "
+        "(una licencia por línea o en la primera columna).",
         parse_mode='Markdown',
         reply_markup=ReplyKeyboardRemove()
     )
@@ -511,55 +743,206 @@ async def process_add_licenses(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text("❌ No se detectó ninguna key válida. Intenta de nuevo.")
         return ADD_KEYS_LICENSES
         
-    added_keys = 0
-    db_session = get_session() 
     try:
-        for lic in keys_list:
-            existing_key = db_session.query(Key).filter_by(licencia=lic).first()
-            if not existing_key:
-                nueva_key = Key(producto_id=product_id, licencia=lic, estado='available')
-                db_session.add(nueva_key)
-                added_keys += 1
-            else:
-                logger.warning(f"Key duplicada omitida: {lic}")
-        
-        db_session.commit()
+        added_keys, duplicadas = await ejecutar_db(insertar_licencias, product_id, keys_list)
 
         await update.message.reply_text(
             f"✅ Keys agregadas a **{product_name}**:\n"
-            f"Se agregaron **{added_keys}** nuevas licencias.",
+            f"Se agregaron **{added_keys}** nuevas licencias ({duplicadas} duplicadas omitidas).",
             parse_mode='Markdown',
             reply_markup=get_admin_keyboard()
         )
     except Exception as e:
         logger.error(f"Error al añadir keys: {e}")
-        db_session.rollback()
         await update.message.reply_text("❌ Error al guardar las keys. Usa /cancelar.", reply_markup=get_admin_keyboard())
+    
+    context.user_data.clear()
+    return ConversationHandler.END
+
+async def _importar_archivo_licencias(mensaje_progreso, ruta, product_id, product_name):
+    """Importa el archivo en bloques, reportando el avance en el mensaje de progreso."""
+    insertadas = duplicadas = 0
+    progreso = MensajeProgreso(mensaje_progreso)
+    bloques = leer_licencias(ruta)
+    try:
+        while True:
+            bloque = await ejecutar_en_hilo_db(next, bloques, None)
+            if bloque is None:
+                break
+            nuevas, repetidas = await ejecutar_db(insertar_licencias, product_id, bloque)
+            insertadas += nuevas
+            duplicadas += repetidas
+            await progreso.actualizar(
+                f"⏳ Importando keys para {product_name}...\n"
+                f"Procesadas: {insertadas + duplicadas} | Nuevas: {insertadas} | Duplicadas: {duplicadas}"
+            )
+
+        await mensaje_progreso.reply_text(
+            f"✅ Importación completada para **{product_name}**:\n"
+            f"Nuevas: **{insertadas}** | Duplicadas omitidas: **{duplicadas}**",
+            parse_mode='Markdown',
+            reply_markup=get_admin_keyboard()
+        )
+    except Exception as e:
+        logger.error(f"Error en importación masiva de keys: {e}")
+        await mensaje_progreso.reply_text(
+            f"❌ La importación se detuvo por un error. Se alcanzaron a guardar {insertadas} keys nuevas.",
+            reply_markup=get_admin_keyboard()
+        )
     finally:
-        db_session.close()
+        bloques.close()
+        os.remove(ruta)
+
+async def process_license_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Recibe un .txt/.csv de licencias y lo importa como tarea en segundo plano."""
+    product_id = context.user_data.get('product_to_add_keys_id')
+    product_name = context.user_data.get('product_to_add_keys_name')
     
+    if not product_id:
+        return await cancel_conversation(update, context)
+
+    documento = update.message.document
+    descriptor, ruta = tempfile.mkstemp(suffix=os.path.splitext(documento.file_name or '')[1].lower() or '.txt')
+    os.close(descriptor)
+    try:
+        archivo = await documento.get_file()
+        await archivo.download_to_drive(ruta)
+    except Exception as e:
+        os.remove(ruta)
+        logger.error(f"Error al descargar archivo de keys: {e}")
+        await update.message.reply_text("❌ No se pudo descargar el archivo (máximo 20 MB). Usa /cancelar.")
+        return ADD_KEYS_LICENSES
+
+    mensaje_progreso = await update.message.reply_text(f"⏳ Importando keys para {product_name}...")
+    lanzar_en_segundo_plano(
+        context,
+        _importar_archivo_licencias(mensaje_progreso, ruta, product_id, product_name),
+        update=update
+    )
+
     context.user_data.clear()
     return ConversationHandler.END
 
+async def reconcile_stock(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Recalcula los contadores de stock desde 'keys' y reporta la deriva encontrada."""
+    if not await check_admin(update): return
+
+    # Un lote por llamada: entre lotes, las compras no esperan al recuento completo.
+    deriva = []
+    for producto_ids in await ejecutar_db(lotes_de_productos):
+        deriva += await ejecutar_db(reconciliar_lote, producto_ids)
+    if not deriva:
+        message = "✅ Contadores de stock consistentes."
+    else:
+        message = f"⚠️ Se corrigieron **{len(deriva)}** productos (disponibles/vendidas):\n\n"
+        for pid, nombre, actual, esperado in deriva:
+            message += f"ID: `{pid}` | **{nombre}**: {actual[0]}/{actual[1]} → {esperado[0]}/{esperado[1]}\n"
+
+    await update.message.reply_text(message, parse_mode='Markdown', reply_markup=get_admin_keyboard())
+
+async def show_auth_cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Muestra los aciertos/fallos de la caché de autorización."""
+    if not await check_admin(update): return
+
+    aciertos, fallos, entradas = CACHE_ADMIN.estadisticas()
+    total = aciertos + fallos
+    ratio = (aciertos / total * 100) if total else 0.0
+    await update.message.reply_text(
+        f"🔐 **Caché de autorización**\n"
+        f"Aciertos: `{aciertos}` | Fallos: `{fallos}` ({ratio:.1f}% aciertos)\n"
+        f"Entradas: `{entradas}` | TTL: `{CACHE_ADMIN.ttl:.0f}s`",
+        parse_mode='Markdown',
+        reply_markup=get_admin_keyboard()
+    )
+
+async def _enviar_exportacion(mensaje_progreso, tipo, filtros):
+    """Genera la exportación en un archivo temporal y la envía como documento."""
+    descriptor, ruta = tempfile.mkstemp(suffix='.csv.gz')
+    os.close(descriptor)
+    try:
+        filas = await ejecutar_db(exportar_csv, tipo, ruta, **filtros)
+        with open(ruta, 'rb') as archivo:
+            await mensaje_progreso.reply_document(
+                document=archivo,
+                filename=f"{tipo}_{datetime.now():%Y%m%d_%H%M%S}.csv.gz",
+                caption=f"✅ Exportación de {tipo}: {filas} filas."
+            )
+        await mensaje_progreso.delete()
+    except Exception as e:
+        logger.error(f"Error al exportar {tipo}: {e}")
+        await mensaje_progreso.edit_text(
+            f"❌ No se pudo generar o enviar la exportación de {tipo}. "
+            "Si es demasiado grande, usa python db_export.py en el servidor."
+        )
+    finally:
+        os.remove(ruta)
+
+async def export_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/exportar <keys|socios|ventas> [producto_id] [estado]: envía un CSV comprimido generado en segundo plano."""
+    if not await check_admin(update): return
+
+    args = context.args or []
+    tipo = args[0].lower() if args else None
+    filtros = {}
+    if tipo == 'keys':
+        for arg in args[1:]:
+            if arg.isdigit():
+                filtros['producto_id'] = int(arg)
+            elif arg.lower() in ESTADOS_KEY:
+                filtros['estado'] = arg.lower()
+            else:
+                tipo = None
+    elif len(args) != 1:
+        tipo = None
+
+    if tipo not in EXPORTACIONES:
+        await update.message.reply_text(
+            "Uso:\n"
+            "/exportar keys [producto_id] [available|used]\n"
+            "/exportar socios\n"
+            "/exportar ventas",
+            reply_markup=get_admin_keyboard()
+        )
+        return
+
+    mensaje_progreso = await update.message.reply_text(f"⏳ Generando exportación de {tipo}...")
+    lanzar_en_segundo_plano(context, _enviar_exportacion(mensaje_progreso, tipo, filtros), update=update)
+
 async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if check_admin(update) and update.message: 
+    if await check_admin(update) and update.message: 
         await update.message.reply_text("Opción no reconocida. Usa los botones o /start para volver al menú principal.", reply_markup=get_admin_keyboard())
 
 # =================================================================
 # 5. Función Principal de Ejecución del Bot Administrador
 # =================================================================
 
-def main_admin() -> None:
-    """Ejecuta el bot administrador."""
-    application = Application.builder().token(ADMIN_TOKEN_STR).build()
+def crear_aplicacion() -> Application:
+    """Construye la Application con todos sus handlers registrados."""
+    application = (
+        Application.builder()
+        .token(ADMIN_TOKEN_STR)
+        .base_url(TELEGRAM_API_URL)
+        .base_file_url(TELEGRAM_FILE_URL)
+        .application_class(AplicacionBot)
+        .context_types(ContextTypes(context=ContextoBot))
+        .post_init(iniciar_admin)
+        .concurrent_updates(ProcesadorPorUsuario())
+        .build()
+    )
+    application.add_error_handler(marcar_update_fallido)
     
     # LOGIN DE ADMINISTRADORES (maneja el comando /login)
     application.add_handler(CommandHandler("login", admin_login_prompt))
     
     # Handlers para comandos y botones simples
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("reconciliar", reconcile_stock))
+    application.add_handler(CommandHandler("authcache", show_auth_cache_stats))
+    application.add_handler(CommandHandler("exportar", export_data))
     application.add_handler(MessageHandler(filters.Regex("^Go back$") | filters.Regex("^Back to Admin Menu$"), start))
     application.add_handler(MessageHandler(filters.Regex("^👤 Listar Socios$"), list_users))
+    application.add_handler(CommandHandler("socios", list_users))
+    application.add_handler(CallbackQueryHandler(paginate_users, pattern=r"^socios:[as]:\d+(:.+)?$"))
     application.add_handler(MessageHandler(filters.Regex("^📦 Gestión Productos$"), manage_products_menu))
 
     # Flujo de Ajuste de Saldo
@@ -588,6 +971,18 @@ def main_admin() -> None:
     )
     application.add_handler(create_user_conv_handler)
 
+    # Flujos de Carga Masiva por CSV (socios y ajustes de saldo)
+    bulk_conv_handler = ConversationHandler(
+        entry_points=[CommandHandler("cargar_socios", prompt_bulk_users), CommandHandler("cargar_saldos", prompt_bulk_saldo)],
+        states={
+            BULK_USERS_FILE: [MessageHandler(filters.Document.FileExtension("csv"), process_bulk_users_file)],
+            BULK_SALDO_FILE: [MessageHandler(filters.Document.FileExtension("csv"), process_bulk_saldo_file)],
+        },
+        fallbacks=[CommandHandler("cancelar", cancel_conversation), CommandHandler("start", start)],
+        per_user=True
+    )
+    application.add_handler(bulk_conv_handler)
+
     # Flujo de Creación de Producto
     product_conv_handler = ConversationHandler(
         entry_points=[MessageHandler(filters.Regex("^➕ Crear Producto$"), prompt_create_product)],
@@ -618,7 +1013,10 @@ def main_admin() -> None:
         entry_points=[MessageHandler(filters.Regex("^🔑 Añadir Keys$"), show_key_management_menu)],
         states={
             ADD_KEYS_PRODUCT: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_product_for_keys)],
-            ADD_KEYS_LICENSES: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_add_licenses)],
+            ADD_KEYS_LICENSES: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, process_add_licenses),
+                MessageHandler(filters.Document.FileExtension("txt") | filters.Document.FileExtension("csv"), process_license_file),
+            ],
         },
         fallbacks=[CommandHandler("cancelar", cancel_conversation), CommandHandler("start", start)],
         per_user=True
@@ -628,8 +1026,18 @@ def main_admin() -> None:
     # Manejador general para texto no reconocido
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, unknown))
 
+    instrumentar_aplicacion(application, 'admin')
+    return application
+
+def main_admin() -> None:
+    """Ejecuta el bot administrador."""
+    application = crear_aplicacion()
+
     logger.info("El Bot ADMINISTRADOR se está iniciando...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if modo_webhook():
+        asyncio.run(ejecutar_webhook({'admin': application}, int(os.getenv('WEBHOOK_ADMIN_PORT', '8081'))))
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == '__main__':
@@ -1,10 +1,22 @@
 import os
+import io
+import asyncio
 import logging
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler
+from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
+from telegram.error import TelegramError
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes, ConversationHandler
 from sqlalchemy.orm.exc import NoResultFound
-from db_models import Usuario, Producto, Key, inicializar_db, get_session 
+from db_models import Usuario, ejecutar_db, lectura_idempotente, escritura_serializada
+from db_stock import stock_disponible
+from catalog_cache import CACHE_CATALOGO
+from db_purchases import comprar_key, comprar_keys, COMPRA_MAX_CANTIDAD
+from db_ledger import pagina_transacciones, TIPO_COMPRA
+from auth_cache import CACHE_ADMIN
 from dotenv import load_dotenv
+from bot_middleware import AplicacionBot, ContextoBot, ProcesadorPorUsuario, marcar_update_fallido, TELEGRAM_API_URL, TELEGRAM_FILE_URL
+from metrics import instrumentar_aplicacion
+from webhook_server import modo_webhook, ejecutar_webhook
+from db_migrations import verificar_esquema
 
 # =================================================================
 # 1. Configuración Inicial (Lectura de Variables de Entorno)
@@ -14,13 +26,11 @@ TOKEN = os.getenv('BOT_MAIN_TOKEN')
 if not TOKEN:
     raise ValueError("Error: BOT_MAIN_TOKEN no encontrado. Verifica las variables de entorno.")
 
-inicializar_db() 
-
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # --- Estados del ConversationHandler ---
-LOGIN_KEY, BUY_CATEGORY, BUY_PRODUCT = range(3)
+LOGIN_KEY = 0
 
 # =================================================================
 # 2. Funciones de Utilidad y Teclados
@@ -43,12 +53,16 @@ def get_keyboard_main(is_logged_in):
 # 3. Handlers de Inicio y Login
 # =================================================================
 
+@lectura_idempotente
+def _buscar_usuario(session_db, telegram_id):
+    """Retorna el usuario asociado a un telegram_id (o None)."""
+    return session_db.query(Usuario).filter_by(telegram_id=telegram_id).first()
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Muestra el mensaje de bienvenida y el teclado de login/menu."""
     user_id_telegram = update.effective_user.id
     
-    with get_session() as session_db:
-        usuario = session_db.query(Usuario).filter_by(telegram_id=user_id_telegram).first() 
+    usuario = await ejecutar_db(_buscar_usuario, user_id_telegram)
 
     if usuario:
         await update.message.reply_text(
@@ -74,6 +88,20 @@ async def show_login_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
     return LOGIN_KEY
 
+@escritura_serializada
+def _vincular_login(session_db, username, login_key_input, user_id_telegram):
+    """Valida credenciales y asocia el telegram_id. Retorna 'ok', 'id_en_uso' o 'fallido'."""
+    usuario = session_db.query(Usuario).filter_by(username=username, login_key=login_key_input).first()
+    if not usuario:
+        return 'fallido'
+
+    if usuario.telegram_id is None:
+        if session_db.query(Usuario).filter_by(telegram_id=user_id_telegram).first() is not None:
+            return 'id_en_uso'
+        usuario.telegram_id = user_id_telegram
+        session_db.commit()
+    return 'ok'
+
 async def handle_login_key(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Procesa el login_key y la contraseña ingresada."""
     text = update.message.text
@@ -83,7 +111,6 @@ async def handle_login_key(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
     parts = text.split()
     
-    session_db = get_session()
     try:
         if len(parts) != 2:
             await update.message.reply_text(
@@ -95,25 +122,21 @@ async def handle_login_key(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         username, login_key_input = parts
         user_id_telegram = update.effective_user.id
 
-        usuario = session_db.query(Usuario).filter_by(username=username, login_key=login_key_input).first()
-
-        if usuario:
-            if usuario.telegram_id is None:
-                if session_db.query(Usuario).filter_by(telegram_id=user_id_telegram).first() is None:
-                    usuario.telegram_id = user_id_telegram
-                    session_db.commit()
-                else:
-                    await update.message.reply_text(
-                        "❌ Tu ID de Telegram ya está en uso. Desloguea la cuenta anterior o contacta al administrador."
-                    )
-                    return LOGIN_KEY
+        resultado = await ejecutar_db(_vincular_login, username, login_key_input, user_id_telegram)
 
+        if resultado == 'ok':
+            CACHE_ADMIN.invalidar(user_id_telegram)
             await update.message.reply_text(
                 "✅ **You have been successfully authorized!**",
                 parse_mode='Markdown',
                 reply_markup=get_keyboard_main(True)
             )
             return ConversationHandler.END
+        elif resultado == 'id_en_uso':
+            await update.message.reply_text(
+                "❌ Tu ID de Telegram ya está en uso. Desloguea la cuenta anterior o contacta al administrador."
+            )
+            return LOGIN_KEY
         else:
             await update.message.reply_text(
                 "❌ Login failed. Incorrect credentials or user not found. Try again, or type /start."
@@ -121,23 +144,25 @@ async def handle_login_key(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             return LOGIN_KEY
     except Exception as e:
         logger.error(f"Error en handle_login_key: {e}")
-        session_db.rollback()
         await update.message.reply_text("Ha ocurrido un error inesperado. Intenta de nuevo o usa /start.")
         return ConversationHandler.END
-    finally:
-        session_db.close()
+
+@escritura_serializada
+def _desvincular_usuario(session_db, user_id_telegram):
+    """Desasocia el telegram_id de su usuario. Retorna True si había sesión activa."""
+    usuario = session_db.query(Usuario).filter_by(telegram_id=user_id_telegram).first()
+    if not usuario:
+        return False
+    usuario.telegram_id = None
+    session_db.commit()
+    return True
 
 async def logout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Cierra la sesión del usuario desasociando el telegram_id."""
     user_id_telegram = update.effective_user.id
-    is_logged_in = False
     
-    with get_session() as session_db:
-        usuario = session_db.query(Usuario).filter_by(telegram_id=user_id_telegram).first()
-        if usuario:
-            usuario.telegram_id = None
-            session_db.commit()
-            is_logged_in = True
+    is_logged_in = await ejecutar_db(_desvincular_usuario, user_id_telegram)
+    CACHE_ADMIN.invalidar(user_id_telegram)
     
     if is_logged_in:
         await update.message.reply_text(
@@ -150,181 +175,287 @@ async def logout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             reply_markup=get_keyboard_main(False)
         )
         
+# Historial en "👤 Account": hist:a:<id> (más nuevos) / hist:s:<id> (más antiguos)
+CB_HISTORIAL = "hist:"
+
+def _mensaje_cuenta(usuario, movimientos, hay_mas_nuevas, hay_mas_antiguas):
+    """Construye el texto de la cuenta con una página del historial y sus botones inline."""
+    message = (
+        f"👤 **Your account:**\n"
+        f"• Login: **{usuario.username}**\n"
+        f"• Saldo: **${usuario.saldo:.2f}**\n\n"
+        f"🧾 **History:**\n"
+    )
+    if not movimientos:
+        message += "No transactions yet."
+    for t in movimientos:
+        concepto = f"Purchase `{t.detalle}`" if t.tipo == TIPO_COMPRA else "Balance adjustment"
+        message += (
+            f"• {t.fecha:%Y-%m-%d %H:%M} | {concepto}\n"
+            f"   `{t.monto:+.2f}` → Saldo `${t.saldo_resultante:.2f}`\n"
+        )
+
+    botones = []
+    if hay_mas_nuevas:
+        botones.append(InlineKeyboardButton("⬅️ Newer", callback_data=f"{CB_HISTORIAL}a:{movimientos[0].id}"))
+    if hay_mas_antiguas:
+        botones.append(InlineKeyboardButton("Older ➡️", callback_data=f"{CB_HISTORIAL}s:{movimientos[-1].id}"))
+    return message, (InlineKeyboardMarkup([botones]) if botones else None)
+
 async def show_account(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Muestra la información de la cuenta."""
+    """Muestra la información de la cuenta con la página más reciente del historial."""
     user_id_telegram = update.effective_user.id
     
-    with get_session() as session_db:
-        usuario = session_db.query(Usuario).filter_by(telegram_id=user_id_telegram).first()
+    usuario = await ejecutar_db(_buscar_usuario, user_id_telegram)
     
     if usuario:
-        message = (
-            f"👤 **Your account:**\n"
-            f"• Login: **{usuario.username}**\n"
-            f"• Saldo: **${usuario.saldo:.2f}**\n\n"
-            f"// Historial de compras/recargas no implementado //"
-        )
+        pagina = await ejecutar_db(pagina_transacciones, user_id_telegram)
+        message, reply_markup = _mensaje_cuenta(usuario, *pagina)
         
         await update.message.reply_text(
             message,
             parse_mode='Markdown',
-            reply_markup=get_keyboard_main(True)
+            reply_markup=reply_markup or get_keyboard_main(True)
         )
     else:
         await update.message.reply_text("Please log in first using /start or the Login button.")
+
+async def paginate_history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Navega por el historial de la cuenta editando el mismo mensaje."""
+    query = update.callback_query
+    usuario = await ejecutar_db(_buscar_usuario, update.effective_user.id)
+    if usuario is None:
+        await query.answer("Please log in first.", show_alert=True)
+        return
+    await query.answer()
+
+    _, direccion, cursor = query.data.split(':')
+    if direccion == 's':
+        pagina = await ejecutar_db(pagina_transacciones, usuario.telegram_id, mas_antiguas_que=int(cursor))
+    else:
+        pagina = await ejecutar_db(pagina_transacciones, usuario.telegram_id, mas_nuevas_que=int(cursor))
+
+    message, reply_markup = _mensaje_cuenta(usuario, *pagina)
+    await query.edit_message_text(message, parse_mode='Markdown', reply_markup=reply_markup)
         
 # =================================================================
 # 4. Handlers de Compra (Buy keys) - Lógica de Inventario
 # =================================================================
 
-async def show_buy_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Muestra las categorías de productos."""
-    user_id_telegram = update.effective_user.id
-    
-    with get_session() as session_db:
-        usuario = session_db.query(Usuario).filter_by(telegram_id=user_id_telegram).first()
-        
-        if not usuario:
-            await update.message.reply_text("❌ Please log in first.")
-            return ConversationHandler.END
+# callback_data compacto (límite de 64 bytes de Telegram):
+#   "bm"        -> menú de categorías
+#   "bc:<id>"   -> categoría del producto <id>
+#   "bp:<id>"   -> comprar el producto <id>
+CB_MENU, CB_CATEGORIA, CB_PRODUCTO = "bm", "bc:", "bp:"
+# Compra por lote: bq:<producto> abre el selector de cantidad, bn:<producto>:<cantidad> compra.
+CB_CANTIDAD, CB_LOTE = "bq:", "bn:"
+CANTIDADES_LOTE = (5, 10, 20, 50, 100)
+# Las licencias van en el mensaje si el texto cabe en el límite de Telegram;
+# si no, o si el envío falla, se entregan como documento .txt.
+MAX_CARACTERES_MENSAJE = 4096
+
+def _teclado_categorias(catalogo):
+    """Teclado inline de categorías, construido una sola vez por versión del catálogo."""
+    if 'teclado_categorias' not in catalogo.vistas:
+        keyboard_rows = [
+            [InlineKeyboardButton(categoria, callback_data=f"{CB_CATEGORIA}{productos[0][0]}")]
+            for categoria, productos in catalogo.productos_por_categoria.items() if categoria
+        ]
+        catalogo.vistas['teclado_categorias'] = InlineKeyboardMarkup(keyboard_rows)
+    return catalogo.vistas['teclado_categorias']
 
-        categorias = session_db.query(Producto.categoria).distinct().all()
-    
-    keyboard_rows = []
-    for cat_tuple in categorias:
-        categoria = cat_tuple[0]
-        if categoria: 
-            keyboard_rows.append([KeyboardButton(categoria)])
-            
-    keyboard_rows.append([KeyboardButton("Back")]) 
+async def show_buy_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Muestra las categorías de productos (mensaje nuevo, o editado si viene de un botón inline)."""
+    query = update.callback_query
+    catalogo = await CACHE_CATALOGO.obtener()
 
-    reply_markup = ReplyKeyboardMarkup(keyboard_rows, resize_keyboard=True, one_time_keyboard=False)
+    if query:
+        await query.answer()
+        await query.edit_message_text("Choose a category:", reply_markup=_teclado_categorias(catalogo))
+        return
 
-    await update.message.reply_text(
-        "Choose a category:",
-        reply_markup=reply_markup
-    )
-    return BUY_CATEGORY
+    usuario = await ejecutar_db(_buscar_usuario, update.effective_user.id)
+    if usuario is None:
+        await update.message.reply_text("❌ Please log in first.")
+        return
 
-async def handle_category_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Maneja la selección de la categoría y muestra los productos y acciones."""
-    category = update.message.text
-    
-    if category == "Back":
-        return await start(update, context) 
+    await update.message.reply_text("Choose a category:", reply_markup=_teclado_categorias(catalogo))
 
-    with get_session() as session_db:
-        productos = session_db.query(Producto).filter_by(categoria=category).all()
+async def handle_category_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Muestra los productos de la categoría elegida editando el mismo mensaje."""
+    query = update.callback_query
+    await query.answer()
 
-    if not productos:
-        await update.message.reply_text(f"❌ No products found in category: **{category}**", parse_mode='Markdown')
-        return BUY_CATEGORY
+    catalogo = await CACHE_CATALOGO.obtener()
+    producto = catalogo.productos_por_id.get(int(query.data[len(CB_CATEGORIA):]))
+    productos = catalogo.productos_por_categoria.get(producto[2]) if producto else None
 
-    context.user_data['selected_category'] = category
+    if not productos:
+        await query.edit_message_text("❌ This category is no longer available.", reply_markup=_teclado_categorias(catalogo))
+        return
+
+    category = producto[2]
+    # El catálogo viene de la caché; solo el stock se lee de la DB.
+    stock = await ejecutar_db(stock_disponible, category)
+
+    product_keys = [
+        [
+            InlineKeyboardButton(
+                f"{nombre} - ${precio:.2f} (Stock: {stock.get(producto_id, 0)})",
+                callback_data=f"{CB_PRODUCTO}{producto_id}"
+            ),
+            InlineKeyboardButton("🔢 Qty", callback_data=f"{CB_CANTIDAD}{producto_id}"),
+        ]
+        for producto_id, nombre, _, precio in productos
+    ]
+    product_keys.append([InlineKeyboardButton("⬅️ Go back", callback_data=CB_MENU)])
 
-    product_keys = []
-    
-    for producto in productos:
-        with get_session() as s:
-            stock = s.query(Key).filter(Key.producto_id == producto.id, Key.estado == 'available').count()
-        
-        button_text = f"{producto.nombre} - ${producto.precio:.2f} (Stock: {stock})"
-        product_keys.append([KeyboardButton(button_text)])
-            
-    product_keys.append([KeyboardButton("Go back")])
-    
-    reply_markup = ReplyKeyboardMarkup(product_keys, resize_keyboard=True, one_time_keyboard=False)
-    
-    await update.message.reply_text(
+    await query.edit_message_text(
         f"Choose a product in category {category}:",
-        reply_markup=reply_markup
+        reply_markup=InlineKeyboardMarkup(product_keys)
     )
-    return BUY_PRODUCT
 
+async def handle_final_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Compra el producto elegido (resuelto por ID) y entrega la key."""
+    query = update.callback_query
+    producto_id = int(query.data[len(CB_PRODUCTO):])
 
-async def handle_final_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Procesa las selecciones de compra (Buy)."""
-    text = update.message.text
-    user_id_telegram = update.effective_user.id
-    
-    if text == "Go back":
-        return await show_buy_menu(update, context)
-    
-    session_db = get_session()
     try:
-        parts = text.rsplit(' - $', 1) 
-        if len(parts) != 2:
-            raise ValueError("Invalid product format.")
-            
-        product_name = parts[0].strip()
-        price_str = parts[1].split('(')[0].strip() 
-        price = float(price_str.replace('$', '').replace(',', '.'))
-        
-        usuario = session_db.query(Usuario).filter_by(telegram_id=user_id_telegram).first()
-        producto = session_db.query(Producto).filter_by(nombre=product_name).first()
-
-        if not usuario or not producto:
-            await update.message.reply_text("❌ Error interno: Usuario o producto no encontrado.", reply_markup=get_keyboard_main(True))
-            return ConversationHandler.END
+        estado, datos = await ejecutar_db(comprar_key, update.effective_user.id, producto_id)
+    except Exception as e:
+        logger.error(f"Error en la transacción: {e}")
+        await query.answer("❌ Ocurrió un error en la compra. Intenta de nuevo o usa /start.", show_alert=True)
+        return
+
+    # Los fallos se notifican con una alerta y el menú de productos queda intacto.
+    if estado == 'no_encontrado':
+        await query.answer("❌ Error interno: Usuario o producto no encontrado.", show_alert=True)
+        return
+
+    if estado == 'saldo_insuficiente':
+        await query.answer(f"❌ Saldo insuficiente. Tu saldo es: ${datos:.2f}", show_alert=True)
+        return
+
+    if estado == 'agotado':
+        await query.answer(f"❌ Producto agotado. No hay claves disponibles para {datos}.", show_alert=True)
+        return
+
+    # Éxito y Entrega de Clave: mensaje propio para que la key no se pierda al
+    # seguir navegando; el menú de productos queda disponible para otra compra.
+    await query.answer()
+    await query.message.reply_text(
+        f"🎉 **Compra Exitosa de {datos['producto']}!**\n"
+        f"Costo: **${datos['precio']:.2f}**\n"
+        f"Tu nuevo saldo: **${datos['saldo']:.2f}**\n\n"
+        f"🔐 **Tu Key/Licencia:** `{datos['licencia']}`", 
+        parse_mode='Markdown'
+    )
 
-        # 1. Verificar Saldo
-        if usuario.saldo < price:
-            await update.message.reply_text(f"❌ Saldo insuficiente. Tu saldo es: ${usuario.saldo:.2f}", reply_markup=update.message.reply_markup)
-            return BUY_PRODUCT
-            
-        # 2. Buscar Key Disponible (Inventario)
-        available_key = session_db.query(Key).filter_by(
-            producto_id=producto.id, 
-            estado='available'
-        ).with_for_update().first() 
-
-        if not available_key:
-            await update.message.reply_text(f"❌ Producto agotado. No hay claves disponibles para {producto.nombre}.", reply_markup=update.message.reply_markup)
-            return BUY_PRODUCT
-            
-        # 3. Realizar la Transacción
-        usuario.saldo -= price
-        available_key.estado = 'used'
-        
-        session_db.commit()
+async def show_quantity_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Muestra las cantidades disponibles para comprar un lote del producto elegido."""
+    query = update.callback_query
+    await query.answer()
+
+    producto_id = int(query.data[len(CB_CANTIDAD):])
+    catalogo = await CACHE_CATALOGO.obtener()
+    producto = catalogo.productos_por_id.get(producto_id)
+    if producto is None:
+        await query.edit_message_text("❌ This product is no longer available.", reply_markup=_teclado_categorias(catalogo))
+        return
+
+    _, nombre, categoria, precio = producto
+    disponibles = (await ejecutar_db(stock_disponible, categoria)).get(producto_id, 0)
+    cantidades = [n for n in CANTIDADES_LOTE if n <= min(disponibles, COMPRA_MAX_CANTIDAD)]
+    botones = [
+        InlineKeyboardButton(f"{n} (${precio * n:.2f})", callback_data=f"{CB_LOTE}{producto_id}:{n}")
+        for n in cantidades
+    ]
+    filas = [botones[i:i + 3] for i in range(0, len(botones), 3)]
+    filas.append([InlineKeyboardButton("⬅️ Go back", callback_data=f"{CB_CATEGORIA}{producto_id}")])
+
+    texto = f"How many keys of {nombre}? (${precio:.2f} each, Stock: {disponibles})"
+    if not cantidades:
+        texto += "\nNot enough stock for a bulk purchase."
+    await query.edit_message_text(texto, reply_markup=InlineKeyboardMarkup(filas))
+
+async def handle_bulk_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Compra un lote de keys con un solo débito y las entrega en un mensaje o en un .txt."""
+    query = update.callback_query
+    producto_id, cantidad = (int(v) for v in query.data[len(CB_LOTE):].split(':'))
+    if not 1 <= cantidad <= COMPRA_MAX_CANTIDAD:
+        await query.answer("❌ Cantidad no válida.", show_alert=True)
+        return
 
-        # 4. Éxito y Entrega de Clave
-        await update.message.reply_text(
-            f"🎉 **Compra Exitosa de {producto.nombre}!**\n"
-            f"Costo: **${price:.2f}**\n"
-            f"Tu nuevo saldo: **${usuario.saldo:.2f}**\n\n"
-            f"🔐 **Tu Key/Licencia:** `{available_key.licencia}`", 
-            parse_mode='Markdown'
+    try:
+        estado, datos = await ejecutar_db(comprar_keys, update.effective_user.id, producto_id, cantidad)
+    except Exception as e:
+        logger.error(f"Error en la compra por lote: {e}")
+        await query.answer("❌ Ocurrió un error en la compra. Intenta de nuevo o usa /start.", show_alert=True)
+        return
+
+    if estado == 'no_encontrado':
+        await query.answer("❌ Error interno: Usuario o producto no encontrado.", show_alert=True)
+        return
+
+    if estado == 'saldo_insuficiente':
+        await query.answer(f"❌ Saldo insuficiente. Tu saldo es: ${datos:.2f}", show_alert=True)
+        return
+
+    if estado == 'agotado':
+        await query.answer(
+            f"❌ Stock insuficiente de {datos['producto']}: quedan {datos['disponibles']} claves disponibles.",
+            show_alert=True
         )
-        return await start(update, context)
+        return
 
-    except ValueError:
-        await update.message.reply_text("❌ Error al procesar la selección. Intenta de nuevo.", reply_markup=update.message.reply_markup)
-        return BUY_PRODUCT
-    except Exception as e:
-        logger.error(f"Error en la transacción: {e}")
-        session_db.rollback()
-        await update.message.reply_text("❌ Ocurrió un error en la compra. Intenta de nuevo o usa /start.")
-        return ConversationHandler.END
-    finally:
-        session_db.close()
-            
-    await update.message.reply_text("Opción no válida. Elige una de las opciones del menú.", reply_markup=update.message.reply_markup)
-    return BUY_PRODUCT
+    await query.answer()
+    resumen = (
+        f"🎉 **Compra Exitosa: {cantidad} x {datos['producto']}!**\n"
+        f"Costo: **${datos['total']:.2f}**\n"
+        f"Tu nuevo saldo: **${datos['saldo']:.2f}**"
+    )
+    licencias = "\n".join(f"`{licencia}`" for licencia in datos['licencias'])
+    texto = f"{resumen}\n\n🔐 **Tus Keys/Licencias:**\n{licencias}"
+    if len(texto) <= MAX_CARACTERES_MENSAJE:
+        try:
+            await query.message.reply_text(texto, parse_mode='Markdown')
+            return
+        except TelegramError as e:
+            # La compra ya está confirmada: las keys se entregan igualmente en el archivo.
+            logger.warning(f"No se pudieron enviar las keys en un mensaje ({e}); se envían como archivo.")
+
+    archivo = io.BytesIO(("\n".join(datos['licencias']) + "\n").encode('utf-8'))
+    await query.message.reply_document(
+        document=InputFile(archivo, filename=f"keys_{producto_id}_{cantidad}.txt"),
+        caption=f"{resumen}\n\n🔐 Tus {cantidad} Keys/Licencias van en el archivo adjunto.",
+        parse_mode='Markdown'
+    )
 
 
 # =================================================================
 # 5. Función Principal de Ejecución
 # =================================================================
 
-def main() -> None:
-    """Ejecuta el bot."""
-    application = Application.builder().token(TOKEN).build()
+def crear_aplicacion() -> Application:
+    """Construye la Application con todos sus handlers registrados."""
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .base_url(TELEGRAM_API_URL)
+        .base_file_url(TELEGRAM_FILE_URL)
+        .application_class(AplicacionBot)
+        .context_types(ContextTypes(context=ContextoBot))
+        .post_init(verificar_esquema)
+        .concurrent_updates(ProcesadorPorUsuario())
+        .build()
+    )
+    application.add_error_handler(marcar_update_fallido)
 
     # Handlers de comandos y botones de texto simples
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("logout", logout))
     application.add_handler(MessageHandler(filters.Regex("^👤 Account$"), show_account))
+    application.add_handler(CallbackQueryHandler(paginate_history, pattern=rf"^{CB_HISTORIAL}[as]:\d+$"))
     application.add_handler(MessageHandler(filters.Regex("^🚀 Log out$"), logout))
 
     # Flujo de Login
@@ -337,25 +468,31 @@ def main() -> None:
     )
     application.add_handler(login_conv_handler)
     
-    # Flujo de Compra
-    buy_conv_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex("^🛒 Buy keys$"), show_buy_menu)],
-        states={
-            BUY_CATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_category_selection)],
-            BUY_PRODUCT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_final_purchase)],
-        },
-        fallbacks=[CommandHandler("start", start)], 
-        per_user=True,
-    )
-    application.add_handler(buy_conv_handler)
+    # Flujo de Compra (teclado inline, editando el mismo mensaje)
+    application.add_handler(MessageHandler(filters.Regex("^🛒 Buy keys$"), show_buy_menu))
+    application.add_handler(CallbackQueryHandler(show_buy_menu, pattern=f"^{CB_MENU}$"))
+    application.add_handler(CallbackQueryHandler(handle_category_selection, pattern=rf"^{CB_CATEGORIA}\d+$"))
+    application.add_handler(CallbackQueryHandler(handle_final_purchase, pattern=rf"^{CB_PRODUCTO}\d+$"))
+    application.add_handler(CallbackQueryHandler(show_quantity_menu, pattern=rf"^{CB_CANTIDAD}\d+$"))
+    application.add_handler(CallbackQueryHandler(handle_bulk_purchase, pattern=rf"^{CB_LOTE}\d+:\d+$"))
     
     # Manejar el botón "➕ Create Account"
     async def show_create_account_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("To create an account, please ask the administrator for credentials.", reply_markup=get_keyboard_main(False))
     application.add_handler(MessageHandler(filters.Regex("^➕ Create Account$"), show_create_account_info))
 
+    instrumentar_aplicacion(application, 'main')
+    return application
+
+def main() -> None:
+    """Ejecuta el bot."""
+    application = crear_aplicacion()
+
     logger.info("El Bot de Telegram se está iniciando...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if modo_webhook():
+        asyncio.run(ejecutar_webhook({'main': application}, int(os.getenv('PORT', '8080'))))
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,186 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import Application, BaseUpdateProcessor, CallbackContext
+from db_models import iniciar_unidad_de_trabajo, terminar_unidad_de_trabajo, unidad_de_trabajo_actual, desligar_unidad_de_trabajo, cerrar_unidad_de_trabajo, DB_POOL_SIZE, DB_MAX_OVERFLOW, CONEXIONES_FONDO
+from metrics import registrar_update
+
+logger = logging.getLogger(__name__)
+
+def _inicio_del_proceso():
+    """time.time() del arranque del proceso, antes de los imports (en Linux, desde /proc)."""
+    try:
+        with open('/proc/self/stat') as stat, open('/proc/uptime') as uptime:
+            inicio_ticks = int(stat.read().rsplit(')', 1)[1].split()[19])
+            desde_encendido = float(uptime.read().split()[0])
+        return time.time() - (desde_encendido - inicio_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+# Referencia para medir el tiempo hasta el primer update atendido; fuera de Linux
+# cuenta desde que se importa este módulo (ver bench_arranque.py).
+_INICIO_PROCESO = _inicio_del_proceso()
+_primer_update_atendido = False
+
+# Servidor de la Bot API: por defecto el de Telegram; se puede apuntar a un
+# telegram-bot-api propio o al simulador de bench_load.py.
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org/bot')
+TELEGRAM_FILE_URL = os.getenv('TELEGRAM_FILE_URL', 'https://api.telegram.org/file/bot')
+
+# =================================================================
+# Middleware de Updates (unidad de trabajo de DB por update)
+# =================================================================
+
+class ContextoBot(CallbackContext):
+    """CallbackContext que expone la unidad de trabajo del update como context.db."""
+
+    @property
+    def db(self):
+        return unidad_de_trabajo_actual()
+
+class AplicacionBot(Application):
+    """Application que envuelve cada update en una unidad de trabajo de DB."""
+
+    async def process_update(self, update: object) -> None:
+        uow, token = iniciar_unidad_de_trabajo()
+        try:
+            await super().process_update(update)
+        finally:
+            terminar_unidad_de_trabajo(token)
+            try:
+                await cerrar_unidad_de_trabajo(uow)
+            except Exception as e:
+                logger.error(f"Error al cerrar la unidad de trabajo del update: {e}")
+            if uow.consultas:
+                logger.debug(f"Update procesado: {uow.consultas} consultas, {uow.checkouts} checkouts")
+            registrar_update(getattr(self, 'nombre_metricas', ''), uow)
+            _registrar_primer_update()
+
+# =================================================================
+# Procesamiento Concurrente de Updates (en orden por usuario)
+# =================================================================
+# Updates de usuarios distintos se procesan en paralelo (hasta
+# BOT_CONCURRENT_UPDATES a la vez); los de un mismo usuario, uno tras otro y en
+# el orden en que llegaron, para que el estado de ConversationHandler sea coherente.
+
+# run_bots.py atiende los dos bots en un proceso con un solo pool de conexiones y
+# cada update retiene la suya hasta terminar: entre ambos no deben tener más updates
+# en curso que conexiones disponibles, descontando las reservadas a tareas de fondo.
+BOTS_POR_PROCESO = 2
+_CAPACIDAD_POOL = DB_POOL_SIZE + DB_MAX_OVERFLOW - CONEXIONES_FONDO
+BOT_CONCURRENT_UPDATES = int(os.getenv('BOT_CONCURRENT_UPDATES', str(max(1, min(16, _CAPACIDAD_POOL // BOTS_POR_PROCESO)))))
+if BOT_CONCURRENT_UPDATES * BOTS_POR_PROCESO > _CAPACIDAD_POOL:
+    logger.warning(
+        f"BOT_CONCURRENT_UPDATES={BOT_CONCURRENT_UPDATES} x {BOTS_POR_PROCESO} bots supera la capacidad del pool "
+        f"({_CAPACIDAD_POOL} sin las de tareas de fondo); sube DB_POOL_SIZE/DB_MAX_OVERFLOW o baja la concurrencia."
+    )
+
+class ProcesadorPorUsuario(BaseUpdateProcessor):
+    """Update processor con un lock por usuario que se toma antes del cupo global."""
+
+    def __init__(self, max_concurrent_updates=BOT_CONCURRENT_UPDATES):
+        # El semáforo de la clase base se toma antes de do_process_update; si limitara,
+        # los updates en cola de un mismo usuario ocuparían cupos esperando su lock.
+        # Por eso la base queda sin límite y el cupo real se aplica tras el lock del usuario.
+        # _limite se fija después: la base dimensiona su semáforo leyendo max_concurrent_updates.
+        super().__init__(sys.maxsize)
+        self._limite = max_concurrent_updates
+        self._cupos = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks = {}
+
+    @property
+    def max_concurrent_updates(self) -> int:
+        return getattr(self, '_limite', self._max_concurrent_updates)
+
+    @property
+    def current_concurrent_updates(self) -> int:
+        # La base descuenta de max_concurrent_updates los cupos libres de su semáforo de
+        # tamaño sys.maxsize; los updates en curso son los que ocupan un cupo de _cupos.
+        return self._limite - self._cupos._value
+
+    @staticmethod
+    def _clave(update):
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                return ('usuario', update.effective_user.id)
+            if update.effective_chat is not None:
+                return ('chat', update.effective_chat.id)
+        return None
+
+    async def do_process_update(self, update, coroutine) -> None:
+        clave = self._clave(update)
+        if clave is None:
+            async with self._cupos:
+                await coroutine
+            return
+
+        # [lock, updates pendientes]; la Application crea las tareas en orden de
+        # llegada y asyncio.Lock despierta a sus esperas en orden FIFO.
+        entrada = self._locks.setdefault(clave, [asyncio.Lock(), 0])
+        entrada[1] += 1
+        try:
+            async with entrada[0]:
+                async with self._cupos:
+                    await coroutine
+        finally:
+            entrada[1] -= 1
+            if entrada[1] == 0:
+                del self._locks[clave]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+def _registrar_primer_update():
+    global _primer_update_atendido
+    if not _primer_update_atendido:
+        _primer_update_atendido = True
+        logger.info(f"Primer update atendido a {time.time() - _INICIO_PROCESO:.2f}s del arranque")
+
+async def marcar_update_fallido(update: object, context: CallbackContext) -> None:
+    """Error handler: el update terminó con excepción, su unidad de trabajo se revierte."""
+    uow = unidad_de_trabajo_actual()
+    if uow is not None:
+        uow.fallida = True
+    logger.error("Excepción no controlada procesando un update", exc_info=context.error)
+
+def lanzar_en_segundo_plano(context: CallbackContext, coroutine, update: object = None):
+    """Ejecuta una corrutina como tarea de la Application, fuera de la unidad de trabajo del update."""
+    async def _tarea():
+        desligar_unidad_de_trabajo()
+        return await coroutine
+
+    return context.application.create_task(_tarea(), update=update)
+
+# Las tareas en segundo plano reportan avance editando un mensaje; los bloques
+# terminan en milisegundos, así que las ediciones se espacian para no caer en
+# el control de flood de Telegram.
+PROGRESS_EDIT_SECONDS = float(os.getenv('PROGRESS_EDIT_SECONDS', '3'))
+
+class MensajeProgreso:
+    """Edita un mensaje de progreso como máximo cada 'intervalo' segundos.
+
+    Un error al editar (RetryAfter, flood control, mensaje borrado) se registra y se ignora:
+    nunca detiene la tarea que reporta.
+    """
+
+    def __init__(self, mensaje, intervalo=PROGRESS_EDIT_SECONDS):
+        self.mensaje = mensaje
+        self.intervalo = intervalo
+        self._ultima = time.monotonic()
+
+    async def actualizar(self, texto):
+        ahora = time.monotonic()
+        if ahora - self._ultima < self.intervalo:
+            return
+        self._ultima = ahora
+        try:
+            await self.mensaje.edit_text(texto)
+        except TelegramError as e:
+            logger.warning(f"No se pudo actualizar el mensaje de progreso: {e}")
@@ -0,0 +1,121 @@
+import os
+import time
+import uuid
+import select
+import logging
+import threading
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+from db_models import Producto, Metadato, DATABASE_URL, ejecutar_db, lectura_idempotente
+
+logger = logging.getLogger(__name__)
+
+# =================================================================
+# Caché del Catálogo (categorías, productos y precios)
+# =================================================================
+# El catálogo solo cambia desde bot_admin, que cambia app_meta['catalog_version']
+# en la misma transacción. El bot principal compara esa versión cada
+# CATALOG_POLL_SECONDS (y al instante vía LISTEN/NOTIFY en Postgres).
+
+CLAVE_VERSION_CATALOGO = 'catalog_version'
+CANAL_NOTIFY = 'catalog_version'
+CATALOG_POLL_SECONDS = float(os.getenv('CATALOG_POLL_SECONDS', '10'))
+
+def incrementar_version_catalogo(session_db):
+    """Marca el catálogo como modificado dentro de la transacción actual (sin commit)."""
+    version = uuid.uuid4().hex
+    session_db.query(Metadato).filter(Metadato.clave == CLAVE_VERSION_CATALOGO).update({Metadato.valor: version})
+    if session_db.get_bind().dialect.name == 'postgresql':
+        # pg_notify se entrega al hacer commit; si la transacción se revierte no se envía.
+        session_db.execute(text("SELECT pg_notify(:canal, :version)"), {'canal': CANAL_NOTIFY, 'version': version})
+
+class Catalogo:
+    """Foto inmutable del catálogo en una versión dada."""
+
+    def __init__(self, version, productos):
+        self.version = version
+        self.productos_por_id = {p[0]: p for p in productos}
+        self.productos_por_categoria = {}
+        for producto in productos:
+            self.productos_por_categoria.setdefault(producto[2], []).append(producto)
+        self.categorias = list(self.productos_por_categoria)
+        # Teclados u otras vistas derivadas que los bots construyen una vez por versión.
+        self.vistas = {}
+
+class CacheCatalogo:
+    """Mantiene el último Catalogo y lo recarga cuando cambia la versión en la DB."""
+
+    def __init__(self, intervalo=CATALOG_POLL_SECONDS):
+        self.intervalo = intervalo
+        self._catalogo = None
+        self._verificado = 0.0
+        self._lock = threading.Lock()
+        self._escucha = None
+
+    def invalidar(self):
+        """Fuerza a verificar la versión en el próximo acceso."""
+        self._verificado = 0.0
+
+    def vigente(self):
+        """Retorna el Catalogo si se verificó hace menos de 'intervalo' segundos, si no None."""
+        if self._catalogo is not None and time.monotonic() - self._verificado < self.intervalo:
+            return self._catalogo
+        return None
+
+    @lectura_idempotente
+    def actualizar(self, session_db):
+        """Compara la versión en la DB y recarga el catálogo si cambió (se ejecuta en el hilo de DB)."""
+        with self._lock:
+            if self.vigente() is not None:
+                return self._catalogo
+
+            version = session_db.query(Metadato.valor).filter(Metadato.clave == CLAVE_VERSION_CATALOGO).scalar()
+            if self._catalogo is None or version is None or version != self._catalogo.version:
+                productos = session_db.query(
+                    Producto.id, Producto.nombre, Producto.categoria, Producto.precio
+                ).filter(Producto.eliminado_en.is_(None)).order_by(Producto.id).all()
+                self._catalogo = Catalogo(version, [tuple(p) for p in productos])
+                logger.info(f"Catálogo recargado (versión {version}, {len(productos)} productos)")
+            self._verificado = time.monotonic()
+            return self._catalogo
+
+    async def obtener(self):
+        """Retorna el catálogo vigente, consultando la DB solo si toca verificar la versión."""
+        if self._escucha is None:
+            self._iniciar_escucha()
+        catalogo = self.vigente()
+        if catalogo is None:
+            catalogo = await ejecutar_db(self.actualizar)
+        return catalogo
+
+    def _iniciar_escucha(self):
+        """En Postgres, invalida la caché al recibir NOTIFY; en otros motores basta el sondeo."""
+        self._escucha = False
+        if not DATABASE_URL.startswith('postgres'):
+            return
+        self._escucha = threading.Thread(target=self._escuchar, name='catalog-listen', daemon=True)
+        self._escucha.start()
+
+    def _escuchar(self):
+        motor = create_engine(DATABASE_URL, poolclass=NullPool)
+        while True:
+            try:
+                conexion = motor.raw_connection()
+                try:
+                    dbapi = conexion.driver_connection
+                    dbapi.autocommit = True
+                    dbapi.cursor().execute(f"LISTEN {CANAL_NOTIFY}")
+                    while True:
+                        if select.select([dbapi], [], [], 60) == ([], [], []):
+                            continue
+                        dbapi.poll()
+                        if dbapi.notifies:
+                            dbapi.notifies.clear()
+                            self.invalidar()
+                finally:
+                    conexion.close()
+            except Exception as e:
+                logger.warning(f"Escucha de catálogo interrumpida, se usa sondeo: {e}")
+                time.sleep(self.intervalo)
+
+CACHE_CATALOGO = CacheCatalogo()
@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+
+# =================================================================
+# Verificación del Procesador de Updates (orden por usuario y cupos)
+# =================================================================
+# Alimenta ProcesadorPorUsuario igual que la Application (una tarea por update,
+# en orden de llegada) con handlers simulados y comprueba que:
+#   1. los updates de un mismo usuario terminan en el orden en que llegaron;
+#   2. una ráfaga de un usuario no bloquea a los demás (sin head-of-line blocking);
+#   3. nunca hay más de max_concurrent_updates handlers ejecutándose a la vez;
+#   4. current_concurrent_updates está entre los handlers en ejecución (más los que
+#      ya tienen cupo y aún no arrancaron) y el límite, y vuelve a 0 al terminar.
+#
+# Uso: python check_update_order.py [--usuarios 20] [--updates 10] [--cupos 4]
+# No toca la base de datos ni la red; termina con exit 1 si algo falla.
+
+def _update(telegram_id, update_id):
+    from telegram import Update
+    return Update.de_json({'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(time.time()), 'text': 'x',
+        'chat': {'id': telegram_id, 'type': 'private'},
+        'from': {'id': telegram_id, 'is_bot': False, 'first_name': 'check'},
+    }}, None)
+
+class Registro:
+    """Orden de finalización, pico de handlers simultáneos y lecturas de current_concurrent_updates."""
+
+    def __init__(self, procesador):
+        self.procesador = procesador
+        self.terminados = []
+        self.activos = 0
+        self.pico = 0
+        self.en_curso_fuera_de_rango = []
+
+    async def handler(self, telegram_id, numero, segundos):
+        self.activos += 1
+        self.pico = max(self.pico, self.activos)
+        en_curso = self.procesador.current_concurrent_updates
+        if not self.activos <= en_curso <= self.procesador.max_concurrent_updates:
+            self.en_curso_fuera_de_rango.append((en_curso, self.activos))
+        try:
+            await asyncio.sleep(segundos)
+        finally:
+            self.activos -= 1
+        self.terminados.append((telegram_id, numero))
+
+async def _procesar(registro, llegadas):
+    """llegadas: [(telegram_id, segundos)] en orden de llegada."""
+    procesador = registro.procesador
+    tareas, numeros = [], {}
+    for update_id, (telegram_id, segundos) in enumerate(llegadas, 1):
+        numero = numeros[telegram_id] = numeros.get(telegram_id, 0) + 1
+        tareas.append(asyncio.create_task(procesador.process_update(
+            _update(telegram_id, update_id), registro.handler(telegram_id, numero, segundos)
+        )))
+        await asyncio.sleep(0)
+    await asyncio.gather(*tareas)
+    if procesador.current_concurrent_updates != 0:
+        registro.en_curso_fuera_de_rango.append((procesador.current_concurrent_updates, 0))
+
+async def verificar_orden(usuarios, updates, cupos):
+    from bot_middleware import ProcesadorPorUsuario
+    registro = Registro(ProcesadorPorUsuario(cupos))
+    llegadas = [(u, random.uniform(0, 0.02)) for _ in range(updates) for u in range(1, usuarios + 1)]
+    await _procesar(registro, llegadas)
+
+    problemas = []
+    for usuario in range(1, usuarios + 1):
+        orden = [n for u, n in registro.terminados if u == usuario]
+        if orden != sorted(orden):
+            problemas.append(f"usuario {usuario} terminó fuera de orden: {orden}")
+    if registro.pico > cupos:
+        problemas.append(f"{registro.pico} handlers simultáneos con {cupos} cupos")
+    if registro.en_curso_fuera_de_rango:
+        obtenido, activos = registro.en_curso_fuera_de_rango[0]
+        problemas.append(f"current_concurrent_updates = {obtenido} con {activos} handlers en ejecución y {cupos} cupos")
+    return problemas
+
+async def verificar_sin_bloqueo(cupos):
+    from bot_middleware import ProcesadorPorUsuario
+    registro = Registro(ProcesadorPorUsuario(cupos))
+    rafaga = cupos * 2 + 2
+    await _procesar(registro, [(1, 0.05)] * rafaga + [(2, 0.0)])
+
+    posicion = registro.terminados.index((2, 1))
+    if posicion > 1:
+        return [f"el usuario 2 terminó en la posición {posicion + 1}, tras {posicion} updates de la ráfaga del usuario 1"]
+    return []
+
+def main():
+    parser = argparse.ArgumentParser(description="Verifica el orden por usuario y los cupos de ProcesadorPorUsuario.")
+    parser.add_argument('--usuarios', type=int, default=20)
+    parser.add_argument('--updates', type=int, default=10, help="Updates por usuario.")
+    parser.add_argument('--cupos', type=int, default=4)
+    parser.add_argument('--semilla', type=int, default=1)
+    args = parser.parse_args()
+
+    # Solo se importa bot_middleware; nunca se usa el DATABASE_URL del entorno.
+    os.environ['DATABASE_URL'] = 'sqlite://'
+    random.seed(args.semilla)
+    problemas = asyncio.run(verificar_orden(args.usuarios, args.updates, args.cupos))
+    problemas += asyncio.run(verificar_sin_bloqueo(args.cupos))
+    for problema in problemas:
+        print(f"❌ {problema}")
+    if not problemas:
+        print(f"✅ Orden por usuario, cupo de {args.cupos}, updates en curso y ausencia de bloqueo entre usuarios verificados.")
+    sys.exit(1 if problemas else 0)
+
+
+if __name__ == '__main__':
+    main()
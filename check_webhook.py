@@ -0,0 +1,154 @@
+import sys
+import time
+import asyncio
+import logging
+import argparse
+from bench_load import ApiTelegramFalsa, preparar_entorno
+
+# =================================================================
+# Verificación del Servidor del Webhook (rutas y respuestas HTTP)
+# =================================================================
+# Levanta la app aiohttp de webhook_server.crear_app_web sobre un puerto local
+# con Applications simuladas (solo se usan running, bot y update_queue) y
+# comprueba cada respuesta:
+#   1. POST /webhook/<bot> desconocido -> 404;
+#   2. secreto ausente o incorrecto -> 403 y el update no se encola;
+#   3. cuerpo que no es JSON -> 400;
+#   4. update válido -> 200 y queda en la update_queue del bot correcto;
+#   5. GET /healthz -> 503 'starting' con un bot detenido, 200 'ok' con todos activos;
+#   6. GET /metrics -> 200 en formato Prometheus;
+#   7. de punta a punta: el bot_main.crear_aplicacion() real, contra la Bot API
+#      simulada de bench_load.py, recibe un /start por POST y responde con sendMessage.
+#
+# Uso: python check_webhook.py
+# No usa la red ni la API de Telegram (ni el DATABASE_URL del entorno: usa una
+# SQLite temporal); termina con exit 1 si algo falla.
+
+SECRETO = 'secreto-de-prueba'
+
+class AplicacionFalsa:
+    """Lo que el servidor del webhook usa de una Application."""
+
+    def __init__(self, running=True):
+        self.running = running
+        self.bot = None
+        self.update_queue = asyncio.Queue()
+
+# /start tal como lo envía Telegram al webhook.
+UPDATE_START = {
+    'update_id': 900000001,
+    'message': {
+        'message_id': 17, 'date': 1760000000, 'text': '/start',
+        'from': {'id': 5550001, 'is_bot': False, 'first_name': 'Ana', 'username': 'ana_check', 'language_code': 'es'},
+        'chat': {'id': 5550001, 'first_name': 'Ana', 'username': 'ana_check', 'type': 'private'},
+        'entities': [{'offset': 0, 'length': 6, 'type': 'bot_command'}],
+    },
+}
+
+def _update(update_id):
+    return {'update_id': update_id, 'message': {
+        'message_id': 1, 'date': 0, 'text': '/start',
+        'chat': {'id': 1, 'type': 'private'},
+        'from': {'id': 1, 'is_bot': False, 'first_name': 'check'},
+    }}
+
+def _comprobador(problemas):
+    def comprobar(descripcion, obtenido, esperado):
+        if obtenido != esperado:
+            problemas.append(f"{descripcion}: se esperaba {esperado}, se obtuvo {obtenido}")
+    return comprobar
+
+async def verificar_rutas(problemas):
+    from aiohttp.test_utils import TestServer, TestClient
+    from webhook_server import crear_app_web, CABECERA_SECRETO
+
+    aplicaciones = {'main': AplicacionFalsa(), 'admin': AplicacionFalsa(running=False)}
+    comprobar = _comprobador(problemas)
+
+    async with TestClient(TestServer(crear_app_web(aplicaciones, secreto=SECRETO))) as cliente:
+        cabeceras = {CABECERA_SECRETO: SECRETO}
+
+        respuesta = await cliente.post('/webhook/otro', json=_update(1), headers=cabeceras)
+        comprobar("bot desconocido", respuesta.status, 404)
+
+        respuesta = await cliente.post('/webhook/main', json=_update(2))
+        comprobar("sin secreto", respuesta.status, 403)
+        respuesta = await cliente.post('/webhook/main', json=_update(3), headers={CABECERA_SECRETO: 'otro'})
+        comprobar("secreto incorrecto", respuesta.status, 403)
+        comprobar("updates encolados tras 403", aplicaciones['main'].update_queue.qsize(), 0)
+
+        respuesta = await cliente.post('/webhook/main', data=b'no es json', headers=cabeceras)
+        comprobar("cuerpo inválido", respuesta.status, 400)
+
+        respuesta = await cliente.post('/webhook/main', json=_update(4), headers=cabeceras)
+        comprobar("update válido", respuesta.status, 200)
+        comprobar("updates encolados en main", aplicaciones['main'].update_queue.qsize(), 1)
+        comprobar("updates encolados en admin", aplicaciones['admin'].update_queue.qsize(), 0)
+        if not aplicaciones['main'].update_queue.empty():
+            comprobar("update_id encolado", (await aplicaciones['main'].update_queue.get()).update_id, 4)
+
+        respuesta = await cliente.get('/healthz')
+        comprobar("/healthz con un bot detenido", respuesta.status, 503)
+        comprobar("estado con un bot detenido", (await respuesta.json()).get('status'), 'starting')
+        aplicaciones['admin'].running = True
+        respuesta = await cliente.get('/healthz')
+        comprobar("/healthz con todos los bots activos", respuesta.status, 200)
+        datos = await respuesta.json()
+        comprobar("estado con todos los bots activos", datos.get('status'), 'ok')
+        comprobar("estadísticas del pool en /healthz", 'pool' in datos, True)
+
+        respuesta = await cliente.get('/metrics')
+        comprobar("/metrics", respuesta.status, 200)
+        comprobar("formato de /metrics", '# TYPE bot_handler_duration_seconds histogram' in await respuesta.text(), True)
+
+async def verificar_start(problemas, api, limite=10.0):
+    """POST del /start al webhook de la Application real de bot_main y espera su sendMessage."""
+    from aiohttp.test_utils import TestServer, TestClient
+    from webhook_server import crear_app_web, CABECERA_SECRETO
+    from db_models import ENGINE, inicializar_db
+    import bot_main
+
+    comprobar = _comprobador(problemas)
+    inicializar_db(ENGINE)
+    application = bot_main.crear_aplicacion()
+    await application.initialize()
+    await application.start()
+    try:
+        async with TestClient(TestServer(crear_app_web({'main': application}, secreto=SECRETO))) as cliente:
+            respuesta = await cliente.post('/webhook/main', json=UPDATE_START, headers={CABECERA_SECRETO: SECRETO})
+            comprobar("/start por el webhook", respuesta.status, 200)
+            fin = time.monotonic() + limite
+            while not api.envios and time.monotonic() < fin:
+                await asyncio.sleep(0.05)
+            comprobar("sendMessage de respuesta al /start", api.envios, 1)
+    finally:
+        await application.stop()
+        await application.shutdown()
+
+async def verificar():
+    # Todo lo importado después (bots, db_models) usa la Bot API simulada y una DB temporal.
+    api = ApiTelegramFalsa()
+    await api.iniciar()
+    preparar_entorno(argparse.Namespace(database_url=''), api.puerto)
+    problemas = []
+    try:
+        await verificar_rutas(problemas)
+        await verificar_start(problemas, api)
+    finally:
+        await api.detener()
+    return problemas
+
+def main():
+    argparse.ArgumentParser(description="Verifica las respuestas HTTP del servidor del webhook.").parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('aiohttp.access').setLevel(logging.WARNING)
+    problemas = asyncio.run(verificar())
+    for problema in problemas:
+        print(f"❌ {problema}")
+    if not problemas:
+        print("✅ Rutas del webhook (404/403/400/200), /healthz, /metrics y respuesta de bot_main a /start verificadas.")
+    sys.exit(1 if problemas else 0)
+
+
+if __name__ == '__main__':
+    main()
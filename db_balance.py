@@ -0,0 +1,79 @@
+import os
+from datetime import datetime
+from sqlalchemy import update, insert, select, literal, or_, Integer, BigInteger, Float, String
+from sqlalchemy.sql.expression import ColumnElement
+from db_models import Usuario, Transaccion
+
+# =================================================================
+# Movimientos de Saldo (UPDATE atómico con límite opcional)
+# =================================================================
+# El saldo nunca se lee, modifica en Python y se reescribe: la suma se hace en
+# la base con UPDATE ... SET saldo = saldo + :delta RETURNING saldo, así dos
+# escrituras concurrentes sobre la misma fila (compra y ajuste de un admin)
+# se aplican ambas. El límite va en el WHERE de la misma sentencia.
+#
+# sentencia_saldo y sentencia_registro son las únicas que escriben saldo y libro:
+# las usan mover_saldo (ajustes individuales y compras en SQLite), la compra en
+# una sola sentencia de Postgres (como CTE) y los ajustes masivos por CSV.
+
+# Piso opcional para los ajustes de administrador (p. ej. 0); por defecto no hay
+# piso y un ajuste puede dejar el saldo en negativo, como antes.
+_PISO = os.getenv('SALDO_MINIMO_AJUSTES', '')
+SALDO_MINIMO_AJUSTES = float(_PISO) if _PISO.strip() else None
+
+_COLUMNAS_LIBRO = ('usuario_id', 'fecha', 'tipo', 'monto', 'saldo_resultante', 'producto_id', 'detalle', 'autor_telegram_id')
+
+def _sql(valor, tipo):
+    """El valor tal cual si ya es una expresión SQL; si no, como parámetro del tipo dado."""
+    return valor if isinstance(valor, ColumnElement) else literal(valor, tipo)
+
+def _piso(delta, minimo):
+    """Condición del mínimo: solo limita débitos; los abonos aplican aunque el saldo siga bajo el mínimo."""
+    if minimo is None:
+        return None
+    if isinstance(delta, (int, float)):
+        return None if delta >= 0 else Usuario.saldo + delta >= minimo
+    return or_(delta >= 0, Usuario.saldo + delta >= minimo)
+
+def sentencia_saldo(delta, condicion, minimo=None):
+    """UPDATE usuarios SET saldo = saldo + delta WHERE condicion [y el piso] RETURNING id, username, saldo.
+
+    delta puede ser un número o una expresión SQL (p. ej. un CASE por id o el precio de un CTE).
+    """
+    sentencia = update(Usuario).where(condicion).values(saldo=Usuario.saldo + delta)
+    piso = _piso(delta, minimo)
+    if piso is not None:
+        sentencia = sentencia.where(piso)
+    return sentencia.returning(Usuario.id, Usuario.username, Usuario.saldo)
+
+def sentencia_registro(origen, tipo, monto, producto_id=None, detalle=None, autor_telegram_id=None):
+    """INSERT en el libro de un movimiento por fila de origen (columnas id y saldo, ya actualizado).
+
+    origen es el CTE de sentencia_saldo o una subconsulta sobre usuarios; monto y detalle
+    pueden ser expresiones SQL sobre esas filas.
+    """
+    return insert(Transaccion).from_select(_COLUMNAS_LIBRO, select(
+        origen.c.id, literal(datetime.now()), literal(tipo), _sql(monto, Float), origen.c.saldo,
+        _sql(producto_id, Integer), _sql(detalle, String), literal(autor_telegram_id, BigInteger),
+    ))
+
+def saldos_actuales(condicion):
+    """Subconsulta (id, saldo) de los socios de condicion, para registrar tras sentencia_saldo."""
+    return select(Usuario.id, Usuario.saldo).where(condicion).subquery()
+
+def mover_saldo(session_db, delta, tipo, usuario_id=None, telegram_id=None, minimo=None,
+                producto_id=None, detalle=None, autor_telegram_id=None):
+    """Suma delta al saldo del socio (por id o telegram_id) y registra el movimiento, sin commit.
+
+    Con minimo, un débito (delta < 0) no aplica si el saldo resultante quedaría por debajo;
+    los abonos siempre aplican, aunque el saldo siga bajo el mínimo.
+    Retorna la fila (id, username, saldo) ya actualizada, o None si no se aplicó.
+    """
+    condicion = Usuario.id == usuario_id if usuario_id is not None else Usuario.telegram_id == telegram_id
+    fila = session_db.execute(sentencia_saldo(delta, condicion, minimo)).first()
+    if fila is not None:
+        session_db.execute(sentencia_registro(
+            saldos_actuales(Usuario.id == fila.id), tipo, delta, producto_id=producto_id,
+            detalle=detalle, autor_telegram_id=autor_telegram_id,
+        ))
+    return fila
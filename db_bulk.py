@@ -0,0 +1,197 @@
+import io
+import os
+import csv
+import math
+from datetime import datetime
+from sqlalchemy import insert, case
+from db_models import Usuario, Transaccion, escritura_serializada
+from db_ledger import TIPO_AJUSTE
+from db_balance import SALDO_MINIMO_AJUSTES, sentencia_saldo, sentencia_registro, saldos_actuales
+
+# =================================================================
+# Altas y Ajustes de Saldo Masivos (CSV)
+# =================================================================
+# El archivo se valida completo en una pasada (con una consulta por bloque
+# de identificadores). Si alguna fila tiene errores no se aplica nada y se
+# retorna el reporte por fila; si no, todas las filas se aplican con
+# sentencias por conjuntos en una sola transacción, con su movimiento en el libro.
+
+BULK_MAX_FILAS = int(os.getenv('BULK_MAX_FILAS', '5000'))
+_BLOQUE_CONSULTA = 500
+_VERDADERO = {'1', 'si', 'sí', 'yes', 'true', 'x'}
+_FALSO = {'', '0', 'no', 'false'}
+
+class ArchivoInvalido(ValueError):
+    """El archivo no se puede procesar (cabeceras, tamaño o formato)."""
+
+def leer_csv(ruta, obligatorias, alternativas=()):
+    """Lee el CSV (',' o ';') y retorna [(numero_de_linea, {columna: valor})].
+
+    obligatorias deben estar todas en la cabecera; de alternativas basta con una.
+    """
+    with open(ruta, newline='', encoding='utf-8-sig', errors='replace') as archivo:
+        muestra = archivo.read(4096)
+        archivo.seek(0)
+        try:
+            dialecto = csv.Sniffer().sniff(muestra, delimiters=',;')
+        except csv.Error:
+            dialecto = csv.excel
+        lector = csv.reader(archivo, dialecto)
+        cabecera = [c.strip().lower() for c in next(lector, [])]
+        faltantes = [c for c in obligatorias if c not in cabecera]
+        if alternativas and not any(c in cabecera for c in alternativas):
+            faltantes.append('|'.join(alternativas))
+        if faltantes:
+            raise ArchivoInvalido(f"Faltan columnas en la cabecera: {', '.join(faltantes)}.")
+
+        filas = []
+        for valores in lector:
+            if not any(v.strip() for v in valores):
+                continue
+            filas.append((lector.line_num, {c: v.strip() for c, v in zip(cabecera, valores)}))
+            if len(filas) > BULK_MAX_FILAS:
+                raise ArchivoInvalido(f"El archivo supera el máximo de {BULK_MAX_FILAS} filas.")
+    if not filas:
+        raise ArchivoInvalido("El archivo no tiene filas de datos.")
+    return filas
+
+def reporte_errores(errores):
+    """Genera el CSV de errores (linea, valor, error) en memoria."""
+    salida = io.StringIO()
+    escritor = csv.writer(salida)
+    escritor.writerow(('linea', 'valor', 'error'))
+    escritor.writerows(errores)
+    return salida.getvalue().encode('utf-8')
+
+def _numero(valor):
+    numero = float(valor.replace(',', '.'))
+    if not math.isfinite(numero):
+        raise ValueError(valor)
+    return numero
+
+def _en_bloques(session_db, columna, valores, *extra):
+    """Consulta (columna, *extra) de usuarios cuyo valor está en 'valores', en bloques de IN."""
+    valores = list(valores)
+    filas = []
+    for i in range(0, len(valores), _BLOQUE_CONSULTA):
+        filas += session_db.query(columna, *extra).filter(columna.in_(valores[i:i + _BLOQUE_CONSULTA])).all()
+    return filas
+
+# --- Alta de Socios: username, login_key[, saldo][, es_admin] ---
+@escritura_serializada
+def cargar_socios(session_db, filas, autor_telegram_id=None):
+    """Valida y crea los socios de 'filas'. Retorna (creados, errores); con errores no se crea ninguno."""
+    errores, nuevos, vistos = [], [], {}
+    for linea, fila in filas:
+        username, login_key = fila.get('username', ''), fila.get('login_key', '')
+        if not username or len(username) > 50:
+            errores.append((linea, username, 'username vacío o de más de 50 caracteres'))
+            continue
+        if username in vistos:
+            errores.append((linea, username, f'username repetido (línea {vistos[username]})'))
+            continue
+        vistos[username] = linea
+        if not login_key or len(login_key) > 100:
+            errores.append((linea, username, 'login_key vacía o de más de 100 caracteres'))
+            continue
+        try:
+            saldo = _numero(fila.get('saldo') or '0')
+        except ValueError:
+            errores.append((linea, username, f"saldo no válido: {fila.get('saldo')}"))
+            continue
+        es_admin = fila.get('es_admin', '').lower()
+        if es_admin not in _VERDADERO | _FALSO:
+            errores.append((linea, username, f"es_admin no válido: {fila.get('es_admin')}"))
+            continue
+        nuevos.append({'username': username, 'login_key': login_key, 'saldo': saldo, 'es_admin': es_admin in _VERDADERO})
+
+    lineas = {u['username']: vistos[u['username']] for u in nuevos}
+    for (existente,) in _en_bloques(session_db, Usuario.username, lineas):
+        errores.append((lineas[existente], existente, 'ya existe un socio con ese username'))
+    if errores:
+        return 0, sorted(errores)
+
+    ahora = datetime.now()
+    for nuevo in nuevos:
+        nuevo['fecha_registro'] = ahora
+    ids = dict(session_db.execute(insert(Usuario).returning(Usuario.username, Usuario.id), nuevos).all())
+    movimientos = [
+        {'usuario_id': ids[u['username']], 'fecha': ahora, 'tipo': TIPO_AJUSTE, 'monto': u['saldo'],
+         'saldo_resultante': u['saldo'], 'detalle': 'Saldo inicial', 'autor_telegram_id': autor_telegram_id}
+        for u in nuevos if u['saldo']
+    ]
+    if movimientos:
+        session_db.execute(insert(Transaccion), movimientos)
+    session_db.commit()
+    return len(nuevos), []
+
+# --- Ajustes de Saldo: id|username, monto ---
+@escritura_serializada
+def cargar_ajustes(session_db, filas, autor_telegram_id=None):
+    """Valida y aplica los ajustes de 'filas'. Retorna (aplicados, errores); con errores no se aplica ninguno."""
+    errores, validas = [], []
+    for linea, fila in filas:
+        identificador = fila.get('id') or fila.get('username', '')
+        try:
+            monto = _numero(fila.get('monto', ''))
+        except ValueError:
+            errores.append((linea, identificador, f"monto no válido: {fila.get('monto')}"))
+            continue
+        if not monto:
+            errores.append((linea, identificador, 'monto igual a cero'))
+            continue
+        if fila.get('id'):
+            if not fila['id'].isdigit():
+                errores.append((linea, identificador, 'id no numérico'))
+                continue
+            validas.append((linea, identificador, Usuario.id, int(fila['id']), monto))
+        elif identificador:
+            validas.append((linea, identificador, Usuario.username, identificador, monto))
+        else:
+            errores.append((linea, '', 'fila sin id ni username'))
+
+    # Resolución de socios: una consulta por bloque de ids y otra por bloque de usernames.
+    por_id = dict(_en_bloques(session_db, Usuario.id, {v for _, _, c, v, _ in validas if c is Usuario.id}, Usuario.id))
+    por_username = dict(_en_bloques(session_db, Usuario.username, {v for _, _, c, v, _ in validas if c is Usuario.username}, Usuario.id))
+
+    ajustes, vistos, identificadores = {}, {}, {}
+    for linea, identificador, columna, valor, monto in validas:
+        usuario_id = (por_id if columna is Usuario.id else por_username).get(valor)
+        if usuario_id is None:
+            errores.append((linea, identificador, 'socio no encontrado'))
+        elif usuario_id in vistos:
+            errores.append((linea, identificador, f'socio repetido (línea {vistos[usuario_id]})'))
+        else:
+            vistos[usuario_id], identificadores[usuario_id] = linea, identificador
+            ajustes[usuario_id] = monto
+    if errores:
+        return 0, sorted(errores)
+
+    # Misma primitiva que db_balance.mover_saldo (piso incluido), un UPDATE por bloque
+    # con el monto de cada socio en un CASE; el piso solo rechaza débitos.
+    ids, rechazados = list(ajustes), []
+    for i in range(0, len(ids), _BLOQUE_CONSULTA):
+        bloque = ids[i:i + _BLOQUE_CONSULTA]
+        monto = case({uid: ajustes[uid] for uid in bloque}, value=Usuario.id)
+        aplicados = {fila.id for fila in session_db.execute(sentencia_saldo(monto, Usuario.id.in_(bloque), SALDO_MINIMO_AJUSTES))}
+        rechazados += [uid for uid in bloque if uid not in aplicados]
+    if rechazados:
+        # Las filas rechazadas no se modificaron: su saldo es el previo al ajuste.
+        saldos = dict(_en_bloques(session_db, Usuario.id, rechazados, Usuario.saldo))
+        session_db.rollback()
+        for uid in rechazados:
+            if uid in saldos:
+                errores.append((vistos[uid], identificadores[uid], f'el saldo quedaría en {saldos[uid] + ajustes[uid]:.2f}, bajo el mínimo'))
+            else:
+                errores.append((vistos[uid], identificadores[uid], 'socio no encontrado'))
+        return 0, sorted(errores)
+
+    for i in range(0, len(ids), _BLOQUE_CONSULTA):
+        bloque = ids[i:i + _BLOQUE_CONSULTA]
+        origen = saldos_actuales(Usuario.id.in_(bloque))
+        session_db.execute(sentencia_registro(
+            origen, TIPO_AJUSTE, case({uid: ajustes[uid] for uid in bloque}, value=origen.c.id),
+            detalle='Ajuste masivo', autor_telegram_id=autor_telegram_id,
+        ))
+    session_db.commit()
+    return len(ajustes), []
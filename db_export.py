@@ -0,0 +1,69 @@
+import os
+import csv
+import sys
+import gzip
+from sqlalchemy import select
+from db_models import Usuario, Producto, Key, Transaccion, get_session
+from db_ledger import TIPO_COMPRA
+
+# =================================================================
+# Exportación CSV (cursor del lado del servidor, salida comprimida)
+# =================================================================
+# Las filas se leen en lotes de EXPORT_YIELD_PER con yield_per (en Postgres,
+# stream_results usa un cursor con nombre) y se escriben al vuelo en un
+# .csv.gz: la memoria no crece con el tamaño de la tabla.
+
+EXPORT_YIELD_PER = int(os.getenv('EXPORT_YIELD_PER', '5000'))
+ESTADOS_KEY = ('available', 'used')
+
+def _consulta_keys(producto_id=None, estado=None):
+    consulta = select(
+        Key.id, Key.producto_id, Producto.nombre, Key.licencia, Key.estado
+    ).join(Producto, Producto.id == Key.producto_id)
+    if producto_id is not None:
+        consulta = consulta.where(Key.producto_id == producto_id)
+    if estado is not None:
+        consulta = consulta.where(Key.estado == estado)
+    return consulta.order_by(Key.id)
+
+def _consulta_socios():
+    # login_key no se exporta: es la credencial del socio.
+    return select(
+        Usuario.id, Usuario.telegram_id, Usuario.username, Usuario.saldo, Usuario.es_admin, Usuario.fecha_registro
+    ).order_by(Usuario.id)
+
+def _consulta_ventas():
+    return select(
+        Transaccion.id, Transaccion.fecha, Transaccion.usuario_id, Usuario.username,
+        Transaccion.producto_id, Transaccion.detalle, Transaccion.monto, Transaccion.saldo_resultante
+    ).join(Usuario, Usuario.id == Transaccion.usuario_id).where(
+        Transaccion.tipo == TIPO_COMPRA
+    ).order_by(Transaccion.fecha, Transaccion.id)
+
+EXPORTACIONES = {
+    'keys': (('id', 'producto_id', 'producto', 'licencia', 'estado'), _consulta_keys),
+    'socios': (('id', 'telegram_id', 'username', 'saldo', 'es_admin', 'fecha_registro'), _consulta_socios),
+    'ventas': (('id', 'fecha', 'usuario_id', 'username', 'producto_id', 'detalle', 'monto', 'saldo_resultante'), _consulta_ventas),
+}
+
+def exportar_csv(session_db, tipo, ruta, **filtros):
+    """Escribe la exportación 'tipo' como CSV comprimido en ruta. Retorna el número de filas."""
+    cabeceras, consulta = EXPORTACIONES[tipo]
+    resultado = session_db.execute(consulta(**filtros).execution_options(yield_per=EXPORT_YIELD_PER))
+    filas = 0
+    with gzip.open(ruta, 'wt', newline='', encoding='utf-8') as archivo:
+        escritor = csv.writer(archivo)
+        escritor.writerow(cabeceras)
+        for lote in resultado.partitions():
+            escritor.writerows(lote)
+            filas += len(lote)
+    return filas
+
+
+if __name__ == '__main__':
+    # Uso: python db_export.py <keys|socios|ventas> salida.csv.gz (para volcados mayores al límite de Telegram)
+    if len(sys.argv) != 3 or sys.argv[1] not in EXPORTACIONES:
+        sys.exit(f"Uso: python db_export.py <{'|'.join(EXPORTACIONES)}> salida.csv.gz")
+    with get_session() as session:
+        total = exportar_csv(session, sys.argv[1], sys.argv[2])
+    print(f"{total} filas exportadas a {sys.argv[2]}")
@@ -0,0 +1,61 @@
+import os
+import csv
+import itertools
+from sqlalchemy.dialects import postgresql, sqlite
+from db_models import Key, escritura_serializada
+from db_stock import ajustar_contadores
+
+# =================================================================
+# Importación Masiva de Licencias (dedup por conjuntos, en bloques)
+# =================================================================
+
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '2000'))
+_CABECERAS = {'licencia', 'licencias', 'key', 'keys', 'license'}
+
+def _insert_ignorando_duplicados(dialecto):
+    """INSERT que omite licencias existentes: ON CONFLICT DO NOTHING (Postgres) o INSERT OR IGNORE (SQLite)."""
+    if dialecto == 'postgresql':
+        return postgresql.insert(Key).on_conflict_do_nothing(index_elements=['licencia'])
+    if dialecto == 'sqlite':
+        return sqlite.insert(Key).prefix_with('OR IGNORE')
+    raise NotImplementedError(f"Importación masiva no soportada para el dialecto '{dialecto}'")
+
+@escritura_serializada
+def insertar_licencias(session_db, producto_id, licencias):
+    """Inserta un bloque de licencias omitiendo duplicados en una sola sentencia.
+
+    Retorna (insertadas, duplicadas). Los contadores de stock se ajustan en la misma transacción.
+    """
+    unicas = list(dict.fromkeys(licencias))
+    if not unicas:
+        return 0, len(licencias)
+
+    sentencia = _insert_ignorando_duplicados(session_db.get_bind().dialect.name).returning(Key.id)
+    insertadas = len(session_db.execute(
+        sentencia,
+        [{'producto_id': producto_id, 'licencia': lic, 'estado': 'available'} for lic in unicas]
+    ).all())
+
+    ajustar_contadores(session_db, producto_id, disponibles=insertadas)
+    session_db.commit()
+    return insertadas, len(licencias) - insertadas
+
+def leer_licencias(ruta, tamano_bloque=IMPORT_CHUNK_SIZE):
+    """Lee un .txt (una licencia por línea) o .csv (primera columna) en bloques sin cargarlo completo."""
+    with open(ruta, newline='', encoding='utf-8-sig', errors='replace') as archivo:
+        if ruta.lower().endswith('.csv'):
+            filas = (fila[0] if fila else '' for fila in csv.reader(archivo))
+        else:
+            filas = iter(archivo)
+
+        licencias = (lic.strip() for lic in filas)
+        licencias = (lic for lic in licencias if lic)
+        primera = next(licencias, None)
+        if primera is not None and primera.lower() not in _CABECERAS:
+            licencias = itertools.chain([primera], licencias)
+
+        while True:
+            bloque = list(itertools.islice(licencias, tamano_bloque))
+            if not bloque:
+                return
+            yield bloque
@@ -0,0 +1,53 @@
+from datetime import datetime
+from sqlalchemy import select, tuple_
+from db_models import Usuario, Transaccion, lectura_idempotente
+
+# =================================================================
+# Libro de Transacciones (historial de compras y ajustes de saldo)
+# =================================================================
+# Cada cambio de saldo inserta una fila en la misma transacción que lo aplica.
+# El historial se pagina por keyset sobre (fecha, id) con el índice
+# ix_transacciones_usuario_fecha, así que una página cuesta lo mismo sin
+# importar cuántas compras acumule el socio.
+
+HISTORIAL_POR_PAGINA = 5
+
+TIPO_COMPRA = 'compra'
+TIPO_AJUSTE = 'ajuste'
+
+def registrar_transaccion(session_db, usuario_id, tipo, monto, saldo_resultante,
+                          producto_id=None, detalle=None, autor_telegram_id=None):
+    """Agrega un movimiento a la transacción actual (sin commit)."""
+    session_db.add(Transaccion(
+        usuario_id=usuario_id, fecha=datetime.now(), tipo=tipo, monto=monto,
+        saldo_resultante=saldo_resultante, producto_id=producto_id, detalle=detalle,
+        autor_telegram_id=autor_telegram_id,
+    ))
+
+@lectura_idempotente
+def pagina_transacciones(session_db, telegram_id, mas_antiguas_que=None, mas_nuevas_que=None, limite=HISTORIAL_POR_PAGINA):
+    """Retorna (movimientos, hay_mas_nuevas, hay_mas_antiguas), del más reciente al más antiguo.
+
+    mas_antiguas_que/mas_nuevas_que son el id del último/primer movimiento de la página vecina.
+    Solo se consideran movimientos del socio con ese telegram_id.
+    """
+    usuario_id = select(Usuario.id).where(Usuario.telegram_id == telegram_id).scalar_subquery()
+    query = session_db.query(Transaccion).filter(Transaccion.usuario_id == usuario_id)
+    orden = tuple_(Transaccion.fecha, Transaccion.id)
+
+    cursor = mas_antiguas_que if mas_antiguas_que is not None else mas_nuevas_que
+    if cursor is not None:
+        fila = session_db.query(Transaccion.fecha, Transaccion.id).filter(
+            Transaccion.id == cursor, Transaccion.usuario_id == usuario_id
+        ).first()
+        if fila is None:
+            return [], False, False
+        if mas_nuevas_que is not None:
+            filas = query.filter(orden > tuple_(*fila)).order_by(
+                Transaccion.fecha, Transaccion.id
+            ).limit(limite + 1).all()
+            return list(reversed(filas[:limite])), len(filas) > limite, True
+        query = query.filter(orden < tuple_(*fila))
+
+    filas = query.order_by(Transaccion.fecha.desc(), Transaccion.id.desc()).limit(limite + 1).all()
+    return filas[:limite], cursor is not None, len(filas) > limite
@@ -0,0 +1,147 @@
+import os
+import sys
+import asyncio
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import sessionmaker
+from db_models import Base, Usuario, Producto, Key, Metadato, Transaccion, ENGINE, DATABASE_URL, get_session, inicializar_db, ejecutar_en_hilo_db
+
+# =================================================================
+# Migraciones Versionadas (idempotentes, se ejecutan en cada deploy)
+# =================================================================
+# La versión aplicada se guarda en app_meta['schema_version']. Cada migración
+# debe poder re-ejecutarse sin error sobre una base que ya tenga el cambio.
+
+CLAVE_VERSION = 'schema_version'
+
+def _m001_contadores_stock(conn):
+    """Agrega productos.available_count/sold_count y los calcula desde 'keys'."""
+    columnas = {c['name'] for c in inspect(conn).get_columns('productos')}
+    for columna in ('available_count', 'sold_count'):
+        if columna not in columnas:
+            conn.execute(text(f"ALTER TABLE productos ADD COLUMN {columna} INTEGER NOT NULL DEFAULT 0"))
+
+    conn.execute(text("""
+        UPDATE productos SET
+            available_count = (SELECT count(*) FROM keys WHERE keys.producto_id = productos.id AND keys.estado = 'available'),
+            sold_count = (SELECT count(*) FROM keys WHERE keys.producto_id = productos.id AND keys.estado = 'used')
+    """))
+
+def _m002_indices(conn):
+    """Crea los índices de filtros frecuentes (incluye el índice parcial de keys disponibles)."""
+    for tabla in (Usuario.__table__, Producto.__table__, Key.__table__):
+        for indice in tabla.indexes:
+            indice.create(bind=conn, checkfirst=True)
+
+def _m003_indice_prefijo_username(conn):
+    """Índice para búsquedas por prefijo de username (LIKE 'abc%') en Postgres."""
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_usuarios_username_prefijo ON usuarios (username varchar_pattern_ops)"
+        ))
+
+def _m004_version_catalogo(conn):
+    """Registra app_meta['catalog_version'] para invalidar la caché del catálogo."""
+    tabla = Metadato.__table__
+    existe = conn.execute(tabla.select().where(tabla.c.clave == 'catalog_version')).first()
+    if existe is None:
+        conn.execute(tabla.insert().values(clave='catalog_version', valor='0'))
+
+def _m005_transacciones(conn):
+    """Crea el libro de transacciones y su índice (usuario, fecha) para el historial paginado."""
+    Transaccion.__table__.create(bind=conn, checkfirst=True)
+    for indice in Transaccion.__table__.indexes:
+        indice.create(bind=conn, checkfirst=True)
+
+def _m006_baja_logica_productos(conn):
+    """Agrega productos.eliminado_en para la baja lógica de productos."""
+    columnas = {c['name'] for c in inspect(conn).get_columns('productos')}
+    if 'eliminado_en' not in columnas:
+        conn.execute(text("ALTER TABLE productos ADD COLUMN eliminado_en TIMESTAMP"))
+
+MIGRACIONES = [
+    (1, _m001_contadores_stock),
+    (2, _m002_indices),
+    (3, _m003_indice_prefijo_username),
+    (4, _m004_version_catalogo),
+    (5, _m005_transacciones),
+    (6, _m006_baja_logica_productos),
+]
+VERSION_ACTUAL = MIGRACIONES[-1][0]
+
+def version_aplicada(session_db):
+    """Retorna la versión de esquema registrada (0 si nunca se migró)."""
+    metadato = session_db.get(Metadato, CLAVE_VERSION)
+    return int(metadato.valor) if metadato else 0
+
+def _registrar_version(conn, numero):
+    tabla = Metadato.__table__
+    actualizadas = conn.execute(
+        tabla.update().where(tabla.c.clave == CLAVE_VERSION).values(valor=str(numero))
+    ).rowcount
+    if not actualizadas:
+        conn.execute(tabla.insert().values(clave=CLAVE_VERSION, valor=str(numero)))
+
+def aplicar_migraciones(engine=ENGINE):
+    """Crea las tablas faltantes y aplica las migraciones pendientes, cada una en su transacción."""
+    Base.metadata.create_all(bind=engine)
+
+    Session = sessionmaker(bind=engine)
+    with Session() as session:
+        version = version_aplicada(session)
+
+    for numero, migracion in MIGRACIONES:
+        if numero <= version:
+            continue
+        logging.info(f"Aplicando migración {numero}: {migracion.__doc__}")
+        with engine.begin() as conn:
+            migracion(conn)
+            _registrar_version(conn, numero)
+
+
+# =================================================================
+# Verificación de Esquema al Arrancar (post_init de los bots)
+# =================================================================
+# DB_INIT_ON_STARTUP=check (por defecto) lee solo app_meta['schema_version'] y
+# ejecuta inicializar_db() únicamente si el esquema está desactualizado.
+# DB_INIT_ON_STARTUP=off delega todo al comando de deploy (python db_migrations.py).
+
+DB_INIT_ON_STARTUP = os.getenv('DB_INIT_ON_STARTUP', 'check').lower()
+_esquema_verificado = False
+_lock_esquema = asyncio.Lock()
+
+def esquema_al_dia():
+    """True si la versión registrada es la actual (una sola consulta por clave primaria)."""
+    try:
+        with get_session() as session:
+            return version_aplicada(session) >= VERSION_ACTUAL
+    except SQLAlchemyError:
+        # Base nueva: app_meta todavía no existe.
+        return False
+
+def _verificar_o_inicializar():
+    if esquema_al_dia():
+        logging.info(f"Esquema en versión {VERSION_ACTUAL}; se omite la inicialización.")
+        return
+    inicializar_db(ENGINE)
+
+async def verificar_esquema(application=None):
+    """Hook post_init: verifica el esquema una vez por proceso, fuera del event loop."""
+    global _esquema_verificado
+    if DB_INIT_ON_STARTUP == 'off':
+        return
+    async with _lock_esquema:
+        if not _esquema_verificado:
+            await ejecutar_en_hilo_db(_verificar_o_inicializar)
+            _esquema_verificado = True
+
+if __name__ == '__main__':
+    # Uso en deploy: python db_migrations.py
+    print(f"Migrando Base de Datos con URL: {DATABASE_URL}")
+    try:
+        inicializar_db(ENGINE)
+        print(f"Esquema en versión {VERSION_ACTUAL}.")
+    except Exception as e:
+        print(f"\n--- ERROR CRÍTICO EN MIGRACIONES ---\nDetalle: {e}")
+        sys.exit(1)
@@ -1,7 +1,14 @@
 import os
 import logging
 import sys
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, DateTime, BigInteger, ForeignKey
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, event, make_url, text, Column, Integer, String, Float, Boolean, DateTime, BigInteger, ForeignKey, Index
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
 from datetime import datetime
 from dotenv import load_dotenv 
@@ -23,6 +30,10 @@ class Usuario(Base):
     es_admin = Column(Boolean, default=False)
     fecha_registro = Column(DateTime, default=datetime.now)
 
+    __table_args__ = (
+        Index('ix_usuarios_username_login_key', 'username', 'login_key'),
+    )
+
 class Producto(Base):
     __tablename__ = 'productos'
     id = Column(Integer, primary_key=True)
@@ -31,8 +42,20 @@ class Producto(Base):
     precio = Column(Float, nullable=False)
     descripcion = Column(String(255)) 
     fecha_creacion = Column(DateTime, default=datetime.now)
+    # Contadores desnormalizados de keys; se mantienen en la misma transacción
+    # que compras, altas y bajas de keys (ver db_stock.reconciliar_contadores).
+    available_count = Column(Integer, nullable=False, default=0, server_default='0')
+    sold_count = Column(Integer, nullable=False, default=0, server_default='0')
+    # Baja lógica: el producto sale del catálogo al instante y sus keys se purgan
+    # por bloques en segundo plano (ver db_stock.purgar_keys).
+    eliminado_en = Column(DateTime, nullable=True)
     keys = relationship("Key", back_populates="producto")
 
+    __table_args__ = (
+        Index('ix_productos_categoria', 'categoria'),
+        Index('ix_productos_nombre', 'nombre'),
+    )
+
 class Key(Base):
     __tablename__ = 'keys'
     id = Column(Integer, primary_key=True)
@@ -41,20 +64,317 @@ class Key(Base):
     estado = Column(String(20), default='available') 
     producto = relationship("Producto", back_populates="keys")
 
+    __table_args__ = (
+        Index('ix_keys_producto_estado', 'producto_id', 'estado'),
+        # Índice parcial: solo las keys vendibles (Postgres y SQLite lo soportan).
+        Index(
+            'ix_keys_disponibles', 'producto_id',
+            postgresql_where=text("estado = 'available'"),
+            sqlite_where=text("estado = 'available'"),
+        ),
+    )
+
+class Transaccion(Base):
+    """Movimiento de saldo (compra o ajuste); solo se insertan filas, nunca se modifican."""
+    __tablename__ = 'transacciones'
+    id = Column(Integer, primary_key=True)
+    usuario_id = Column(Integer, ForeignKey('usuarios.id'), nullable=False)
+    fecha = Column(DateTime, nullable=False, default=datetime.now)
+    tipo = Column(String(20), nullable=False)
+    monto = Column(Float, nullable=False)
+    saldo_resultante = Column(Float, nullable=False)
+    # Sin FK: el historial se conserva aunque el producto se elimine.
+    producto_id = Column(Integer, nullable=True)
+    detalle = Column(String(255))
+    autor_telegram_id = Column(BigInteger, nullable=True)
+
+    __table_args__ = (
+        Index('ix_transacciones_usuario_fecha', 'usuario_id', 'fecha', 'id'),
+    )
+
+class Metadato(Base):
+    __tablename__ = 'app_meta'
+    clave = Column(String(50), primary_key=True)
+    valor = Column(String(255), nullable=False)
+
 
 # --- Conexión y Sesión (Lee DATABASE_URL de ENV) ---
 load_dotenv() 
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///socios_bot.db') 
-ENGINE = create_engine(DATABASE_URL, pool_pre_ping=True)
+
+# --- Configuración del Pool (Lee DB_* de ENV) ---
+# DB_DISCONNECT_MODE=pessimistic hace un ping (SELECT 1) en cada checkout;
+# optimistic (por defecto) no lo hace y, si la conexión resultó caída, reintenta
+# una vez las lecturas idempotentes (ver lectura_idempotente/ejecutar_db).
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+DB_DISCONNECT_MODE = os.getenv('DB_DISCONNECT_MODE', 'optimistic').lower()
+
+# --- Latencia de Checkout del Pool ---
+# Se mide en el propio pool, así cuenta cualquier checkout (unidades de trabajo,
+# get_session() y tareas de fondo). SQLAlchemy no emite un evento antes del
+# checkout, por eso se mide en connect() y no con un listener.
+_lock_pool = threading.Lock()
+_estadisticas_checkout = {'checkouts': 0, 'segundos_total': 0.0, 'segundos_max': 0.0}
+_observadores_checkout = []
+
+def _registrar_checkout(segundos):
+    with _lock_pool:
+        _estadisticas_checkout['checkouts'] += 1
+        _estadisticas_checkout['segundos_total'] += segundos
+        _estadisticas_checkout['segundos_max'] = max(_estadisticas_checkout['segundos_max'], segundos)
+    for observador in _observadores_checkout:
+        observador(segundos)
+
+def observar_checkouts(funcion):
+    """Registra funcion(segundos), llamada tras cada checkout del pool (también los fallidos por timeout)."""
+    _observadores_checkout.append(funcion)
+
+class PoolMedido(QueuePool):
+    """QueuePool que mide cuánto espera cada checkout."""
+
+    def connect(self):
+        inicio = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            _registrar_checkout(time.perf_counter() - inicio)
+
+def estadisticas_pool():
+    """Retorna la latencia de checkout acumulada y el estado actual del pool."""
+    with _lock_pool:
+        datos = dict(_estadisticas_checkout)
+    datos['segundos_promedio'] = datos['segundos_total'] / datos['checkouts'] if datos['checkouts'] else 0.0
+    datos['modo_desconexion'] = DB_DISCONNECT_MODE
+    datos['estado'] = ENGINE.pool.status()
+    return datos
+
+def _opciones_engine(url):
+    opciones = {'pool_pre_ping': DB_DISCONNECT_MODE == 'pessimistic'}
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # SQLite en memoria usa un pool de una sola conexión sin tamaño configurable.
+        return opciones
+    opciones.update(
+        poolclass=PoolMedido,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    return opciones
+
+ENGINE = create_engine(DATABASE_URL, **_opciones_engine(DATABASE_URL))
+ES_SQLITE = ENGINE.dialect.name == 'sqlite'
+
+# --- Perfil SQLite (Lee SQLITE_* de ENV) ---
+# WAL permite lecturas concurrentes con un escritor; busy_timeout hace que un
+# escritor espere el lock en lugar de fallar con 'database is locked'.
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', '20000'))
+# SQLITE_PERFIL=0 deja SQLite como antes del perfil (sin pragmas ni cola de escritura);
+# solo sirve para comparar con bench_load.py --compras-directas.
+SQLITE_PERFIL = os.getenv('SQLITE_PERFIL', '1') != '0'
+
+if ES_SQLITE and SQLITE_PERFIL:
+    @event.listens_for(ENGINE, 'connect')
+    def _configurar_sqlite(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        if ENGINE.url.database not in (None, '', ':memory:'):
+            cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+        cursor.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+        cursor.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}')
+        cursor.close()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=ENGINE)
 
 def get_session():
     """Retorna una nueva sesión de SQLAlchemy."""
     return SessionLocal()
 
+# --- Unidad de Trabajo por Update ---
+# Cada update usa como máximo una conexión del pool: la sesión se abre al primer
+# acceso, queda ligada a esa conexión durante todo el update y se confirma (o
+# revierte) al final. Por eso los updates en curso nunca superan las conexiones
+# del pool (ver BOT_CONCURRENT_UPDATES en bot_middleware).
+_UOW_ACTUAL = contextvars.ContextVar('uow_actual', default=None)
+
+class UnidadDeTrabajo:
+    """Sesión perezosa compartida por todos los accesos a DB de un update."""
+
+    def __init__(self):
+        self._conexion = None
+        self._session = None
+        self.fallida = False
+        self.consultas = 0
+        self.checkouts = 0
+        self.segundos_sql = 0.0
+        self.escritura_pendiente = False
+
+    @property
+    def abierta(self):
+        return self._session is not None
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._conexion = ENGINE.connect()
+            self._session = SessionLocal(bind=self._conexion)
+        return self._session
+
+    def descartar_conexion(self):
+        """Cierra sesión y conexión (p. ej. invalidada); el siguiente acceso obtiene una nueva."""
+        if self._session is not None:
+            self._session.close()
+            self._conexion.close()
+            self._session = self._conexion = None
+        self.escritura_pendiente = False
+
+    def finalizar(self):
+        """Confirma (o revierte si el update falló) y devuelve la conexión al pool."""
+        if self._session is None:
+            return
+        try:
+            if self.fallida:
+                self._session.rollback()
+            else:
+                self._session.commit()
+        finally:
+            self._session.close()
+            self._conexion.close()
+            self._session = self._conexion = None
+
+def unidad_de_trabajo_actual():
+    """Retorna la unidad de trabajo del update en curso (o None fuera de un update)."""
+    return _UOW_ACTUAL.get()
+
+def iniciar_unidad_de_trabajo():
+    """Crea una unidad de trabajo para el contexto actual. Retorna (uow, token)."""
+    uow = UnidadDeTrabajo()
+    return uow, _UOW_ACTUAL.set(uow)
+
+def terminar_unidad_de_trabajo(token):
+    _UOW_ACTUAL.reset(token)
+
+def desligar_unidad_de_trabajo():
+    """Quita la unidad de trabajo del contexto actual (para tareas que sobreviven al update)."""
+    _UOW_ACTUAL.set(None)
+
+async def cerrar_unidad_de_trabajo(uow):
+    """Confirma lo pendiente y devuelve la conexión. Usa su propio hilo: en el pool de DB
+    quedaría en cola tras updates que esperan conexión, que esperarían a su vez esta."""
+    if uow.abierta:
+        await _ejecutar_en(_EJECUTOR_CIERRE, uow.finalizar)
+
+@event.listens_for(ENGINE, 'before_cursor_execute')
+def _contar_consulta(conn, cursor, statement, parameters, context, executemany):
+    uow = _UOW_ACTUAL.get()
+    if uow is not None:
+        uow.consultas += 1
+        if not statement.lstrip()[:6].upper().startswith('SELECT'):
+            uow.escritura_pendiente = True
+
+@event.listens_for(ENGINE, 'commit')
+@event.listens_for(ENGINE, 'rollback')
+def _fin_de_transaccion(conn):
+    uow = _UOW_ACTUAL.get()
+    if uow is not None:
+        uow.escritura_pendiente = False
+
+@event.listens_for(ENGINE, 'checkout')
+def _contar_checkout(dbapi_connection, connection_record, connection_proxy):
+    uow = _UOW_ACTUAL.get()
+    if uow is not None:
+        uow.checkouts += 1
+
+# --- Ejecución No Bloqueante (Pool de Hilos Acotado) ---
+# Las consultas se ejecutan fuera del event loop para que una query lenta
+# no detenga los updates de los demás usuarios. El número de hilos no debe
+# superar el tamaño del pool de conexiones (5 + 10 overflow por defecto).
+DB_WORKERS = int(os.getenv('DB_WORKERS', str(min(8, DB_POOL_SIZE + DB_MAX_OVERFLOW))))
+_EJECUTOR_DB = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='db')
+
+# En SQLite hay un solo escritor a la vez: las funciones marcadas con
+# @escritura_serializada se encolan en un único hilo para no competir por el lock.
+_EJECUTOR_ESCRITURA = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-escritura')
+
+# Cierre de unidades de trabajo (usa la conexión del update, nunca espera al pool).
+_EJECUTOR_CIERRE = ThreadPoolExecutor(max_workers=2, thread_name_prefix='db-cierre')
+
+# Accesos fuera de un update (importaciones, exportaciones y purgas en segundo
+# plano, post_init): hilos propios con una sesión por llamada, así ocupan como
+# máximo DB_BACKGROUND_WORKERS conexiones (más la del escritor en SQLite) y no
+# compiten con los updates por los hilos de DB.
+DB_BACKGROUND_WORKERS = int(os.getenv('DB_BACKGROUND_WORKERS', '2'))
+_EJECUTOR_FONDO = ThreadPoolExecutor(max_workers=DB_BACKGROUND_WORKERS, thread_name_prefix='db-fondo')
+CONEXIONES_FONDO = DB_BACKGROUND_WORKERS + (1 if ES_SQLITE else 0)
+
+async def _ejecutar_en(ejecutor, fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(ejecutor, contextvars.copy_context().run, fn, *args)
+
+async def ejecutar_en_hilo_db(fn, *args):
+    """Ejecuta fn(*args) en el pool de hilos de DB conservando el contexto (unidad de trabajo)."""
+    return await _ejecutar_en(_EJECUTOR_DB, fn, *args)
+
+async def ejecutar_db(fn, *args, **kwargs):
+    """Ejecuta fn(session, *args, **kwargs) en el pool de hilos de DB y retorna su resultado.
+
+    Dentro de un update se usa la sesión de su unidad de trabajo; fuera de él, una sesión nueva
+    en los hilos de fondo.
+    En SQLite, las escrituras marcadas con @escritura_serializada pasan por la cola de un solo hilo.
+    """
+    uow = _UOW_ACTUAL.get()
+
+    def _ejecutar():
+        if uow is None:
+            with get_session() as session_db:
+                return fn(session_db, *args, **kwargs)
+        try:
+            return fn(uow.session, *args, **kwargs)
+        except Exception:
+            # Si falló el checkout no hay sesión: uow.session abriría otra conexión.
+            if uow.abierta:
+                uow.session.rollback()
+            raise
+
+    def _tarea():
+        # Si el update ya escribió en esta transacción, reconectar perdería esas escrituras.
+        escritura_previa = uow is not None and uow.escritura_pendiente
+        try:
+            return _ejecutar()
+        except DBAPIError as e:
+            reintentable = e.connection_invalidated and getattr(fn, 'idempotente', False) and not escritura_previa
+            if not reintentable:
+                raise
+            logging.warning(f"Conexión a la DB perdida en {getattr(fn, '__name__', fn)}; reintentando lectura.")
+            if uow is not None:
+                uow.descartar_conexion()
+            return _ejecutar()
+
+    if ES_SQLITE and SQLITE_PERFIL and getattr(fn, 'escritura', False):
+        ejecutor = _EJECUTOR_ESCRITURA
+    else:
+        ejecutor = _EJECUTOR_DB if uow is not None else _EJECUTOR_FONDO
+    return await _ejecutar_en(ejecutor, _tarea)
+
+def lectura_idempotente(fn):
+    """Marca fn(session, ...) como lectura pura: ejecutar_db puede reintentarla si la conexión cayó."""
+    fn.idempotente = True
+    return fn
+
+def escritura_serializada(fn):
+    """Marca fn(session, ...) como escritura con commit propio: en SQLite se ejecuta en la cola de escritura."""
+    fn.escritura = True
+    return fn
+
 def inicializar_db(engine=ENGINE): 
-    """Crea las tablas, y el usuario administrador si no existen."""
-    Base.metadata.create_all(bind=engine) 
+    """Crea las tablas, aplica las migraciones pendientes y el usuario administrador si no existen."""
+    from db_migrations import aplicar_migraciones
+    aplicar_migraciones(engine)
 
     Session = sessionmaker(bind=engine)
     with Session() as session:
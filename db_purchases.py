@@ -0,0 +1,146 @@
+import os
+from sqlalchemy import select, update, func, and_, exists, literal
+from db_models import Usuario, Producto, Key, Transaccion, escritura_serializada
+from db_stock import ajustar_contadores
+from db_ledger import TIPO_COMPRA
+from db_balance import mover_saldo, sentencia_saldo, sentencia_registro
+
+# =================================================================
+# Motor de Compras (asignación de keys sin contención + débito atómico)
+# =================================================================
+
+COMPRA_MAX_CANTIDAD = int(os.getenv('COMPRA_MAX_CANTIDAD', '100'))
+
+# Postgres: una sola sentencia. Las keys se reclaman con SKIP LOCKED para que los
+# compradores concurrentes del mismo producto tomen keys distintas en lugar de
+# esperar el mismo lock, y el saldo se debita una vez con db_balance.sentencia_saldo
+# como CTE (todo o nada: si no hay :cantidad keys libres no se debita ni se entrega
+# nada). La compra queda en el libro con db_balance.sentencia_registro, dentro de
+# la misma sentencia.
+def _sentencia_compra_postgres(telegram_id, producto_id, cantidad, detalle_prefijo):
+    prod = select(Producto.id, Producto.nombre, Producto.precio).where(
+        Producto.id == producto_id, Producto.eliminado_en.is_(None)
+    ).cte('prod')
+    key_libre = select(Key.id).where(
+        Key.producto_id == producto_id, Key.estado == 'available'
+    ).limit(cantidad).with_for_update(skip_locked=True).cte('key_libre')
+    disponibles = select(func.count()).select_from(key_libre).scalar_subquery()
+    total = prod.c.precio * cantidad
+
+    debito = sentencia_saldo(
+        -total, and_(Usuario.telegram_id == telegram_id, disponibles == cantidad), minimo=0
+    ).cte('debito')
+    hubo_debito = exists(select(debito.c.id))
+    entrega = update(Key).where(Key.id == key_libre.c.id, hubo_debito).values(
+        estado='used'
+    ).returning(Key.licencia).cte('entrega')
+    contadores = update(Producto).where(Producto.id == producto_id, hubo_debito).values(
+        available_count=Producto.available_count - cantidad, sold_count=Producto.sold_count + cantidad
+    ).returning(Producto.id).cte('contadores')
+    registro = sentencia_registro(
+        debito, TIPO_COMPRA, -total, producto_id=producto_id, detalle=literal(detalle_prefijo) + prod.c.nombre
+    ).returning(Transaccion.id).cte('registro')
+
+    return select(
+        select(prod.c.nombre).scalar_subquery().label('producto'),
+        select(prod.c.precio).scalar_subquery().label('precio'),
+        select(debito.c.saldo).scalar_subquery().label('saldo'),
+        select(func.array_agg(entrega.c.licencia)).scalar_subquery().label('licencias'),
+        disponibles.label('disponibles'),
+        select(Usuario.saldo).where(Usuario.telegram_id == telegram_id).scalar_subquery().label('saldo_actual'),
+        select(func.count()).select_from(contadores).scalar_subquery().label('contadores'),
+        select(func.count()).select_from(registro).scalar_subquery().label('registros'),
+    )
+
+def _detalle_prefijo(cantidad):
+    """Prefijo del concepto en el libro: '20 x ' para compras por lote, vacío para una sola key."""
+    return f"{cantidad} x " if cantidad > 1 else ''
+
+def _comprar_postgres(session_db, telegram_id, producto_id, cantidad):
+    fila = session_db.execute(
+        _sentencia_compra_postgres(telegram_id, producto_id, cantidad, _detalle_prefijo(cantidad))
+    ).one()
+
+    if fila.producto is None or fila.saldo_actual is None:
+        session_db.rollback()
+        return 'no_encontrado', None
+    if fila.disponibles < cantidad:
+        session_db.rollback()
+        return 'agotado', {'producto': fila.producto, 'disponibles': fila.disponibles}
+    if not fila.licencias:
+        session_db.rollback()
+        return 'saldo_insuficiente', fila.saldo_actual
+
+    session_db.commit()
+    return 'ok', {
+        'producto': fila.producto, 'precio': fila.precio, 'cantidad': cantidad,
+        'total': fila.precio * cantidad, 'saldo': fila.saldo, 'licencias': list(fila.licencias),
+    }
+
+def _comprar_sqlite(session_db, telegram_id, producto_id, cantidad):
+    # SQLite no tiene SKIP LOCKED: la escritura se serializa con el lock de la base,
+    # así que se escribe primero (débito) para tomar el lock de escritura desde el inicio.
+    producto = session_db.query(Producto.nombre, Producto.precio).filter(
+        Producto.id == producto_id, Producto.eliminado_en.is_(None)
+    ).first()
+    if producto is None:
+        return 'no_encontrado', None
+
+    total = producto.precio * cantidad
+    debito = mover_saldo(session_db, -total, TIPO_COMPRA, telegram_id=telegram_id, minimo=0,
+                         producto_id=producto_id, detalle=_detalle_prefijo(cantidad) + producto.nombre)
+    if debito is None:
+        saldo_actual = session_db.query(Usuario.saldo).filter(Usuario.telegram_id == telegram_id).scalar()
+        session_db.rollback()
+        if saldo_actual is None:
+            return 'no_encontrado', None
+        return 'saldo_insuficiente', saldo_actual
+
+    keys_libres = (
+        select(Key.id)
+        .where(Key.producto_id == producto_id, Key.estado == 'available')
+        .limit(cantidad)
+    )
+    licencias = session_db.execute(
+        update(Key)
+        .where(Key.id.in_(keys_libres), Key.estado == 'available')
+        .values(estado='used')
+        .returning(Key.licencia)
+    ).scalars().all()
+    if len(licencias) < cantidad:
+        session_db.rollback()
+        return 'agotado', {'producto': producto.nombre, 'disponibles': len(licencias)}
+
+    ajustar_contadores(session_db, producto_id, disponibles=-cantidad, vendidas=cantidad)
+    session_db.commit()
+    return 'ok', {
+        'producto': producto.nombre, 'precio': producto.precio, 'cantidad': cantidad,
+        'total': total, 'saldo': debito.saldo, 'licencias': licencias,
+    }
+
+@escritura_serializada
+def comprar_keys(session_db, telegram_id, producto_id, cantidad):
+    """Compra 'cantidad' keys del producto con un solo débito, en una transacción (todo o nada).
+
+    Retorna (estado, datos) con estado 'ok', 'no_encontrado', 'agotado' o 'saldo_insuficiente'.
+    En 'ok', datos trae 'licencias' (lista); en 'agotado', 'producto' y 'disponibles'.
+    """
+    if not 1 <= cantidad <= COMPRA_MAX_CANTIDAD:
+        raise ValueError(f"Cantidad fuera de rango (1-{COMPRA_MAX_CANTIDAD}): {cantidad}")
+    if session_db.get_bind().dialect.name == 'postgresql':
+        return _comprar_postgres(session_db, telegram_id, producto_id, cantidad)
+    return _comprar_sqlite(session_db, telegram_id, producto_id, cantidad)
+
+@escritura_serializada
+def comprar_key(session_db, telegram_id, producto_id):
+    """Compra una key del producto para el usuario en una transacción.
+
+    Retorna (estado, datos) con estado 'ok', 'no_encontrado', 'agotado' o 'saldo_insuficiente'.
+    """
+    estado, datos = comprar_keys(session_db, telegram_id, producto_id, 1)
+    if estado == 'ok':
+        return estado, {'producto': datos['producto'], 'precio': datos['precio'],
+                        'saldo': datos['saldo'], 'licencia': datos['licencias'][0]}
+    if estado == 'agotado':
+        return estado, datos['producto']
+    return estado, datos
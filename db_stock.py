@@ -0,0 +1,161 @@
+import os
+import sys
+import logging
+from datetime import datetime
+from sqlalchemy import func, case, select, delete
+from db_models import Producto, Key, get_session, lectura_idempotente, escritura_serializada
+from catalog_cache import incrementar_version_catalogo
+
+# =================================================================
+# Consulta de Stock (contadores desnormalizados en 'productos')
+# =================================================================
+
+@lectura_idempotente
+def productos_con_stock(session_db, categoria=None):
+    """Retorna [(producto, stock)] del catálogo o de una categoría en una sola consulta."""
+    query = session_db.query(Producto).filter(Producto.eliminado_en.is_(None))
+    if categoria is not None:
+        query = query.filter(Producto.categoria == categoria)
+    return [(producto, producto.available_count) for producto in query.order_by(Producto.id).all()]
+
+@lectura_idempotente
+def stock_disponible(session_db, categoria=None):
+    """Retorna {producto_id: stock} del catálogo completo o de una categoría."""
+    query = session_db.query(Producto.id, Producto.available_count).filter(Producto.eliminado_en.is_(None))
+    if categoria is not None:
+        query = query.filter(Producto.categoria == categoria)
+    return dict(query.all())
+
+# =================================================================
+# Mantenimiento de Contadores
+# =================================================================
+
+def ajustar_contadores(session_db, producto_id, disponibles=0, vendidas=0):
+    """Suma deltas a los contadores del producto dentro de la transacción actual (sin commit)."""
+    session_db.query(Producto).filter(Producto.id == producto_id).update(
+        {
+            Producto.available_count: Producto.available_count + disponibles,
+            Producto.sold_count: Producto.sold_count + vendidas,
+        },
+        synchronize_session=False
+    )
+
+def contar_keys(session_db, producto_ids):
+    """Recuenta desde 'keys' los productos dados. Retorna {producto_id: (disponibles, vendidas)}."""
+    filas = session_db.query(
+        Key.producto_id,
+        func.sum(case((Key.estado == 'available', 1), else_=0)),
+        func.sum(case((Key.estado == 'used', 1), else_=0)),
+    ).filter(Key.producto_id.in_(producto_ids)).group_by(Key.producto_id).all()
+    return {pid: (int(disp or 0), int(vend or 0)) for pid, disp, vend in filas}
+
+# Productos por transacción del recuento: cada lote queda bloqueado solo mientras
+# se cuentan sus keys, y entre lotes las compras siguen (también en la cola de SQLite).
+RECONCILE_CHUNK_SIZE = int(os.getenv('RECONCILE_CHUNK_SIZE', '1'))
+
+@lectura_idempotente
+def lotes_de_productos(session_db, tamano=RECONCILE_CHUNK_SIZE):
+    """Retorna los ids de todos los productos en lotes de 'tamano' para reconciliar_lote."""
+    ids = [pid for (pid,) in session_db.query(Producto.id).order_by(Producto.id).all()]
+    return [ids[i:i + tamano] for i in range(0, len(ids), tamano)]
+
+@escritura_serializada
+def reconciliar_lote(session_db, producto_ids, corregir=True):
+    """Recalcula desde 'keys' los contadores del lote. Retorna [(id, nombre, (antes), (después))] con la deriva."""
+    # Primero se bloquean los productos y después se cuenta: toda escritura sobre 'keys'
+    # actualiza el contador de su producto en la misma transacción, así que una que siga
+    # en curso queda esperando el lock y suma su delta sobre el recuento ya corregido.
+    productos = session_db.query(Producto).filter(Producto.id.in_(producto_ids)).order_by(Producto.id).with_for_update().all()
+    reales = contar_keys(session_db, producto_ids)
+    deriva = []
+    for producto in productos:
+        actual = (producto.available_count, producto.sold_count)
+        esperado = reales.get(producto.id, (0, 0))
+        if actual != esperado:
+            deriva.append((producto.id, producto.nombre, actual, esperado))
+            if corregir:
+                producto.available_count, producto.sold_count = esperado
+
+    # El fin de la transacción libera los locks del lote.
+    if corregir:
+        session_db.commit()
+    else:
+        session_db.rollback()
+    for pid, nombre, actual, esperado in deriva:
+        logging.warning(f"Deriva de stock en producto {pid} ({nombre}): {actual} -> {esperado}")
+    return deriva
+
+def reconciliar_contadores(session_db, corregir=True):
+    """Reconcilia todos los productos, un lote por transacción. Retorna la deriva de todos los lotes."""
+    deriva = []
+    for producto_ids in lotes_de_productos(session_db):
+        deriva += reconciliar_lote(session_db, producto_ids, corregir)
+    return deriva
+
+# =================================================================
+# Baja de Productos (borrado lógico + purga de keys por bloques)
+# =================================================================
+# Borrar de una vez todas las keys de un producto grande retiene los locks
+# (o el único escritor de SQLite) el tiempo suficiente para frenar las compras
+# de todo el catálogo. La baja marca el producto y cada bloque de keys se borra
+# en su propia transacción corta.
+
+PURGE_CHUNK_SIZE = int(os.getenv('PURGE_CHUNK_SIZE', '5000'))
+
+@escritura_serializada
+def marcar_producto_eliminado(session_db, producto_id):
+    """Da de baja el producto (sale del catálogo al confirmar). Retorna (nombre, keys_pendientes) o None.
+
+    Es idempotente: sobre un producto ya dado de baja retorna sus keys pendientes para retomar la purga.
+    """
+    producto = session_db.query(Producto).filter(Producto.id == producto_id).with_for_update().first()
+    if producto is None:
+        return None
+    if producto.eliminado_en is None:
+        producto.eliminado_en = datetime.now()
+        incrementar_version_catalogo(session_db)
+    resultado = (producto.nombre, producto.available_count + producto.sold_count)
+    session_db.commit()
+    return resultado
+
+@escritura_serializada
+def purgar_keys(session_db, producto_id, tamano_bloque=PURGE_CHUNK_SIZE):
+    """Borra un bloque de keys de un producto dado de baja y ajusta sus contadores. Retorna las borradas."""
+    bloque = select(Key.id).where(Key.producto_id == producto_id).limit(tamano_bloque)
+    estados = session_db.execute(
+        delete(Key).where(Key.id.in_(bloque)).returning(Key.estado)
+    ).scalars().all()
+    if estados:
+        disponibles = sum(1 for estado in estados if estado == 'available')
+        ajustar_contadores(session_db, producto_id, disponibles=-disponibles, vendidas=disponibles - len(estados))
+    session_db.commit()
+    return len(estados)
+
+@lectura_idempotente
+def productos_pendientes_de_purga(session_db):
+    """Retorna [(id, nombre, keys_pendientes)] de los productos dados de baja que aún no se borraron."""
+    return [tuple(fila) for fila in session_db.query(
+        Producto.id, Producto.nombre, Producto.available_count + Producto.sold_count
+    ).filter(Producto.eliminado_en.isnot(None)).order_by(Producto.id).all()]
+
+@escritura_serializada
+def eliminar_producto_purgado(session_db, producto_id):
+    """Borra la fila del producto dado de baja una vez que ya no tiene keys. Retorna True si se borró."""
+    borrados = session_db.query(Producto).filter(
+        Producto.id == producto_id,
+        Producto.eliminado_en.isnot(None),
+        ~session_db.query(Key.id).filter(Key.producto_id == producto_id).exists()
+    ).delete(synchronize_session=False)
+    session_db.commit()
+    return bool(borrados)
+
+
+if __name__ == '__main__':
+    # Uso: python db_stock.py [--solo-reportar]
+    solo_reportar = '--solo-reportar' in sys.argv
+    with get_session() as session:
+        deriva = reconciliar_contadores(session, corregir=not solo_reportar)
+    if not deriva:
+        print("Contadores de stock consistentes.")
+    for pid, nombre, actual, esperado in deriva:
+        print(f"Producto {pid} ({nombre}): disponibles/vendidas {actual} -> {esperado}")
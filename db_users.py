@@ -0,0 +1,36 @@
+from sqlalchemy import and_
+from db_models import Usuario, lectura_idempotente
+
+# =================================================================
+# Listado de Socios (paginación por keyset sobre usuarios.id)
+# =================================================================
+
+SOCIOS_POR_PAGINA = 10
+
+def _filtro_prefijo(session_db, prefijo):
+    """Filtro 'username empieza por prefijo' que puede resolverse con el índice de username."""
+    condicion = Usuario.username.startswith(prefijo, autoescape=True)
+    if session_db.get_bind().dialect.name == 'sqlite':
+        # LIKE en SQLite no usa índices; el rango sobre la colación BINARY sí.
+        condicion = and_(Usuario.username >= prefijo, Usuario.username < prefijo + '\U0010ffff', condicion)
+    return condicion
+
+@lectura_idempotente
+def pagina_usuarios(session_db, despues_de=None, antes_de=None, prefijo=None, limite=SOCIOS_POR_PAGINA):
+    """Retorna (usuarios, hay_anterior, hay_siguiente) de una página ordenada por id.
+
+    despues_de/antes_de son el último/primer id de la página vecina; el costo no depende del total de filas.
+    """
+    query = session_db.query(Usuario)
+    if prefijo:
+        query = query.filter(_filtro_prefijo(session_db, prefijo))
+
+    if antes_de is not None:
+        filas = query.filter(Usuario.id < antes_de).order_by(Usuario.id.desc()).limit(limite + 1).all()
+        hay_anterior = len(filas) > limite
+        return list(reversed(filas[:limite])), hay_anterior, True
+
+    if despues_de is not None:
+        query = query.filter(Usuario.id > despues_de)
+    filas = query.order_by(Usuario.id).limit(limite + 1).all()
+    return filas[:limite], despues_de is not None, len(filas) > limite
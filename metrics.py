@@ -0,0 +1,230 @@
+import os
+import sys
+import time
+import bisect
+import logging
+import threading
+from functools import wraps
+from aiohttp import web
+from sqlalchemy import event
+from telegram.ext import ConversationHandler, ApplicationHandlerStop
+from db_models import ENGINE, unidad_de_trabajo_actual, observar_checkouts
+
+logger = logging.getLogger(__name__)
+
+# =================================================================
+# Métricas (histogramas de latencia y contadores en formato Prometheus)
+# =================================================================
+# Cada callback registrado se envuelve para medir su latencia y contar sus
+# excepciones por bot, handler y estado de ConversationHandler. Las sentencias
+# SQL se miden con eventos del engine y la espera de cada checkout, en el pool.
+# Todo se expone en GET /metrics: en el servidor del webhook, o en METRICS_PORT
+# cuando los bots usan polling.
+
+METRICS_PORT = os.getenv('METRICS_PORT', '')
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '0.0.0.0')
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_SENTENCIAS = (1, 2, 5, 10, 20, 50, 100)
+
+class Histograma:
+    """Histograma acumulativo por combinación de etiquetas (seguro entre hilos)."""
+
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas, buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *valores_etiquetas):
+        with self._lock:
+            serie = self._series.get(valores_etiquetas)
+            if serie is None:
+                serie = self._series[valores_etiquetas] = [[0] * len(self.buckets), 0.0, 0]
+            indice = bisect.bisect_left(self.buckets, valor)
+            if indice < len(self.buckets):
+                serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def exponer(self):
+        with self._lock:
+            series = {k: (list(v[0]), v[1], v[2]) for k, v in self._series.items()}
+        for valores, (cuentas, suma, total) in sorted(series.items()):
+            acumulado = 0
+            for limite, cuenta in zip(self.buckets, cuentas):
+                acumulado += cuenta
+                yield f"{self.nombre}_bucket{_etiquetas(self.etiquetas, valores, le=limite)} {acumulado}"
+            yield f"{self.nombre}_bucket{_etiquetas(self.etiquetas, valores, le='+Inf')} {total}"
+            yield f"{self.nombre}_sum{_etiquetas(self.etiquetas, valores)} {suma}"
+            yield f"{self.nombre}_count{_etiquetas(self.etiquetas, valores)} {total}"
+
+class Contador:
+    """Contador monótono por combinación de etiquetas (seguro entre hilos)."""
+
+    tipo = 'counter'
+
+    def __init__(self, nombre, ayuda, etiquetas):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, *valores_etiquetas, cantidad=1):
+        with self._lock:
+            self._series[valores_etiquetas] = self._series.get(valores_etiquetas, 0) + cantidad
+
+    def total(self):
+        with self._lock:
+            return sum(self._series.values())
+
+    def exponer(self):
+        with self._lock:
+            series = dict(self._series)
+        for valores, total in sorted(series.items()):
+            yield f"{self.nombre}{_etiquetas(self.etiquetas, valores)} {total}"
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _etiquetas(nombres, valores, **extra):
+    pares = list(zip(nombres, valores)) + list(extra.items())
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{n}="{_escapar(v)}"' for n, v in pares) + '}'
+
+LATENCIA_HANDLER = Histograma(
+    'bot_handler_duration_seconds', 'Latencia de cada callback de handler.', ('bot', 'handler', 'estado'))
+ERRORES_HANDLER = Contador(
+    'bot_handler_errors_total', 'Excepciones no controladas por callback de handler.', ('bot', 'handler', 'estado'))
+SENTENCIAS_UPDATE = Histograma(
+    'bot_update_sql_statements', 'Sentencias SQL ejecutadas por update.', ('bot',), BUCKETS_SENTENCIAS)
+DURACION_SQL_UPDATE = Histograma(
+    'bot_update_sql_duration_seconds', 'Tiempo total en sentencias SQL por update.', ('bot',))
+DURACION_SENTENCIA = Histograma(
+    'db_statement_duration_seconds', 'Duración de cada sentencia SQL por tipo.', ('operacion',))
+ESPERA_CHECKOUT = Histograma(
+    'db_pool_checkout_seconds', 'Espera por una conexión del pool en cada checkout.', ())
+
+METRICAS = [LATENCIA_HANDLER, ERRORES_HANDLER, SENTENCIAS_UPDATE, DURACION_SQL_UPDATE, DURACION_SENTENCIA, ESPERA_CHECKOUT]
+
+def exponer_metricas():
+    """Retorna todas las métricas en el formato de texto de Prometheus."""
+    lineas = []
+    for metrica in METRICAS:
+        lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+        lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+        lineas.extend(metrica.exponer())
+    return '\n'.join(lineas) + '\n'
+
+# --- Sentencias SQL (eventos del engine) ---
+@event.listens_for(ENGINE, 'before_cursor_execute')
+def _inicio_sentencia(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._inicio_metricas = time.perf_counter()
+
+@event.listens_for(ENGINE, 'after_cursor_execute')
+def _fin_sentencia(conn, cursor, statement, parameters, context, executemany):
+    inicio = getattr(context, '_inicio_metricas', None)
+    if inicio is None:
+        return
+    segundos = time.perf_counter() - inicio
+    operacion = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTRA'
+    DURACION_SENTENCIA.observar(segundos, operacion)
+    uow = unidad_de_trabajo_actual()
+    if uow is not None:
+        uow.segundos_sql += segundos
+
+# --- Checkouts del Pool (medidos por db_models.PoolMedido) ---
+observar_checkouts(ESPERA_CHECKOUT.observar)
+
+def registrar_update(bot, uow):
+    """Registra las sentencias SQL y su duración total para un update terminado."""
+    SENTENCIAS_UPDATE.observar(uow.consultas, bot)
+    DURACION_SQL_UPDATE.observar(uow.segundos_sql, bot)
+
+# --- Instrumentación de Handlers ---
+def _nombre_estado(callback, estado):
+    """Nombre de la constante de estado (p. ej. ADJUST_AMOUNT) en el módulo del callback, o su valor."""
+    modulo = sys.modules.get(getattr(callback, '__module__', ''))
+    nombres = [n for n, v in vars(modulo).items() if n.isupper() and type(v) is type(estado) and v == estado] if modulo else []
+    return nombres[0] if len(nombres) == 1 else str(estado)
+
+def _envolver(handler, bot, estado):
+    callback = handler.callback
+    nombre = getattr(callback, '__name__', repr(callback))
+
+    @wraps(callback)
+    async def _medido(update, context):
+        inicio = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            ERRORES_HANDLER.incrementar(bot, nombre, estado)
+            raise
+        finally:
+            LATENCIA_HANDLER.observar(time.perf_counter() - inicio, bot, nombre, estado)
+
+    handler.callback = _medido
+
+def instrumentar_aplicacion(application, bot):
+    """Envuelve todos los handlers registrados (incluidos los estados de cada ConversationHandler)."""
+    application.nombre_metricas = bot
+    for grupo in application.handlers.values():
+        for handler in grupo:
+            if isinstance(handler, ConversationHandler):
+                for h in handler.entry_points:
+                    _envolver(h, bot, 'entrada')
+                for estado, handlers in handler.states.items():
+                    for h in handlers:
+                        _envolver(h, bot, _nombre_estado(h.callback, estado))
+                for h in handler.fallbacks:
+                    _envolver(h, bot, 'fallback')
+            else:
+                _envolver(handler, bot, '')
+
+    post_init, post_shutdown = application.post_init, application.post_shutdown
+
+    async def _post_init(app):
+        if post_init:
+            await post_init(app)
+        await iniciar_servidor_metricas()
+
+    async def _post_shutdown(app):
+        await detener_servidor_metricas()
+        if post_shutdown:
+            await post_shutdown(app)
+
+    application.post_init = _post_init
+    application.post_shutdown = _post_shutdown
+
+# --- Endpoint HTTP ---
+async def servir_metricas(request: web.Request) -> web.Response:
+    return web.Response(text=exponer_metricas(), content_type='text/plain', charset='utf-8')
+
+_servidor = None
+
+async def iniciar_servidor_metricas():
+    """Sirve /metrics en METRICS_PORT (modo polling). Sin METRICS_PORT, o si ya está activo, no hace nada."""
+    global _servidor
+    if not METRICS_PORT or _servidor is not None:
+        return
+    app_web = web.Application()
+    app_web.router.add_get('/metrics', servir_metricas)
+    _servidor = web.AppRunner(app_web)
+    await _servidor.setup()
+    await web.TCPSite(_servidor, METRICS_LISTEN, int(METRICS_PORT)).start()
+    logger.info(f"Métricas disponibles en {METRICS_LISTEN}:{METRICS_PORT}/metrics")
+
+async def detener_servidor_metricas():
+    global _servidor
+    if _servidor is not None:
+        servidor, _servidor = _servidor, None
+        await servidor.cleanup()
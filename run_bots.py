@@ -0,0 +1,74 @@
+import os
+import asyncio
+import logging
+import resource
+from telegram import Update
+import bot_main
+import bot_admin
+from db_models import ENGINE
+from webhook_server import modo_webhook, ejecutar_webhook, esperar_parada
+
+# =================================================================
+# Ejecutor Único: ambos bots en un proceso y un event loop
+# =================================================================
+# Comparte un solo ENGINE (y su pool de conexiones) entre bot_main y bot_admin,
+# en lugar de dos intérpretes con dos pools y dos inicializaciones de la DB.
+
+logger = logging.getLogger(__name__)
+
+def memoria_actual_mb():
+    """Memoria residente actual del proceso, de /proc/self/statm (None fuera de Linux)."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError):
+        return None
+
+def registrar_recursos(etapa):
+    """Registra la memoria actual y máxima del proceso y el estado del pool de conexiones."""
+    actual_mb = memoria_actual_mb()
+    maxima_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    actual = f"{actual_mb:.1f} MB" if actual_mb is not None else "n/d"
+    logger.info(f"[{etapa}] Memoria: {actual} (máx {maxima_mb:.1f} MB) | Pool DB: {ENGINE.pool.status()}")
+
+async def ejecutar_polling(aplicaciones):
+    """Inicia polling para todas las Applications y las detiene limpiamente al recibir una señal."""
+    iniciadas = []
+    try:
+        for application in aplicaciones.values():
+            await application.initialize()
+            iniciadas.append(application)
+            if application.post_init:
+                await application.post_init(application)
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            await application.start()
+
+        registrar_recursos("bots iniciados")
+        await esperar_parada()
+    finally:
+        for application in reversed(iniciadas):
+            if application.updater.running:
+                await application.updater.stop()
+            if application.running:
+                await application.stop()
+            await application.shutdown()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+        registrar_recursos("bots detenidos")
+
+def main() -> None:
+    """Ejecuta el bot principal y el administrador en el mismo proceso."""
+    aplicaciones = {
+        'main': bot_main.crear_aplicacion(),
+        'admin': bot_admin.crear_aplicacion(),
+    }
+
+    logger.info("Iniciando BOT PRINCIPAL y BOT ADMINISTRADOR en un solo proceso...")
+    if modo_webhook():
+        asyncio.run(ejecutar_webhook(aplicaciones, int(os.getenv('PORT', '8080'))))
+    else:
+        asyncio.run(ejecutar_polling(aplicaciones))
+
+
+if __name__ == '__main__':
+    main()
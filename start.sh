@@ -4,15 +4,12 @@ echo "========================================="
 echo "  INICIANDO SERVICIOS DE TELEGRAM BOT    "
 echo "========================================="
 
-# 1. Inicia el Bot Principal en segundo plano usando nohup (persistencia)
-echo "-> Iniciando Bot Principal (bot_main.py) con nohup..."
-nohup python bot_main.py > /dev/null 2>&1 &
-
-# 2. Inicia el Bot Administrador en segundo plano usando nohup (persistencia)
-echo "-> Iniciando Bot Administrador (bot_admin.py) con nohup..."
-nohup python bot_admin.py > /dev/null 2>&1 &
-
-# 3. CRÍTICO: Mantener el contenedor VIVO
-# Este comando corre indefinidamente y asegura que Railway no cierre el servicio.
-echo "-> Proceso de persistencia activado (tail -f /dev/null)..."
-tail -f /dev/null
+# 0. Aplica migraciones pendientes (idempotente) antes de levantar los bots
+echo "-> Aplicando migraciones de base de datos (db_migrations.py)..."
+python db_migrations.py || exit 1
+
+# 1. Inicia ambos bots (principal y administrador) en un solo proceso.
+# Comparten event loop, engine y pool de conexiones; al ser el proceso en primer
+# plano, mantiene el contenedor vivo y recibe SIGTERM para un cierre limpio.
+echo "-> Iniciando Bot Principal y Bot Administrador (run_bots.py)..."
+exec python run_bots.py
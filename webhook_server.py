@@ -0,0 +1,99 @@
+import os
+import hmac
+import signal
+import asyncio
+import logging
+from aiohttp import web
+from telegram import Update
+from db_models import estadisticas_pool
+from metrics import servir_metricas
+
+logger = logging.getLogger(__name__)
+
+# =================================================================
+# Modo Webhook (servidor HTTP embebido con aiohttp)
+# =================================================================
+# BOT_MODE=webhook activa este modo; por defecto los bots usan polling.
+# Telegram envía cada update a WEBHOOK_URL/webhook/<bot> con la cabecera
+# X-Telegram-Bot-Api-Secret-Token, que se compara con WEBHOOK_SECRET.
+
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+CABECERA_SECRETO = 'X-Telegram-Bot-Api-Secret-Token'
+
+def modo_webhook() -> bool:
+    return BOT_MODE == 'webhook'
+
+def crear_app_web(aplicaciones, secreto=WEBHOOK_SECRET) -> web.Application:
+    """App aiohttp con POST /webhook/{bot}, GET /healthz y GET /metrics para las Applications dadas ({nombre: app})."""
+
+    async def recibir_update(request: web.Request) -> web.Response:
+        application = aplicaciones.get(request.match_info['bot'])
+        if application is None:
+            raise web.HTTPNotFound()
+        if not hmac.compare_digest(request.headers.get(CABECERA_SECRETO, ''), secreto):
+            raise web.HTTPForbidden()
+        try:
+            update = Update.de_json(await request.json(), application.bot)
+        except Exception:
+            raise web.HTTPBadRequest()
+        await application.update_queue.put(update)
+        return web.Response()
+
+    async def salud(request: web.Request) -> web.Response:
+        estado = {nombre: app.running for nombre, app in aplicaciones.items()}
+        return web.json_response(
+            {'status': 'ok' if all(estado.values()) else 'starting', 'bots': estado, 'pool': estadisticas_pool()},
+            status=200 if all(estado.values()) else 503
+        )
+
+    app_web = web.Application()
+    app_web.router.add_post('/webhook/{bot}', recibir_update)
+    app_web.router.add_get('/healthz', salud)
+    app_web.router.add_get('/metrics', servir_metricas)
+    return app_web
+
+async def esperar_parada():
+    """Bloquea hasta recibir SIGINT o SIGTERM."""
+    parada = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for senal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(senal, parada.set)
+    await parada.wait()
+
+async def ejecutar_webhook(aplicaciones, puerto):
+    """Inicia las Applications, registra sus webhooks y sirve HTTP hasta recibir una señal de parada."""
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        raise ValueError("Error: BOT_MODE=webhook requiere WEBHOOK_URL y WEBHOOK_SECRET.")
+
+    iniciadas, runner = [], None
+    try:
+        for nombre, application in aplicaciones.items():
+            await application.initialize()
+            iniciadas.append(application)
+            if application.post_init:
+                await application.post_init(application)
+            await application.start()
+            await application.bot.set_webhook(
+                url=f"{WEBHOOK_URL}/webhook/{nombre}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES
+            )
+
+        runner = web.AppRunner(crear_app_web(aplicaciones))
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_LISTEN, puerto).start()
+        logger.info(f"Webhook escuchando en {WEBHOOK_LISTEN}:{puerto} para {', '.join(aplicaciones)}")
+
+        await esperar_parada()
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+        for application in reversed(iniciadas):
+            if application.running:
+                await application.stop()
+            await application.shutdown()
+            if application.post_shutdown:
+                await application.post_shutdown(application)